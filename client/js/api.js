@@ -158,6 +158,18 @@ export async function createCommit(repoId, message, files) {
     return handleResponse(response);
 }
 
+export async function getCommits(repoId, { limit = 30, before, ref } = {}) {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (before) params.set('before', before);
+    if (ref) params.set('ref', ref);
+    const response = await fetch(`${API_BASE}/repos/${repoId}/commits?${params}`, {
+        headers: {
+            'Authorization': `Bearer ${localStorage.getItem('token')}`
+        }
+    });
+    return handleResponse(response);
+}
+
 export async function switchBranch(repoId, branchName) {
     const response = await fetch(`${API_BASE}/repos/${repoId}/checkout`, {
         method: 'POST',
@@ -1,24 +1,53 @@
 // commits.js
 import { getCommits } from './api.js';
 
-document.addEventListener("DOMContentLoaded", async () => {
-  const commitList = document.querySelector(".commit-list");
-  
-  try {
-    const commits = await getCommits();
-    
-    if (commits && commits.length > 0) {
-      commitList.innerHTML = commits.map(commit => `
+function renderCommit(commit) {
+  return `
         <div class="commit-item">
           <h3>${commit.message}</h3>
           <p class="commit-hash">${commit.hash}</p>
           <div class="commit-meta">
-            <span>${commit.author}</span>
-            <span>${commit.date}</span>
+            <span>${commit.timestamp}</span>
           </div>
         </div>
-      `).join('');
-    } else {
+      `;
+}
+
+document.addEventListener("DOMContentLoaded", async () => {
+  const commitList = document.querySelector(".commit-list");
+  const params = new URLSearchParams(window.location.search);
+  const repoId = params.get('id');
+  const ref = params.get('ref') || undefined;
+
+  if (!repoId) {
+    commitList.innerHTML = '<p>No repository selected</p>';
+    return;
+  }
+
+  // The endpoint returns one page at a time; next_cursor fetches the page after it
+  async function loadPage(before) {
+    const page = await getCommits(repoId, { before, ref });
+    commitList.querySelector('.load-more')?.remove();
+    commitList.insertAdjacentHTML('beforeend', page.items.map(renderCommit).join(''));
+    if (page.next_cursor) {
+      const button = document.createElement('button');
+      button.className = 'load-more';
+      button.textContent = 'Load more';
+      button.addEventListener('click', () => loadPage(page.next_cursor).catch(showLoadError));
+      commitList.appendChild(button);
+    }
+    return page;
+  }
+
+  function showLoadError(error) {
+    console.error("Error loading commits:", error);
+    commitList.insertAdjacentHTML('beforeend', '<p>Error loading commits</p>');
+  }
+
+  try {
+    commitList.innerHTML = '';
+    const page = await loadPage();
+    if (page.items.length === 0) {
       commitList.innerHTML = '<p>No commits found</p>';
     }
   } catch (error) {
@@ -26,4 +55,3 @@ document.addEventListener("DOMContentLoaded", async () => {
     commitList.innerHTML = '<p>Error loading commits</p>';
   }
 });
-
@@ -187,7 +187,7 @@ function showAddFileModal() {
 }
 
 function showEditFileModal(filename) {
-    authFetch(`/api/repos/${currentRepoId}/files/${filename}`)
+    authFetch(`/api/repos/${currentRepoId}/files/${filename}?encoding=utf-8`)
         .then(res => res.json())
         .then(data => {
             const filesSection = document.getElementById('files');
@@ -243,7 +243,7 @@ async function loadCommits() {
     commitsSection.innerHTML = '<div class="loading">Loading commits...</div>';
     
     try {
-        const response = await authFetch(`/api/repos/${currentRepoId}/commits`);
+        const response = await authFetch(`/api/repos/${currentRepoId}/commits?limit=30`);
         const data = await response.json();
         
         if (!response.ok) {
@@ -9,6 +9,9 @@ from server.routes import api
 from server.cache import cache
 from server.monitoring import initialize_monitoring
 from server.logger import init_logging
+from server.vcs import object_write_stats, lock_metrics
+from server.object_cache import object_cache
+from server.gc import GC_INTERVAL, garbage_collector
 
 def create_app(config=None):
     app = Flask(__name__)
@@ -31,6 +34,8 @@ def create_app(config=None):
     # Initialize extensions
     db.init_app(app)
     initialize_monitoring()
+    if GC_INTERVAL > 0:
+        garbage_collector.start()
     init_logging("logging_config.yml")
     init_error_handlers(app)
     
@@ -61,7 +66,10 @@ def create_app(config=None):
         """Health check endpoint"""
         return jsonify({
             'status': 'healthy',
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': datetime.utcnow().isoformat(),
+            'object_writes': object_write_stats.get_metrics(),
+            'object_cache': object_cache.stats(),
+            'locks': lock_metrics.get_metrics()
         })
     
     return app
@@ -0,0 +1,119 @@
+"""Streaming zip and tar.gz archives of a tree, built from the object store.
+
+Archives are generated file by file and yielded as they are compressed, so
+neither the archive nor any blob is ever held in memory whole. Every file
+gets the same fixed timestamp and mode, which makes an archive a function
+of its tree alone: a completed archive is kept under
+``cache/archives/<tree hash>.<format>`` and later downloads of the same tree
+are served from there.
+"""
+import os
+import tarfile
+import tempfile
+import zlib
+import zipfile
+
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar.gz': 'application/gzip',
+}
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+# Earliest timestamp a zip file can store (1980-01-01 00:00:00)
+ARCHIVE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ARCHIVE_MTIME = 315532800
+FILE_MODE = 0o644
+
+
+def archive_path(repo, tree, fmt):
+    return os.path.join(repo.repo_path, 'cache', 'archives', f"{tree}.{fmt}")
+
+
+class _ChunkSink:
+    """Write-only, unseekable file that collects what zipfile writes until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return b''.join(chunks)
+
+
+def _zip_chunks(repo, tree):
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, blob in repo.iter_tree(tree):
+            info = zipfile.ZipInfo(path, date_time=ARCHIVE_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = FILE_MODE << 16
+            with repo.open_object(blob) as stream:
+                # Sizes are written after the data, so an unknown size has to allow for zip64
+                force_zip64 = stream.size is None or stream.size > zipfile.ZIP64_LIMIT
+                with zf.open(info, 'w', force_zip64=force_zip64) as dest:
+                    while True:
+                        data = stream.read(ARCHIVE_CHUNK_SIZE)
+                        if not data:
+                            break
+                        dest.write(data)
+                        yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _tar_gz_chunks(repo, tree):
+    # The tar stream is written by hand so large files can be yielded piece by
+    # piece; tarfile.addfile copies a whole file before returning
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    total = 0
+    for path, blob in repo.iter_tree(tree):
+        with repo.open_object(blob) as stream:
+            info = tarfile.TarInfo(path)
+            info.size = stream.size if stream.size is not None else repo.object_size(blob)
+            info.mtime = ARCHIVE_MTIME
+            info.mode = FILE_MODE
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            total += len(header)
+            yield compressor.compress(header)
+            while True:
+                data = stream.read(ARCHIVE_CHUNK_SIZE)
+                if not data:
+                    break
+                total += len(data)
+                yield compressor.compress(data)
+        padding = -total % tarfile.BLOCKSIZE
+        total += padding
+        yield compressor.compress(tarfile.NUL * padding)
+    # End-of-archive marker, padded to a whole record
+    trailer = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    total += len(trailer)
+    trailer += tarfile.NUL * (-total % tarfile.RECORDSIZE)
+    yield compressor.compress(trailer)
+    yield compressor.flush()
+
+
+def iter_archive(repo, tree, fmt):
+    """Yield the bytes of an archive of a tree, storing it in the archive cache once complete.
+
+    If the consumer stops early the partial archive is discarded.
+    """
+    generate = _zip_chunks if fmt == 'zip' else _tar_gz_chunks
+    path = archive_path(repo, tree, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in generate(repo, tree):
+                if chunk:
+                    f.write(chunk)
+                    yield chunk
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
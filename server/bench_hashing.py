@@ -0,0 +1,53 @@
+"""Benchmark sequential versus parallel blob hashing for large commits.
+
+Builds a synthetic commit payload and times writing its tree into fresh
+repositories with different numbers of hashing threads. Run from the
+project root:
+
+    python -m server.bench_hashing [files] [file_size] [workers ...]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from server.vcs import GitRepository, HASH_WORKERS
+
+DEFAULT_FILES = 5000
+DEFAULT_FILE_SIZE = 32 * 1024
+
+
+def make_files(count, size):
+    files = []
+    for i in range(count):
+        content = os.urandom(size // 2).hex()
+        files.append({'name': f"dir{i % 50}/file{i}.txt", 'content': content})
+    return files
+
+
+def bench_hashing(files, worker_counts):
+    results = {}
+    tree_hashes = set()
+    for workers in worker_counts:
+        repo_path = tempfile.mkdtemp(prefix='vcs-bench-')
+        try:
+            repo = GitRepository.init(repo_path)
+            start = time.perf_counter()
+            tree_hashes.add(repo._create_tree(files, workers=workers))
+            results[workers] = time.perf_counter() - start
+        finally:
+            shutil.rmtree(repo_path)
+    if len(tree_hashes) != 1:
+        raise AssertionError(f"Tree hash depends on the number of workers: {tree_hashes}")
+    return results
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FILES
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_FILE_SIZE
+    worker_counts = [int(w) for w in sys.argv[3:]] or sorted({1, 2, 4, HASH_WORKERS})
+    print(f"Hashing {count} files of {size} bytes")
+    results = bench_hashing(make_files(count, size), worker_counts)
+    baseline = results[worker_counts[0]]
+    for workers, seconds in results.items():
+        print(f"{workers:3d} workers: {seconds:7.2f}s  ({baseline / seconds:.2f}x)")
@@ -0,0 +1,166 @@
+"""Line-by-line blame with an on-disk cache.
+
+The blame of a file at a commit is derived from the blame of the same file
+at the commit's parents: lines the diff against a parent leaves unchanged
+inherit that parent's attribution, and the rest belong to the commit
+itself. If a commit did not touch the file it shares its parent's blame
+outright, and a parent is not consulted at all when no lines survived from
+it, so the walk stops as soon as every line is attributed.
+
+Every computed blame is cached under ``cache/blame/<commit>/`` keyed by a
+hash of the path, so blaming a newer commit costs one diff on top of the
+cached blame of its parent.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from .diff import MAX_DIFF_BYTES, diff_opcodes, is_binary, split_lines
+
+
+def _cache_path(repo, commit_hash, path):
+    return os.path.join(repo.repo_path, 'cache', 'blame', commit_hash,
+                        hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+
+def _load_cached(repo, commit_hash, path):
+    try:
+        with open(_cache_path(repo, commit_hash, path), 'r') as f:
+            runs = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    # Stored as [commit, line count] runs
+    lines = []
+    for commit, count in runs:
+        lines.extend([commit] * count)
+    return lines
+
+
+def _store_cached(repo, commit_hash, path, lines):
+    runs = []
+    for commit in lines:
+        if runs and runs[-1][0] == commit:
+            runs[-1][1] += 1
+        else:
+            runs.append([commit, 1])
+    cache_path = _cache_path(repo, commit_hash, path)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), prefix='tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(runs, f, separators=(',', ':'))
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _file_blob(repo, commit_hash, path):
+    entry = repo.lookup_path(repo._commit_tree(commit_hash), path)
+    return entry[1] if entry and entry[0] == 'blob' else None
+
+
+def _file_lines(repo, blob_hash, lines_by_blob):
+    lines = lines_by_blob.get(blob_hash)
+    if lines is None:
+        if (repo.object_size(blob_hash) or 0) > MAX_DIFF_BYTES:
+            raise ValueError('File is too large to blame')
+        with repo.open_object(blob_hash) as stream:
+            content = stream.read()
+        if is_binary(content):
+            raise ValueError('Cannot blame a binary file')
+        lines = lines_by_blob[blob_hash] = split_lines(content)
+    return lines
+
+
+def _introducing_commit(repo, commit_hash, path, blob):
+    """Follow history back from a commit for as long as the file keeps the same blob."""
+    while True:
+        for parent in repo.commit_parents(commit_hash):
+            if _file_blob(repo, parent, path) == blob:
+                commit_hash = parent
+                break
+        else:
+            return commit_hash
+
+
+def blame_lines(repo, commit_hash, path):
+    """Return, for each line of path at commit_hash, the hash of the commit that last changed it.
+
+    Raises ValueError if the file does not exist at that commit or is binary.
+    """
+    cached = _load_cached(repo, commit_hash, path)
+    if cached is not None:
+        return cached
+    blob = _file_blob(repo, commit_hash, path)
+    if blob is None:
+        raise ValueError(f"File {path} does not exist at {commit_hash}")
+
+    # Only commits that changed the file are blamed; the rest share the
+    # blame of the commit that introduced their version of it
+    origin = _introducing_commit(repo, commit_hash, path, blob)
+    results = {}
+    lines_by_blob = {}
+    pending = {}
+    stack = [(origin, blob)]
+    while stack:
+        commit, blob = stack[-1]
+        if commit in results:
+            stack.pop()
+            continue
+        if commit not in pending:
+            cached = _load_cached(repo, commit, path)
+            if cached is not None:
+                results[commit] = cached
+                stack.pop()
+                continue
+            lines = _file_lines(repo, blob, lines_by_blob)
+            # (parent origin, matching ranges) for each parent some lines survived from
+            sources = []
+            for parent in repo.commit_parents(commit):
+                parent_blob = _file_blob(repo, parent, path)
+                if parent_blob is None:
+                    continue
+                matches = [op for op in diff_opcodes(_file_lines(repo, parent_blob, lines_by_blob), lines)
+                           if op[0] == 'equal']
+                if matches:
+                    sources.append((_introducing_commit(repo, parent, path, parent_blob), parent_blob, matches))
+            pending[commit] = (len(lines), sources)
+            missing = [(source, source_blob) for source, source_blob, _ in sources if source not in results]
+            if missing:
+                stack.extend(missing)
+                continue
+
+        line_count, sources = pending.pop(commit)
+        attribution = [None] * line_count
+        for source, _, matches in sources:
+            source_lines = results[source]
+            for _, i1, i2, j1, j2 in matches:
+                for offset in range(i2 - i1):
+                    if attribution[j1 + offset] is None:
+                        attribution[j1 + offset] = source_lines[i1 + offset]
+        attribution = [attributed or commit for attributed in attribution]
+        _store_cached(repo, commit, path, attribution)
+        results[commit] = attribution
+        stack.pop()
+
+    if commit_hash != origin:
+        _store_cached(repo, commit_hash, path, results[origin])
+    return results[origin]
+
+
+def blame(repo, commit_hash, path):
+    """Blame a file at a commit, returning its lines with their commits and a summary of each commit."""
+    attribution = blame_lines(repo, commit_hash, path)
+    lines = _file_lines(repo, _file_blob(repo, commit_hash, path), {})
+    commits = {}
+    for commit in set(attribution):
+        commits[commit] = repo._commit_summary(commit, repo._read_commit(commit))
+    return {
+        'commit': commit_hash,
+        'path': path,
+        'lines': [{'line': number, 'commit': commit, 'content': content}
+                  for number, (commit, content) in enumerate(zip(attribution, lines), 1)],
+        'commits': commits
+    }
@@ -0,0 +1,124 @@
+"""Changed-path Bloom filters stored alongside the commit graph.
+
+For every commit in the commit graph, ``objects/info/commit-graph-bloom``
+holds a Bloom filter of the paths that differ between the commit and its
+first parent (or the empty tree for root commits), including every parent
+directory of a changed file. A path history walk tests each commit's
+filter first and only compares trees for the commits whose filter says the
+path may have changed.
+
+The file is a header followed by one variable-length record per commit, in
+commit-graph order:
+
+    filter length (2) | filter bits (filter length bytes)
+
+A filter length of ``TOO_MANY_CHANGES`` marks a commit that changed too
+many paths to be worth filtering, and always answers "maybe". Records are
+only ever appended, so the file can trail the graph after a crash; the
+missing records are computed again the next time the graph is opened.
+"""
+import hashlib
+import struct
+import threading
+
+from .record_file import AppendOnlyRecordFile
+
+BLOOM_SIGNATURE = b'CGBF'
+BLOOM_VERSION = 1
+HEADER = BLOOM_SIGNATURE + struct.pack('>I', BLOOM_VERSION)
+LENGTH = struct.Struct('>H')
+
+# Same trade-off as git: about 1% false positives at 10 bits per path
+BITS_PER_PATH = 10
+NUM_HASHES = 7
+MIN_FILTER_BYTES = 8
+MAX_CHANGED_PATHS = 512
+TOO_MANY_CHANGES = 0xffff
+
+_filters = {}
+_filters_lock = threading.Lock()
+
+
+def _bit_positions(path, bit_count):
+    digest = hashlib.blake2b(path.encode('utf-8'), digest_size=8).digest()
+    h1 = int.from_bytes(digest[:4], 'big')
+    h2 = int.from_bytes(digest[4:], 'big') | 1
+    return [(h1 + i * h2) % bit_count for i in range(NUM_HASHES)]
+
+
+def changed_paths(diff):
+    """Return the set of paths touched by a tree diff, with all their parent directories."""
+    paths = set()
+    for path, _, _ in diff:
+        while path and path not in paths:
+            paths.add(path)
+            path = path.rpartition('/')[0]
+    return paths
+
+
+def build_filter(paths):
+    """Return the filter bytes for a set of paths, or None if there are too many to filter."""
+    if len(paths) > MAX_CHANGED_PATHS:
+        return None
+    size = max(MIN_FILTER_BYTES, (len(paths) * BITS_PER_PATH + 7) // 8)
+    bits = bytearray(size)
+    for path in paths:
+        for position in _bit_positions(path, size * 8):
+            bits[position >> 3] |= 1 << (position & 7)
+    return bytes(bits)
+
+
+def filter_may_contain(bits, path):
+    """Check a filter for path; None (no usable filter) always answers True."""
+    if bits is None:
+        return True
+    positions = _bit_positions(path, len(bits) * 8)
+    return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+
+class ChangedPathFilters(AppendOnlyRecordFile):
+    """In-memory view of a commit-graph-bloom file, refreshed incrementally as it grows."""
+
+    HEADER = HEADER
+    DESCRIPTION = 'changed-path filter'
+    _views = _filters
+    _views_lock = _filters_lock
+
+    def _reset(self):
+        # Filter bytes for each graph position, or None for "too many changes"
+        self.filters = []
+
+    def _load(self, data):
+        offset = 0
+        # Ignore a partially written trailing record
+        while offset + LENGTH.size <= len(data):
+            length, = LENGTH.unpack_from(data, offset)
+            end = offset + LENGTH.size + (0 if length == TOO_MANY_CHANGES else length)
+            if end > len(data):
+                break
+            self.filters.append(None if length == TOO_MANY_CHANGES else data[offset + LENGTH.size:end])
+            offset = end
+        return offset
+
+    def __len__(self):
+        return len(self.filters)
+
+    def append(self, filters):
+        """Append the filters (bytes or None) for the next graph positions, in order.
+
+        Callers hold the commit-graph lock.
+        """
+        self.refresh()
+        records = []
+        for bits in filters:
+            if bits is None:
+                records.append(LENGTH.pack(TOO_MANY_CHANGES))
+            else:
+                records.append(LENGTH.pack(len(bits)) + bits)
+        self._append_records(records)
+
+    def may_contain(self, position, path):
+        """Check whether the commit at a graph position may have changed path."""
+        if position >= len(self.filters):
+            return True
+        return filter_may_contain(self.filters[position], path)
@@ -0,0 +1,91 @@
+"""Content-defined chunking for large blobs.
+
+Large files are cut into variable-size chunks at positions picked by a
+rolling gear hash over the content itself (FastCDC with normalized
+chunking), so an edit only moves the boundaries next to it. Successive
+versions of a large file then share almost all of their chunks, and only
+the chunks around the change are stored again.
+"""
+import hashlib
+import struct
+
+# Blobs at least this large are stored as chunk manifests
+CHUNK_THRESHOLD = 4 * 1024 * 1024
+
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+READ_SIZE = 1024 * 1024
+
+_MASK64 = 0xffffffffffffffff
+# Normalized chunking: a stricter mask before the average size and a looser
+# one after it pull chunk sizes towards the average.
+_AVG_BITS = AVG_CHUNK_SIZE.bit_length() - 1
+MASK_S = ((1 << (_AVG_BITS + 2)) - 1) << (64 - _AVG_BITS - 2)
+MASK_L = ((1 << (_AVG_BITS - 2)) - 1) << (64 - _AVG_BITS + 2)
+
+# Fixed pseudo-random gear table; changing it would change every chunk boundary
+GEAR = tuple(
+    struct.unpack('>Q', hashlib.sha256(b'vcs-gear-%d' % i).digest()[:8])[0]
+    for i in range(256)
+)
+
+
+def find_boundary(data, start, end):
+    """Return the length of the chunk that starts at data[start], looking no further than end."""
+    length = end - start
+    if length <= MIN_CHUNK_SIZE:
+        return length
+    if length > MAX_CHUNK_SIZE:
+        length = MAX_CHUNK_SIZE
+    normal = min(AVG_CHUNK_SIZE, length)
+    gear, mask_s, mask_l, mask64 = GEAR, MASK_S, MASK_L, _MASK64
+    h = 0
+    # Iterating over slices rather than indexing keeps the per-byte work
+    # down to the hash update itself
+    i = start + MIN_CHUNK_SIZE
+    for byte in data[i:start + normal]:
+        h = ((h << 1) + gear[byte]) & mask64
+        i += 1
+        if not h & mask_s:
+            return i - start
+    for byte in data[i:start + length]:
+        h = ((h << 1) + gear[byte]) & mask64
+        i += 1
+        if not h & mask_l:
+            return i - start
+    return length
+
+
+def iter_chunks(stream, prefix=b''):
+    """Yield content-defined chunks read incrementally from a file-like.
+
+    prefix holds bytes already read from the stream. At most
+    MAX_CHUNK_SIZE + READ_SIZE bytes are buffered at a time.
+    """
+    buffer = bytearray(prefix)
+    eof = False
+    while True:
+        while not eof and len(buffer) < MAX_CHUNK_SIZE:
+            data = stream.read(READ_SIZE)
+            if not data:
+                eof = True
+                break
+            buffer += data
+        if not buffer:
+            return
+        size = find_boundary(buffer, 0, len(buffer))
+        yield bytes(buffer[:size])
+        del buffer[:size]
+
+
+def chunk_bytes(data):
+    """Split an in-memory buffer into content-defined chunks."""
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        size = find_boundary(data, pos, len(data))
+        chunks.append(data[pos:pos + size])
+        pos += size
+    return chunks
@@ -0,0 +1,177 @@
+"""Commit-graph index for fast history queries.
+
+The graph lives in ``objects/info/commit-graph`` as a header followed by
+fixed-width records, one per commit, in the order commits were added:
+
+    commit hash (20) | tree hash (20) | parent 1 position (4) |
+    parent 2 position (4) | timestamp (8, float seconds) | generation (4)
+
+Parents always precede their children, so the file is only ever appended to
+and readers can pick up new records by reading past the size they last saw.
+Generation numbers (1 for root commits, otherwise one more than the highest
+parent) let ancestry and merge-base queries stop walking as soon as they
+reach commits too old to matter.
+"""
+import heapq
+import struct
+import threading
+
+from .record_file import AppendOnlyRecordFile
+
+GRAPH_SIGNATURE = b'CGPH'
+GRAPH_VERSION = 1
+HEADER = GRAPH_SIGNATURE + struct.pack('>I', GRAPH_VERSION)
+RECORD = struct.Struct('>20s20sIIdI')
+NO_PARENT = 0xffffffff
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+class CommitGraph(AppendOnlyRecordFile):
+    """In-memory view of a commit-graph file, refreshed incrementally as it grows."""
+
+    HEADER = HEADER
+    DESCRIPTION = 'commit-graph'
+    _views = _graphs
+    _views_lock = _graphs_lock
+
+    def _reset(self):
+        self.oids = []
+        self.trees = []
+        self.parents = []
+        self.timestamps = []
+        self.generations = []
+        self.positions = {}
+
+    def _load(self, data):
+        # Ignore a partially written trailing record
+        size = len(data) - len(data) % RECORD.size
+        for oid, tree, p1, p2, timestamp, generation in RECORD.iter_unpack(data[:size]):
+            oid = oid.hex()
+            self.positions.setdefault(oid, len(self.oids))
+            self.oids.append(oid)
+            self.trees.append(tree.hex())
+            self.parents.append(tuple(p for p in (p1, p2) if p != NO_PARENT))
+            self.timestamps.append(timestamp)
+            self.generations.append(generation)
+        return size
+
+    def __contains__(self, oid):
+        return oid in self.positions
+
+    def __len__(self):
+        return len(self.oids)
+
+    def append(self, commits):
+        """Append commits to the graph file.
+
+        commits is a list of (oid, tree, parent oids, timestamp) tuples in
+        parent-before-child order; every parent must already be in the graph
+        or earlier in the list. Commits already present are skipped.
+        Callers hold the commit-graph lock.
+        """
+        self.refresh()
+        records = []
+        pending = {}
+        for oid, tree, parent_oids, timestamp in commits:
+            if oid in self.positions or oid in pending:
+                continue
+            parent_positions = []
+            generation = 1
+            for parent in parent_oids[:2]:
+                if parent in self.positions:
+                    position = self.positions[parent]
+                    generation = max(generation, self.generations[position] + 1)
+                elif parent in pending:
+                    position, parent_generation = pending[parent]
+                    generation = max(generation, parent_generation + 1)
+                else:
+                    raise ValueError(f'Parent {parent} of {oid} is not in the commit graph')
+                parent_positions.append(position)
+            parent_positions += [NO_PARENT] * (2 - len(parent_positions))
+            pending[oid] = (len(self.oids) + len(records), generation)
+            records.append(RECORD.pack(bytes.fromhex(oid), bytes.fromhex(tree),
+                                       parent_positions[0], parent_positions[1], timestamp, generation))
+        self._append_records(records)
+
+    def parent_oids(self, oid):
+        return [self.oids[p] for p in self.parents[self.positions[oid]]]
+
+    def tree(self, oid):
+        return self.trees[self.positions[oid]]
+
+    def generation(self, oid):
+        return self.generations[self.positions[oid]]
+
+    def timestamp(self, oid):
+        return self.timestamps[self.positions[oid]]
+
+    def walk(self, start_oids):
+        """Yield commit hashes reachable from start_oids, newest first."""
+        heap = []
+        seen = set()
+        for oid in start_oids:
+            position = self.positions[oid]
+            if position not in seen:
+                seen.add(position)
+                heapq.heappush(heap, (-self.timestamps[position], -self.generations[position], position))
+        while heap:
+            _, _, position = heapq.heappop(heap)
+            yield self.oids[position]
+            for parent in self.parents[position]:
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(heap, (-self.timestamps[parent], -self.generations[parent], parent))
+
+    def is_ancestor(self, ancestor, descendant):
+        """Check whether ancestor is reachable from descendant (a commit is its own ancestor)."""
+        target = self.positions[ancestor]
+        min_generation = self.generations[target]
+        stack = [self.positions[descendant]]
+        seen = set(stack)
+        while stack:
+            position = stack.pop()
+            if position == target:
+                return True
+            for parent in self.parents[position]:
+                # Anything at or below the target's generation cannot lead back to it
+                if parent not in seen and (parent == target or self.generations[parent] > min_generation):
+                    seen.add(parent)
+                    stack.append(parent)
+        return False
+
+    def merge_bases(self, a, b):
+        """Return the best common ancestors of a and b.
+
+        Walks both histories at once, highest generation first, and stops once
+        every commit left to visit is already known to be below a common
+        ancestor.
+        """
+        PARENT1, PARENT2, STALE, RESULT = 1, 2, 4, 8
+        pos_a, pos_b = self.positions[a], self.positions[b]
+        if pos_a == pos_b:
+            return [a]
+        flags = {pos_a: PARENT1, pos_b: PARENT2}
+        heap = [(-self.generations[pos_a], pos_a), (-self.generations[pos_b], pos_b)]
+        heapq.heapify(heap)
+        results = []
+        while any(not flags[position] & STALE for _, position in heap):
+            _, position = heapq.heappop(heap)
+            current = flags[position] & (PARENT1 | PARENT2 | STALE)
+            if current & (PARENT1 | PARENT2) == PARENT1 | PARENT2:
+                if not flags[position] & RESULT and not current & STALE:
+                    flags[position] |= RESULT
+                    results.append(position)
+                current |= STALE
+            for parent in self.parents[position]:
+                old = flags.get(parent, 0)
+                if old & current == current:
+                    continue
+                flags[parent] = old | current
+                heapq.heappush(heap, (-self.generations[parent], parent))
+        # Drop results that are ancestors of other results
+        best = [r for r in results
+                if not any(other != r and self.is_ancestor(self.oids[r], self.oids[other]) for other in results)]
+        best.sort(key=lambda p: -self.generations[p])
+        return [self.oids[p] for p in best]
@@ -0,0 +1,227 @@
+"""Diff engine over repository trees and blobs.
+
+Tree-level changes come from GitRepository.diff_trees, which skips identical
+subtrees. Changed text files are compared line by line with Myers' O(ND)
+algorithm in its linear-space form, and the result is grouped into unified
+hunks with a configurable amount of context.
+"""
+
+DEFAULT_CONTEXT = 3
+
+# Files larger than this are reported as changed without a line diff
+MAX_DIFF_BYTES = 2 * 1024 * 1024
+BINARY_SNIFF_BYTES = 8000
+
+
+def is_binary(content):
+    return b'\0' in content[:BINARY_SNIFF_BYTES]
+
+
+def split_lines(content):
+    return content.decode('utf-8', errors='replace').splitlines(keepends=True)
+
+
+def _middle_snake(a, b, a_lo, a_hi, b_lo, b_hi):
+    """Find the middle snake of the shortest edit script between two ranges.
+
+    Returns (x, y, u, v): the snake runs diagonally from (x, y) to (u, v),
+    in coordinates relative to (a_lo, b_lo).
+    """
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    delta = n - m
+    odd = delta & 1
+    forward = {1: 0}
+    backward = {1: 0}
+    for d in range((n + m + 1) // 2 + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1]
+            else:
+                x = forward[k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            forward[k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[delta - k] >= n:
+                return x0, y0, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a_hi - 1 - x] == b[b_hi - 1 - y]:
+                x += 1
+                y += 1
+            backward[k] = x
+            if not odd and -d <= delta - k <= d and x + forward[delta - k] >= n:
+                return n - x, m - y, n - x0, m - y0
+    raise AssertionError('No middle snake found')
+
+
+def _collect_matches(a, b, a_lo, a_hi, b_lo, b_hi, matches):
+    """Append the (i, j) pairs of matching lines between two ranges, in order."""
+    stack = [(a_lo, a_hi, b_lo, b_hi, None)]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi, tail = stack.pop()
+        if tail is not None:
+            matches.extend(tail)
+            continue
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            matches.append((a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        suffix = []
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            suffix.append((a_hi, b_hi))
+        suffix.reverse()
+        if a_lo == a_hi or b_lo == b_hi:
+            matches.extend(suffix)
+            continue
+        x, y, u, v = _middle_snake(a, b, a_lo, a_hi, b_lo, b_hi)
+        snake = [(a_lo + x + i, b_lo + y + i) for i in range(u - x)]
+        # Pushed in reverse so the ranges are processed left to right
+        stack.append((0, 0, 0, 0, suffix))
+        stack.append((a_lo + u, a_hi, b_lo + v, b_hi, None))
+        stack.append((0, 0, 0, 0, snake))
+        stack.append((a_lo, a_lo + x, b_lo, b_lo + y, None))
+
+
+def diff_opcodes(a, b):
+    """Return difflib-style opcodes ('equal', 'replace', 'delete', 'insert') turning a into b."""
+    # Intern lines so comparisons are between small ints
+    ids = {}
+    a_ids = [ids.setdefault(line, len(ids)) for line in a]
+    b_ids = [ids.setdefault(line, len(ids)) for line in b]
+    matches = []
+    _collect_matches(a_ids, b_ids, 0, len(a_ids), 0, len(b_ids), matches)
+    matches.append((len(a), len(b)))
+
+    opcodes = []
+    i = j = 0
+    for mi, mj in matches:
+        if i < mi and j < mj:
+            opcodes.append(('replace', i, mi, j, mj))
+        elif i < mi:
+            opcodes.append(('delete', i, mi, j, j))
+        elif j < mj:
+            opcodes.append(('insert', i, i, j, mj))
+        if mi < len(a):
+            if opcodes and opcodes[-1][0] == 'equal' and opcodes[-1][2] == mi:
+                tag, i1, _, j1, _ = opcodes.pop()
+                opcodes.append(('equal', i1, mi + 1, j1, mj + 1))
+            else:
+                opcodes.append(('equal', mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return opcodes
+
+
+def unified_hunks(a, b, context=DEFAULT_CONTEXT, opcodes=None):
+    """Group the changes between two line lists into unified diff hunks."""
+    if opcodes is None:
+        opcodes = diff_opcodes(a, b)
+    changes = [op for op in opcodes if op[0] != 'equal']
+    if not changes:
+        return []
+
+    # Merge changes whose context windows touch
+    groups = [[changes[0]]]
+    for op in changes[1:]:
+        if op[1] - groups[-1][-1][2] <= 2 * context:
+            groups[-1].append(op)
+        else:
+            groups.append([op])
+
+    hunks = []
+    for group in groups:
+        first, last = group[0], group[-1]
+        a_start = max(0, first[1] - context)
+        b_start = max(0, first[3] - context)
+        a_end = min(len(a), last[2] + context)
+        b_end = min(len(b), last[4] + context)
+        lines = []
+        i = a_start
+        for tag, i1, i2, j1, j2 in group:
+            lines.extend(' ' + line for line in a[i:i1])
+            lines.extend('-' + line for line in a[i1:i2])
+            lines.extend('+' + line for line in b[j1:j2])
+            i = i2
+        lines.extend(' ' + line for line in a[i:a_end])
+        old_lines = a_end - a_start
+        new_lines = b_end - b_start
+        old_start = a_start + 1 if old_lines else a_start
+        new_start = b_start + 1 if new_lines else b_start
+        hunks.append({
+            'header': f'@@ -{old_start},{old_lines} +{new_start},{new_lines} @@',
+            'old_start': old_start,
+            'old_lines': old_lines,
+            'new_start': new_start,
+            'new_lines': new_lines,
+            'lines': lines
+        })
+    return hunks
+
+
+def _read_blob(repo, blob_hash):
+    if not blob_hash:
+        return b''
+    with repo.open_object(blob_hash) as stream:
+        return stream.read()
+
+
+def diff_file(repo, path, old_blob, new_blob, context=DEFAULT_CONTEXT):
+    """Diff one file between two blob hashes (either may be None)."""
+    if not old_blob:
+        status = 'added'
+    elif not new_blob:
+        status = 'deleted'
+    else:
+        status = 'modified'
+    result = {
+        'path': path,
+        'status': status,
+        'old_blob': old_blob,
+        'new_blob': new_blob,
+        'binary': False,
+        'additions': 0,
+        'deletions': 0,
+        'hunks': []
+    }
+    sizes = [repo.object_size(h) or 0 for h in (old_blob, new_blob) if h]
+    if any(size > MAX_DIFF_BYTES for size in sizes):
+        result['too_large'] = True
+        return result
+    old_content = _read_blob(repo, old_blob)
+    new_content = _read_blob(repo, new_blob)
+    if is_binary(old_content) or is_binary(new_content):
+        result['binary'] = True
+        return result
+    a = split_lines(old_content)
+    b = split_lines(new_content)
+    opcodes = diff_opcodes(a, b)
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != 'equal':
+            result['deletions'] += i2 - i1
+            result['additions'] += j2 - j1
+    result['hunks'] = unified_hunks(a, b, context, opcodes)
+    return result
+
+
+def diff_trees(repo, old_tree, new_tree, context=DEFAULT_CONTEXT):
+    """Diff two trees (either may be None) and summarize the changes."""
+    files = [diff_file(repo, path, old_blob, new_blob, context)
+             for path, old_blob, new_blob in repo.diff_trees(old_tree, new_tree)]
+    return {
+        'files': files,
+        'stats': {
+            'files_changed': len(files),
+            'additions': sum(f['additions'] for f in files),
+            'deletions': sum(f['deletions'] for f in files)
+        }
+    }
@@ -0,0 +1,193 @@
+"""Repository integrity checker.
+
+Every stored copy of every object, loose or packed, is read back, and its
+content is hashed and compared with the hash it is stored under. Commits,
+trees and chunk manifests are parsed for the objects they reference.
+Reading and hashing is spread over a process pool in batches, so a check
+is bound by disk and CPU rather than by one interpreter. Each object comes
+back only as its type and its references, never its data.
+
+Once every object is in, each reference has to resolve to an object of
+the right type, and every ref has to point at a commit. The report is a
+JSON-serializable dict:
+
+    {'repo', 'ok', 'objects', 'seconds',
+     'corrupt': [{'hash', 'location', 'error'}],
+     'missing': [{'hash', 'type', 'referenced_by'}],
+     'bad_refs': [{'ref', 'target', 'error'}]}
+
+Run from the project root to check every repository (repos_dir defaults
+to server/repos):
+
+    python -m server.fsck [repos_dir]
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .pack import PackFile, list_packs
+from .vcs import GitRepository, _commit_parents, _iter_loose_chunks, _split_header
+
+DEFAULT_REPOS_DIR = os.path.join(os.path.dirname(__file__), 'repos')
+FSCK_WORKERS = int(os.environ.get('VCS_FSCK_WORKERS', os.cpu_count() or 1))
+BATCH_SIZE = 256
+
+# Object types each kind of reference may point at
+ACCEPTED_TYPES = {
+    'commit': {'commit'},
+    'tree': {'tree'},
+    'blob': {'blob', 'chunked'},
+    'chunk': {'blob'},
+}
+
+
+def _references(obj_type, data):
+    """Return (hash, kind) for every object a commit, tree or chunk manifest refers to."""
+    parsed = json.loads(data)
+    if obj_type == 'commit':
+        return [(parsed['tree'], 'tree')] + [(parent, 'commit') for parent in _commit_parents(parsed)]
+    if obj_type == 'tree':
+        references = []
+        for value in parsed.values():
+            # Trees written before directories got their own objects map paths to blob hashes
+            if isinstance(value, str):
+                references.append((value, 'blob'))
+            else:
+                references.append((value[1], 'tree' if value[0] == 'tree' else 'blob'))
+        return references
+    if obj_type == 'chunked':
+        return [(chunk_hash, 'chunk') for chunk_hash, _ in parsed['chunks']]
+    raise ValueError(f'Unknown object type {obj_type!r}')
+
+
+def _verify(obj_hash, obj_type, chunks):
+    """Hash an object's data pieces; return (type, references), raising ValueError on a mismatch."""
+    sha1 = hashlib.sha1(obj_type.encode() + b' ')
+    # Blobs can be large and reference nothing, so only other types are kept
+    data = [] if obj_type != 'blob' else None
+    for piece in chunks:
+        sha1.update(piece)
+        if data is not None:
+            data.append(piece)
+    if sha1.hexdigest() != obj_hash:
+        raise ValueError(f'Hash mismatch: content hashes to {sha1.hexdigest()}')
+    return obj_type, _references(obj_type, b''.join(data)) if data is not None else []
+
+
+def check_loose_batch(objects):
+    """Check a batch of (hash, path) loose objects; runs in a worker process."""
+    results = []
+    for obj_hash, path in objects:
+        try:
+            with open(path, 'rb') as f:
+                obj_type, chunks = _split_header(_iter_loose_chunks(f))
+                results.append((obj_hash, path, *_verify(obj_hash, obj_type, chunks), None))
+        except Exception as e:
+            results.append((obj_hash, path, None, [], f'{type(e).__name__}: {e}'))
+    return results
+
+
+def check_pack_batch(base_path, hashes):
+    """Check a batch of objects in one pack; runs in a worker process."""
+    results = []
+    pack = PackFile(base_path)
+    try:
+        for obj_hash in hashes:
+            try:
+                obj_type, data = pack.read(obj_hash)
+                results.append((obj_hash, pack.pack_path, *_verify(obj_hash, obj_type, [data]), None))
+            except Exception as e:
+                results.append((obj_hash, pack.pack_path, None, [], f'{type(e).__name__}: {e}'))
+    finally:
+        pack.close()
+    return results
+
+
+def _batches(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def check_repository(repo, executor=None, workers=None):
+    """Check a repository's objects and refs and return the report.
+
+    Batches run on executor, or on a process pool of workers (default
+    FSCK_WORKERS) created for this check.
+    """
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers or FSCK_WORKERS) as pool:
+            return check_repository(repo, executor=pool)
+
+    start = time.monotonic()
+    futures = [executor.submit(check_loose_batch, batch)
+               for batch in _batches(list(repo._iter_loose_objects()))]
+    for base_path in list_packs(repo.pack_path):
+        pack = PackFile(base_path)
+        try:
+            hashes = list(pack)
+        finally:
+            pack.close()
+        futures.extend(executor.submit(check_pack_batch, base_path, batch) for batch in _batches(hashes))
+
+    report = {'repo': repo.repo_path, 'ok': True, 'objects': 0, 'corrupt': [], 'missing': [], 'bad_refs': []}
+    # Hashes stored at all (even if a copy is corrupt) and the type of each sound copy
+    stored = set()
+    types = {}
+    references = {}
+    for future in futures:
+        for obj_hash, location, obj_type, refs, error in future.result():
+            report['objects'] += 1
+            stored.add(obj_hash)
+            if error:
+                report['corrupt'].append({'hash': obj_hash, 'location': location, 'error': error})
+                continue
+            types[obj_hash] = obj_type
+            for ref_hash, kind in refs:
+                references.setdefault((ref_hash, kind), obj_hash)
+
+    for (ref_hash, kind), referrer in sorted(references.items()):
+        if ref_hash not in stored:
+            report['missing'].append({'hash': ref_hash, 'type': kind, 'referenced_by': referrer})
+        elif ref_hash in types and types[ref_hash] not in ACCEPTED_TYPES[kind]:
+            report['corrupt'].append({
+                'hash': referrer, 'location': 'references',
+                'error': f'{ref_hash} is a {types[ref_hash]} object, expected a {kind}'
+            })
+
+    for name, target in repo.list_refs().items():
+        if target not in stored:
+            report['bad_refs'].append({'ref': name, 'target': target, 'error': 'missing object'})
+        elif target in types and types[target] != 'commit':
+            report['bad_refs'].append({'ref': name, 'target': target, 'error': f'points at a {types[target]} object'})
+
+    report['ok'] = not (report['corrupt'] or report['missing'] or report['bad_refs'])
+    report['seconds'] = time.monotonic() - start
+    return report
+
+
+def check_all(repos_dir=DEFAULT_REPOS_DIR, workers=None):
+    """Check every repository under repos_dir on one shared process pool; return their reports."""
+    reports = []
+    if not os.path.isdir(repos_dir):
+        return reports
+    with ProcessPoolExecutor(max_workers=workers or FSCK_WORKERS) as pool:
+        for name in sorted(os.listdir(repos_dir), key=lambda n: (len(n), n)):
+            repo_path = os.path.join(repos_dir, name)
+            if name.isdigit() and os.path.isdir(repo_path):
+                reports.append(check_repository(GitRepository(repo_path), executor=pool))
+    return reports
+
+
+if __name__ == "__main__":
+    repos_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_REPOS_DIR
+    if not os.path.isdir(repos_dir):
+        json.dump({'ok': False, 'error': f'Repository directory not found: {repos_dir}'}, sys.stdout, indent=2)
+        print()
+        sys.exit(1)
+    reports = check_all(repos_dir)
+    json.dump({'ok': all(r['ok'] for r in reports), 'repos': reports}, sys.stdout, indent=2)
+    print()
+    sys.exit(0 if all(r['ok'] for r in reports) else 1)
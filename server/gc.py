@@ -0,0 +1,453 @@
+"""Garbage collection of unreachable objects and orphaned snapshot folders.
+
+A pass marks every object reachable from the refs, HEAD, the checked-out
+tree and every commit recorded in a reflog, then sweeps the loose objects
+that were not marked and have not been written for a grace period. Packed
+objects are left alone; a full repack only keeps what is still stored.
+
+Marking takes no locks. An object written while gc runs is younger than
+the grace period, and a write that finds its object already stored
+touches its mtime, so nothing a concurrent commit relies on looks old.
+Before each batch of deletions the roots are read again and anything new
+is marked. Deletions happen one object directory at a time, under the
+objects lock, so repacks and snapshot imports only wait for one batch
+and the working tree is never locked at all. Refs are only locked when
+packing them, one ref at a time.
+
+The sweep takes the 256 loose-object directories in turn and records
+where it stopped in ``gc-state``, so a pass cut short by its byte or time
+budget carries on from there next time. Marking that runs out of time
+likewise saves what it has marked and what it still has to walk in
+``gc-mark``, and the next pass picks it up rather than starting over.
+A pass that sweeps every directory goes on to pack: reachable loose
+objects go into a pack once there are GC_AUTO_PACK of them, the packs are
+folded into one once there are more than GC_MAX_PACKS, and loose refs are
+moved into packed-refs once there are GC_PACK_REFS of them.
+
+Snapshot folders are imported or deleted one at a time between budget
+checks; each is removed once handled, so the folders left over are what
+the next pass resumes with. Run from the project root (repos_dir
+defaults to server/repos):
+
+    python -m server.gc [repos_dir]
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from . import reflog
+from .pack import DELTA_SEARCH_SECONDS, list_packs
+from .vcs import GitRepository
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPOS_DIR = os.path.join(os.path.dirname(__file__), 'repos')
+# Unreachable loose objects (and stale temporary files) younger than this are kept
+GC_GRACE_SECONDS = int(os.environ.get('VCS_GC_GRACE_SECONDS', 14 * 24 * 3600))
+# Scheduled passes: how often, and how much work each pass may do across all repos
+GC_INTERVAL = int(os.environ.get('VCS_GC_INTERVAL', 3600))
+GC_MAX_SECONDS = float(os.environ.get('VCS_GC_MAX_SECONDS', 60))
+GC_MAX_BYTES = int(os.environ.get('VCS_GC_MAX_BYTES', 1024 * 1024 * 1024))
+# Packing thresholds; 0 turns the step off
+GC_AUTO_PACK = int(os.environ.get('VCS_GC_AUTO_PACK', 1000))
+GC_MAX_PACKS = int(os.environ.get('VCS_GC_MAX_PACKS', 20))
+GC_PACK_REFS = int(os.environ.get('VCS_GC_PACK_REFS', 50))
+# How many objects to check between deadline checks while marking
+MARK_CHECK_INTERVAL = 1000
+PREFIXES = [f'{i:02x}' for i in range(256)]
+
+
+class _OutOfTime(Exception):
+    """Marking ran out of time; carries the commits and trees it had yet to walk."""
+
+    def __init__(self, commits=(), trees=()):
+        super().__init__()
+        self.commits = list(commits)
+        self.trees = list(trees)
+
+
+def gc_roots(repo):
+    """Return the commits and trees gc treats as live: refs, HEAD, reflog entries and the checked-out tree."""
+    commits = set(repo.list_refs().values())
+    head = repo.get_current_commit()
+    if head:
+        commits.add(head)
+    for root, _, filenames in os.walk(repo.logs_path):
+        for filename in filenames:
+            for entry in reflog.read_entries(os.path.join(root, filename)):
+                commits.update(c for c in (entry['old'], entry['new']) if c)
+    trees = set()
+    checked_out = repo._checked_out_tree()
+    if checked_out:
+        trees.add(checked_out)
+    return commits, trees
+
+
+def mark_reachable(repo, commits, trees=(), marked=None, deadline=None):
+    """Add every object reachable from commits and trees to marked (a set) and return it.
+
+    Objects already in marked are assumed to have been walked, so marking
+    again from new roots only visits what they add. Missing objects are
+    skipped; reporting them is fsck's job. Chunk manifests are recognised
+    from the repository's list of them, so blobs are never opened.
+    """
+    marked = set() if marked is None else marked
+    manifests = repo.chunk_manifests()
+    commit_stack = [c for c in commits if c not in marked]
+    tree_stack = list(trees)
+    visited = 0
+    while commit_stack or tree_stack:
+        visited += 1
+        if visited % MARK_CHECK_INTERVAL == 0 and deadline is not None and time.monotonic() > deadline:
+            raise _OutOfTime(commit_stack, tree_stack)
+        if tree_stack:
+            tree = tree_stack.pop()
+            if isinstance(tree, str):
+                if tree in marked:
+                    continue
+                marked.add(tree)
+            try:
+                entries = repo._tree_entries(tree)
+            except ValueError:
+                continue
+            for entry_type, ref in entries.values():
+                if entry_type == 'tree':
+                    tree_stack.append(ref)
+                elif ref not in marked:
+                    marked.add(ref)
+                    if ref in manifests:
+                        _mark_chunks(repo, ref, marked)
+            continue
+        commit_hash = commit_stack.pop()
+        if commit_hash in marked:
+            continue
+        marked.add(commit_hash)
+        try:
+            commit = repo._read_commit(commit_hash)
+        except ValueError:
+            continue
+        tree_stack.append(commit['tree'])
+        commit_stack.extend(p for p in repo.commit_parents(commit_hash) if p not in marked)
+    return marked
+
+
+def _mark_chunks(repo, manifest_hash, marked):
+    stream = repo._open_stored_object(manifest_hash)
+    if stream is None:
+        return
+    with stream:
+        if stream.type == 'chunked':
+            manifest = json.loads(stream.read())
+            marked.update(chunk_hash for chunk_hash, _ in manifest['chunks'])
+
+
+def _state_path(repo):
+    return os.path.join(repo.repo_path, 'gc-state')
+
+
+def _load_next_prefix(repo):
+    try:
+        with open(_state_path(repo), 'r') as f:
+            return json.load(f).get('next_prefix', 0) % len(PREFIXES)
+    except (FileNotFoundError, ValueError, AttributeError, TypeError):
+        return 0
+
+
+def _save_next_prefix(repo, next_prefix):
+    _write_json(repo, _state_path(repo), {'next_prefix': next_prefix, 'updated': time.time()})
+
+
+def _mark_path(repo):
+    return os.path.join(repo.repo_path, 'gc-mark')
+
+
+def _load_mark_progress(repo):
+    """Return (marked, commits, trees) saved by a pass whose marking ran out of time."""
+    try:
+        with open(_mark_path(repo), 'r') as f:
+            progress = json.load(f)
+        return set(progress['marked']), list(progress['commits']), list(progress['trees'])
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return set(), [], []
+
+
+def _save_mark_progress(repo, marked, commits, trees):
+    _write_json(repo, _mark_path(repo), {
+        'marked': sorted(marked), 'commits': commits, 'trees': trees, 'updated': time.time()
+    })
+
+
+def _clear_mark_progress(repo):
+    try:
+        os.remove(_mark_path(repo))
+    except FileNotFoundError:
+        pass
+
+
+def _write_json(repo, path, value):
+    fd, tmp_path = tempfile.mkstemp(dir=repo.repo_path, prefix='tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def collect_garbage(repo, grace_seconds=GC_GRACE_SECONDS, max_bytes=None, max_seconds=None):
+    """Run one gc pass over a repository and return what it did.
+
+    Legacy snapshot folders are folded into the object store and removed
+    first, one at a time until max_seconds runs out. The sweep stops early once it has freed max_bytes or run for
+    max_seconds; 'complete' in the result says whether every object
+    directory was swept. Marking cut short by max_seconds is saved and
+    resumed by the next call.
+    """
+    start = time.monotonic()
+    deadline = start + max_seconds if max_seconds is not None else None
+    stats = {
+        'snapshots_removed': 0,
+        'marked': 0,
+        'objects_removed': 0,
+        'temp_files_removed': 0,
+        'bytes_freed': 0,
+        'objects_packed': 0,
+        'refs_packed': 0,
+        'complete': False,
+    }
+
+    for folder in repo.snapshot_folders():
+        if deadline is not None and time.monotonic() > deadline:
+            stats['seconds'] = time.monotonic() - start
+            return stats
+        repo.import_snapshot(folder)
+        stats['snapshots_removed'] += 1
+
+    # Objects marked so far stay marked: anything reachable then is kept
+    # this time round, and the roots are read again for what changed since
+    marked, pending_commits, pending_trees = _load_mark_progress(repo)
+    try:
+        commits, trees = gc_roots(repo)
+        mark_reachable(repo, list(commits) + pending_commits, list(trees) + pending_trees,
+                       marked, deadline=deadline)
+    except _OutOfTime as e:
+        _save_mark_progress(repo, marked, e.commits, e.trees)
+        stats['marked'] = len(marked)
+        stats['seconds'] = time.monotonic() - start
+        return stats
+    _clear_mark_progress(repo)
+
+    first = _load_next_prefix(repo)
+    swept = 0
+    for swept in range(len(PREFIXES)):
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        if max_bytes is not None and stats['bytes_freed'] >= max_bytes:
+            break
+        prefix = PREFIXES[(first + swept) % len(PREFIXES)]
+        directory = os.path.join(repo.objects_path, prefix)
+        if not _unmarked_entries(directory, prefix, marked):
+            continue
+        try:
+            # Anything the roots gained since marking is marked before deleting
+            commits, trees = gc_roots(repo)
+            mark_reachable(repo, commits, trees, marked, deadline=deadline)
+        except _OutOfTime:
+            break
+        _sweep_directory(repo, directory, _unmarked_entries(directory, prefix, marked),
+                         time.time() - grace_seconds, stats)
+    else:
+        swept = len(PREFIXES)
+        stats['complete'] = True
+    stats['marked'] = len(marked)
+    _save_next_prefix(repo, (first + swept) % len(PREFIXES))
+    if stats['complete']:
+        _pack(repo, marked, deadline, stats)
+    stats['seconds'] = time.monotonic() - start
+    return stats
+
+
+def _pack(repo, marked, deadline, stats):
+    """Pack reachable loose objects, fold packs together and pack refs, as far as the thresholds call for.
+
+    A pack cannot stop halfway, so only its delta search is held to what is
+    left of the time budget.
+    """
+    delta_seconds = DELTA_SEARCH_SECONDS
+    if deadline is not None:
+        delta_seconds = min(delta_seconds, deadline - time.monotonic())
+        if delta_seconds <= 0:
+            return
+    if GC_MAX_PACKS and len(list_packs(repo.pack_path)) > GC_MAX_PACKS:
+        stats['objects_packed'] = repo.repack(full=True, reachable=marked, max_delta_seconds=delta_seconds)
+    elif GC_AUTO_PACK and sum(1 for obj_hash, _ in repo._iter_loose_objects() if obj_hash in marked) >= GC_AUTO_PACK:
+        stats['objects_packed'] = repo.repack(reachable=marked, max_delta_seconds=delta_seconds)
+    if GC_PACK_REFS and _loose_ref_count(repo) >= GC_PACK_REFS:
+        stats['refs_packed'] = repo.pack_refs()
+
+
+def _loose_ref_count(repo):
+    return sum(len(filenames) for _, _, filenames in os.walk(repo.refs_path))
+
+
+def _unmarked_entries(directory, prefix, marked):
+    """Return the names of unmarked objects and temporary files in a loose-object directory."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [name for name in names
+            if name.startswith('tmp_') or (len(name) == 38 and prefix + name not in marked)]
+
+
+def _sweep_directory(repo, directory, candidates, cutoff, stats):
+    """Remove the candidates not written since cutoff, holding the objects lock for this directory only."""
+    if not candidates:
+        return
+    with repo._objects_lock():
+        for name in candidates:
+            path = os.path.join(directory, name)
+            try:
+                # Checked again under the lock: a write may have just touched it
+                st = os.stat(path)
+                if st.st_mtime >= cutoff:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            stats['bytes_freed'] += st.st_size
+            if name.startswith('tmp_'):
+                stats['temp_files_removed'] += 1
+            else:
+                stats['objects_removed'] += 1
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+
+def orphaned_snapshot_folders(repos_dir):
+    """Return the <id>_<hash> snapshot folders in repos_dir whose repository no longer exists."""
+    folders = []
+    for name in sorted(os.listdir(repos_dir)):
+        repo_id, _, suffix = name.partition('_')
+        if (repo_id.isdigit() and len(suffix) == 40 and all(c in '0123456789abcdef' for c in suffix)
+                and not os.path.isdir(os.path.join(repos_dir, repo_id))):
+            folders.append(os.path.join(repos_dir, name))
+    return folders
+
+
+def _remove_folder(folder):
+    """Delete a folder and everything below it; return the bytes its files took."""
+    freed = 0
+    for root, _, filenames in os.walk(folder):
+        for filename in filenames:
+            try:
+                freed += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    shutil.rmtree(folder, ignore_errors=True)
+    return freed
+
+
+def _repo_ids(repos_dir):
+    return sorted((int(name) for name in os.listdir(repos_dir)
+                   if name.isdigit() and os.path.isdir(os.path.join(repos_dir, name))))
+
+
+class GarbageCollector:
+    """Background thread running budgeted gc passes over every repository."""
+
+    def __init__(self, repos_dir=DEFAULT_REPOS_DIR, interval=GC_INTERVAL,
+                 max_bytes=GC_MAX_BYTES, max_seconds=GC_MAX_SECONDS):
+        self.repos_dir = repos_dir
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.running = False
+        self.gc_thread = None
+        self._stop_event = threading.Event()
+        # Repo id the next pass starts from, so a budget never starves later repos
+        self._next_repo = 0
+
+    def start(self):
+        """Start the gc thread"""
+        if not self.running:
+            self.running = True
+            self._stop_event.clear()
+            self.gc_thread = threading.Thread(target=self._gc_loop, name='vcs-gc')
+            self.gc_thread.daemon = True
+            self.gc_thread.start()
+            logger.info("Garbage collection started")
+
+    def stop(self):
+        """Stop the gc thread"""
+        self.running = False
+        self._stop_event.set()
+        if self.gc_thread:
+            self.gc_thread.join()
+            logger.info("Garbage collection stopped")
+
+    def _gc_loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_pass()
+            except Exception as e:
+                logger.error(f"Error in garbage collection pass: {e}")
+
+    def run_pass(self):
+        """Collect garbage in as many repositories as the budget allows; return the totals."""
+        start = time.monotonic()
+        totals = {'repos': 0, 'snapshots_removed': 0, 'objects_removed': 0, 'bytes_freed': 0,
+                  'objects_packed': 0, 'refs_packed': 0}
+        if not os.path.isdir(self.repos_dir):
+            return totals
+        for folder in orphaned_snapshot_folders(self.repos_dir):
+            if time.monotonic() - start >= self.max_seconds or totals['bytes_freed'] >= self.max_bytes:
+                break
+            totals['bytes_freed'] += _remove_folder(folder)
+            totals['snapshots_removed'] += 1
+
+        repo_ids = _repo_ids(self.repos_dir)
+        ordered = [i for i in repo_ids if i >= self._next_repo] + [i for i in repo_ids if i < self._next_repo]
+        for repo_id in ordered:
+            seconds_left = self.max_seconds - (time.monotonic() - start)
+            bytes_left = self.max_bytes - totals['bytes_freed']
+            if seconds_left <= 0 or bytes_left <= 0:
+                break
+            self._next_repo = repo_id
+            repo = GitRepository(os.path.join(self.repos_dir, str(repo_id)))
+            try:
+                stats = collect_garbage(repo, max_bytes=bytes_left, max_seconds=seconds_left)
+            except Exception as e:
+                logger.error(f"Garbage collection failed for repo {repo_id}: {e}")
+                stats = {'complete': True}
+            totals['repos'] += 1
+            for key in ('snapshots_removed', 'objects_removed', 'bytes_freed', 'objects_packed', 'refs_packed'):
+                totals[key] += stats.get(key, 0)
+            self._next_repo = repo_id + 1
+            if not stats['complete']:
+                # Its mark or sweep progress is saved; the next pass starts with
+                # the following repo so one large repo cannot hold up the rest
+                break
+        else:
+            self._next_repo = 0
+        logger.info(f"Garbage collection pass: {totals}")
+        return totals
+
+
+garbage_collector = GarbageCollector()
+
+
+if __name__ == "__main__":
+    repos_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_REPOS_DIR
+    if not os.path.isdir(repos_dir):
+        sys.exit(f"Repository directory not found: {repos_dir}")
+    collector = GarbageCollector(repos_dir, max_bytes=float('inf'), max_seconds=float('inf'))
+    print(collector.run_pass())
@@ -0,0 +1,110 @@
+"""Stat-cache index of the working tree.
+
+The index remembers, for every file under ``files/``, the stat data it had
+when it was last hashed together with the resulting blob hash. A file whose
+mtime, size and inode still match can be assumed unchanged, so working-tree
+status only has to stat files, not read them. The file is:
+
+    b'VIDX' | version (4) | entry count (4) | entries... | sha1 of the above (20)
+
+with entries sorted by path, each being
+
+    mtime (8, ns) | size (8) | inode (8) | blob hash (20) | path length (2) | path (UTF-8)
+"""
+import hashlib
+import os
+import struct
+import tempfile
+
+INDEX_SIGNATURE = b'VIDX'
+INDEX_VERSION = 1
+HEADER = struct.Struct('>4sII')
+ENTRY = struct.Struct('>qQQ20sH')
+
+# Files modified this close to the time the index was written may have
+# changed again within the same timestamp tick, so their cached hash is
+# not trusted ("racily clean" in git terms).
+RACY_NS = 2 * 10**9
+
+
+class IndexEntry:
+    __slots__ = ('mtime_ns', 'size', 'inode', 'blob')
+
+    def __init__(self, mtime_ns, size, inode, blob):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.inode = inode
+        self.blob = blob
+
+    @classmethod
+    def from_stat(cls, st, blob):
+        return cls(st.st_mtime_ns, st.st_size, st.st_ino, blob)
+
+    def matches(self, st):
+        return self.mtime_ns == st.st_mtime_ns and self.size == st.st_size and self.inode == st.st_ino
+
+
+def read_index(path):
+    """Return (entries, index mtime in ns) for an index file.
+
+    entries maps path -> IndexEntry. A missing or corrupt index reads as
+    empty, which only means every file gets hashed once more.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+    except FileNotFoundError:
+        return {}, 0
+    if len(data) < HEADER.size + 20 or hashlib.sha1(data[:-20]).digest() != data[-20:]:
+        return {}, 0
+    signature, version, count = HEADER.unpack_from(data)
+    if signature != INDEX_SIGNATURE or version != INDEX_VERSION:
+        return {}, 0
+    entries = {}
+    offset = HEADER.size
+    for _ in range(count):
+        entry_mtime_ns, size, inode, blob, path_length = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        name = data[offset:offset + path_length].decode('utf-8')
+        offset += path_length
+        entries[name] = IndexEntry(entry_mtime_ns, size, inode, blob.hex())
+    return entries, mtime_ns
+
+
+def write_index(path, entries):
+    """Atomically write a dict of path -> IndexEntry to an index file."""
+    parts = [HEADER.pack(INDEX_SIGNATURE, INDEX_VERSION, len(entries))]
+    for name in sorted(entries):
+        entry = entries[name]
+        encoded = name.encode('utf-8')
+        parts.append(ENTRY.pack(entry.mtime_ns, entry.size, entry.inode, bytes.fromhex(entry.blob), len(encoded)))
+        parts.append(encoded)
+    data = b''.join(parts)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.write(hashlib.sha1(data).digest())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def scan_files(root):
+    """Yield (relative path, stat result) for every regular file below root, using os.scandir."""
+    stack = ['']
+    while stack:
+        prefix = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root, prefix) if prefix else root)
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                rel_path = f"{prefix}/{entry.name}" if prefix else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(rel_path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield rel_path, entry.stat(follow_symlinks=False)
@@ -0,0 +1,176 @@
+"""Three-way merge of trees and text files.
+
+Trees are merged entry by entry against their merge base. Whenever two of
+the three sides of an entry are identical the result is known without
+looking inside it, so unchanged subtrees are never read. Files changed on
+both sides are merged line by line diff3-style; regions both sides changed
+differently become conflicts.
+"""
+import json
+
+from .diff import diff_opcodes, is_binary, split_lines, MAX_DIFF_BYTES
+
+MARKER_OURS = '<<<<<<< ours\n'
+MARKER_SEPARATOR = '=======\n'
+MARKER_THEIRS = '>>>>>>> theirs\n'
+
+
+def _changes(base, side):
+    """Return the (base start, base end, side start, side end) ranges a side changed."""
+    return [(i1, i2, j1, j2) for tag, i1, i2, j1, j2 in diff_opcodes(base, side) if tag != 'equal']
+
+
+def _side_range(changes, lo, hi):
+    """Map the base range [lo, hi) to a side, given that side's changes inside it."""
+    if not changes:
+        return None
+    first, last = changes[0], changes[-1]
+    return first[2] - (first[0] - lo), last[3] + (hi - last[1])
+
+
+def merge_lines(base, ours, theirs):
+    """Merge two edited versions of a list of lines against their common base.
+
+    Returns (lines, conflicts) where lines is the merged result, with
+    conflict markers around every region both sides changed differently,
+    and conflicts is the number of such regions.
+    """
+    changes = sorted([(c, 0) for c in _changes(base, ours)] + [(c, 1) for c in _changes(base, theirs)])
+    sides = (ours, theirs)
+    merged = []
+    conflicts = 0
+    pos = 0
+    i = 0
+    while i < len(changes):
+        # Collect every change overlapping or touching the current region
+        lo, hi = changes[i][0][0], changes[i][0][1]
+        group = ([], [])
+        while i < len(changes) and changes[i][0][0] <= hi:
+            change, side = changes[i]
+            group[side].append(change)
+            hi = max(hi, change[1])
+            i += 1
+        merged.extend(base[pos:lo])
+        pos = hi
+        texts = []
+        for side in (0, 1):
+            span = _side_range(group[side], lo, hi)
+            texts.append(sides[side][span[0]:span[1]] if span else base[lo:hi])
+        original = base[lo:hi]
+        if texts[0] == texts[1] or texts[1] == original:
+            merged.extend(texts[0])
+        elif texts[0] == original:
+            merged.extend(texts[1])
+        else:
+            conflicts += 1
+            merged.append(MARKER_OURS)
+            merged.extend(_terminated(texts[0]))
+            merged.append(MARKER_SEPARATOR)
+            merged.extend(_terminated(texts[1]))
+            merged.append(MARKER_THEIRS)
+    merged.extend(base[pos:])
+    return merged, conflicts
+
+
+def _terminated(lines):
+    """Make sure the last line ends with a newline so a following marker starts on its own line."""
+    if lines and not lines[-1].endswith('\n'):
+        return lines[:-1] + [lines[-1] + '\n']
+    return lines
+
+
+def merge_blobs(repo, base_blob, ours_blob, theirs_blob):
+    """Merge a file changed on both sides.
+
+    Returns (blob hash, conflict) where conflict is None on a clean merge or
+    a dict describing why the file could not be merged.
+    """
+    contents = []
+    for blob in (base_blob, ours_blob, theirs_blob):
+        if blob and (repo.object_size(blob) or 0) > MAX_DIFF_BYTES:
+            return None, {'reason': 'too_large'}
+        if blob:
+            with repo.open_object(blob) as stream:
+                contents.append(stream.read())
+        else:
+            contents.append(b'')
+    if any(is_binary(content) for content in contents):
+        return None, {'reason': 'binary'}
+    lines, conflicts = merge_lines(*(split_lines(content) for content in contents))
+    blob_hash = repo._save_blob(''.join(lines).encode('utf-8'))
+    if conflicts:
+        return blob_hash, {'reason': 'content', 'regions': conflicts}
+    return blob_hash, None
+
+
+def merge_trees(repo, base, ours, theirs, prefix=''):
+    """Three-way merge of trees; any of them may be None for an empty tree.
+
+    Returns (tree hash, conflicts). The tree hash is None when the merged
+    tree is empty. Each conflict is a dict with the path, the reason and the
+    blob on each side; for content conflicts merged_blob holds the file with
+    conflict markers.
+    """
+    if ours == theirs or base == theirs:
+        return _tree_hash(repo, ours), []
+    if base == ours:
+        return _tree_hash(repo, theirs), []
+
+    base_entries = repo._tree_entries(base) if base else {}
+    ours_entries = repo._tree_entries(ours) if ours else {}
+    theirs_entries = repo._tree_entries(theirs) if theirs else {}
+    result = {}
+    conflicts = []
+    for name in sorted(set(base_entries) | set(ours_entries) | set(theirs_entries)):
+        b = base_entries.get(name)
+        o = ours_entries.get(name)
+        t = theirs_entries.get(name)
+        path = f"{prefix}{name}"
+        if o == t or b == t:
+            entry = o
+        elif b == o:
+            entry = t
+        elif all(e is None or e[0] == 'tree' for e in (b, o, t)):
+            subtree, sub_conflicts = merge_trees(repo, b and b[1], o and o[1], t and t[1], path + '/')
+            conflicts.extend(sub_conflicts)
+            entry = ('tree', subtree) if subtree else None
+        elif o and t and all(e is None or e[0] == 'blob' for e in (b, o, t)):
+            blob_hash, conflict = merge_blobs(repo, b and b[1], o[1], t[1])
+            entry = ('blob', blob_hash) if blob_hash else o
+            if conflict:
+                conflicts.append(dict(conflict, **_conflict_sides(path, b, o, t), merged_blob=blob_hash))
+        else:
+            # Deleted on one side and changed on the other, or a file on one
+            # side and a directory on the other
+            entry = o
+            reason = 'modify/delete' if o is None or t is None else 'file/directory'
+            conflicts.append(dict(_conflict_sides(path, b, o, t), reason=reason))
+        if entry is not None:
+            result[name] = entry
+    if not result:
+        return None, conflicts
+    return _write_entries(repo, result), conflicts
+
+
+def _conflict_sides(path, base, ours, theirs):
+    def ref(entry):
+        return entry[1] if entry and isinstance(entry[1], str) else None
+    return {'path': path, 'base': ref(base), 'ours': ref(ours), 'theirs': ref(theirs)}
+
+
+def _tree_hash(repo, tree):
+    """Return the hash of a tree, writing it out if it is a legacy in-memory node."""
+    if isinstance(tree, dict):
+        return _write_entries(repo, tree) if tree else None
+    return tree
+
+
+def _write_entries(repo, entries):
+    tree = {}
+    for name, (entry_type, ref) in entries.items():
+        if entry_type == 'tree':
+            ref = _tree_hash(repo, ref)
+            if ref is None:
+                continue
+        tree[name] = [entry_type, ref]
+    return repo._save_object('tree', json.dumps(tree, sort_keys=True, separators=(',', ':')))
@@ -0,0 +1,33 @@
+"""Fold the legacy <repo>_<commit> snapshot folders back into their repositories.
+
+Commits used to copy the whole repository folder on every commit. Revert now
+rebuilds the working tree from the object store, so the snapshots are only
+dead weight. Run from the project root:
+
+    python -m server.migrate_snapshots [repos_dir]
+"""
+import os
+import sys
+from server.vcs import GitRepository
+
+DEFAULT_REPOS_DIR = os.path.join(os.path.dirname(__file__), 'repos')
+
+
+def migrate_snapshots(repos_dir=DEFAULT_REPOS_DIR):
+    try:
+        for name in sorted(os.listdir(repos_dir)):
+            repo_path = os.path.join(repos_dir, name)
+            if not name.isdigit() or not os.path.isdir(repo_path):
+                continue
+            repo = GitRepository(repo_path)
+            folders = repo.snapshot_folders()
+            if not folders:
+                continue
+            imported = repo.import_snapshots()
+            print(f"Repo {name}: imported {imported} objects from {len(folders)} snapshot folders")
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+
+if __name__ == "__main__":
+    migrate_snapshots(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_REPOS_DIR)
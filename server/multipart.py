@@ -0,0 +1,66 @@
+"""Read a multipart/form-data body part by part straight off the request stream.
+
+``request.form`` and ``request.files`` parse the whole body before the view
+sees any of it, spooling every file to memory or a temporary file. Here
+parts are handed out in order as the body is read, and a part's data is
+only decoded as its reader is read, so a file part can be passed to
+``write_blob_stream`` with no more than a read's worth of it in memory.
+"""
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+READ_SIZE = 64 * 1024
+
+
+class MultipartPart:
+    """One part of the body: its field name, filename (None for plain fields) and a read() over its data."""
+
+    def __init__(self, reader, name, filename):
+        self._reader = reader
+        self.name = name
+        self.filename = filename
+        self.size = 0
+        self._buffer = bytearray()
+        self._more = True
+
+    def read(self, size=-1):
+        while self._more and (size < 0 or len(self._buffer) < size):
+            event = self._reader._next_event()
+            self._buffer += event.data
+            self._more = event.more_data
+        if size < 0 or size > len(self._buffer):
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.size += len(data)
+        return data
+
+
+class MultipartReader:
+    """Iterate over the parts of a multipart body read from stream.
+
+    Each part must be dealt with before the next is asked for; whatever is
+    left unread of it is skipped. Malformed or truncated bodies raise
+    ValueError.
+    """
+
+    def __init__(self, stream, boundary, max_form_memory_size=None, max_parts=None):
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary.encode(), max_form_memory_size, max_parts=max_parts)
+
+    def _next_event(self):
+        while True:
+            event = self._decoder.next_event()
+            if not isinstance(event, NeedData):
+                return event
+            self._decoder.receive_data(self._stream.read(READ_SIZE) or None)
+
+    def __iter__(self):
+        while True:
+            event = self._next_event()
+            if isinstance(event, Epilogue):
+                return
+            if isinstance(event, (Field, File)):
+                part = MultipartPart(self, event.name, getattr(event, 'filename', None))
+                yield part
+                while part._more:
+                    part.read(READ_SIZE)
@@ -0,0 +1,504 @@
+"""Packfile storage for repository objects.
+
+A pack is a pair of files living under ``objects/pack``:
+
+* ``pack-<sha>.pack`` holds every object zlib-compressed, either whole or
+  as a delta against another object in the same pack.
+* ``pack-<sha>.idx`` holds a 256-entry fanout table followed by the sorted
+  object hashes and their offsets into the pack, so a lookup is a fanout
+  read plus a binary search over a small slice of the index.
+
+Both files are mmapped, so reading objects out of a pack costs no syscalls
+beyond the initial open.
+"""
+import os
+import heapq
+import mmap
+import struct
+import hashlib
+import time
+import zlib
+
+PACK_SIGNATURE = b'PACK'
+IDX_SIGNATURE = b'\xffIDX'
+PACK_VERSION = 1
+
+# Object type codes stored in the pack entry header
+TYPE_CODES = {'commit': 1, 'tree': 2, 'blob': 3, 'chunked': 4}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+DELTA_CODE = 7
+
+# type code, uncompressed size, compressed size
+ENTRY_HEADER = struct.Struct('>BQQ')
+
+# Delta search parameters
+DELTA_WINDOW = 10
+MAX_DELTA_DEPTH = 10
+MAX_DELTA_SOURCE = 16 * 1024 * 1024
+DELTA_BLOCK = 16
+# Once a pack has spent this long searching for deltas, the rest of its objects are stored whole
+DELTA_SEARCH_SECONDS = float(os.environ.get('VCS_DELTA_SEARCH_SECONDS', 60))
+# Objects whose leading sample zlib cannot shrink by a tenth are not diffed at all
+COMPRESSIBILITY_SAMPLE = 4096
+MIN_COMPRESSIBLE_SAMPLE = 512
+# Fingerprints keep the smallest hashes of an object's lines; pairs estimated
+# to share less than MIN_RESEMBLANCE of their lines are not diffed
+FINGERPRINT_SIZE = 64
+MIN_FINGERPRINT_PIECES = 8
+MIN_RESEMBLANCE = 0.25
+
+
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _decode_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def _encode_copy(offset, size):
+    """Encode a git-style copy instruction."""
+    out = bytearray([0x80])
+    for i in range(4):
+        byte = (offset >> (8 * i)) & 0xff
+        if byte:
+            out[0] |= 1 << i
+            out.append(byte)
+    for i in range(3):
+        byte = (size >> (8 * i)) & 0xff
+        if byte:
+            out[0] |= 1 << (4 + i)
+            out.append(byte)
+    return bytes(out)
+
+
+def create_delta(base, target):
+    """Encode target as copy/insert instructions against base.
+
+    Uses the git delta encoding: a header with both sizes, then a stream of
+    copy (offset, size) and literal insert instructions.
+    """
+    out = bytearray(_encode_varint(len(base)) + _encode_varint(len(target)))
+
+    # Index the base by fixed-size blocks; the first occurrence wins
+    index = {}
+    for pos in range(0, len(base) - DELTA_BLOCK + 1, DELTA_BLOCK):
+        index.setdefault(base[pos:pos + DELTA_BLOCK], pos)
+
+    pending = bytearray()
+
+    def flush_pending():
+        for start in range(0, len(pending), 127):
+            piece = pending[start:start + 127]
+            out.append(len(piece))
+            out.extend(piece)
+        pending.clear()
+
+    pos = 0
+    target_len = len(target)
+    while pos < target_len:
+        base_pos = index.get(target[pos:pos + DELTA_BLOCK]) if pos + DELTA_BLOCK <= target_len else None
+        if base_pos is None:
+            pending.append(target[pos])
+            pos += 1
+            continue
+
+        # Extend the match backwards into the pending literals
+        while pending and base_pos > 0 and base[base_pos - 1] == pending[-1]:
+            base_pos -= 1
+            pos -= 1
+            pending.pop()
+
+        # Extend the match forwards, comparing in doubling strides
+        length = 0
+        stride = DELTA_BLOCK
+        limit = min(len(base) - base_pos, target_len - pos)
+        while length < limit:
+            step = min(stride, limit - length)
+            if base[base_pos + length:base_pos + length + step] == target[pos + length:pos + length + step]:
+                length += step
+                stride *= 2
+            elif step == 1:
+                break
+            else:
+                stride = max(1, step // 2)
+
+        flush_pending()
+        copied = 0
+        while copied < length:
+            size = min(length - copied, 0xffffff)
+            out.extend(_encode_copy(base_pos + copied, size))
+            copied += size
+        pos += length
+
+    flush_pending()
+    return bytes(out)
+
+
+def apply_delta(base, delta):
+    """Rebuild an object from its delta base and delta instructions."""
+    base_size, pos = _decode_varint(delta, 0)
+    if base_size != len(base):
+        raise ValueError('Delta base size mismatch')
+    result_size, pos = _decode_varint(delta, pos)
+    out = bytearray()
+    delta_len = len(delta)
+    while pos < delta_len:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            offset = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            size = 0
+            for i in range(3):
+                if op & (1 << (4 + i)):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            out += base[offset:offset + size]
+        elif op:
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise ValueError('Invalid delta instruction')
+    if len(out) != result_size:
+        raise ValueError('Delta result size mismatch')
+    return bytes(out)
+
+
+def _compresses(data):
+    """Check whether a sample of data compresses; compressed or random content rarely deltas well."""
+    sample = data[:COMPRESSIBILITY_SAMPLE]
+    if len(sample) < MIN_COMPRESSIBLE_SAMPLE:
+        return True
+    return len(zlib.compress(sample, 1)) < len(sample) * 0.9
+
+
+def _fingerprint(data):
+    """Return a bottom-k sketch of data's lines, or None if there are too few lines to go by.
+
+    Binary content is cut at its newline bytes too, about every 256 bytes.
+    """
+    pieces = set(map(hash, data.split(b'\n')))
+    if len(pieces) < MIN_FINGERPRINT_PIECES:
+        return None
+    return frozenset(heapq.nsmallest(FINGERPRINT_SIZE, pieces))
+
+
+def _resemblance(a, b):
+    """Estimate the share of lines two objects have in common from their fingerprints."""
+    if a is None or b is None:
+        return 1.0
+    smallest = heapq.nsmallest(FINGERPRINT_SIZE, a | b)
+    return sum(1 for h in smallest if h in a and h in b) / len(smallest)
+
+
+def _choose_deltas(objects, load, deadline=None):
+    """Load objects one at a time and pick a delta base for each from a sliding window of similar objects.
+
+    objects is a list of (oid, type, size). They are grouped by type and
+    taken largest first, so most deltas describe removals, which encode
+    smaller than insertions. Yields (oid, type, data, delta) in that order,
+    delta being (base_oid, delta bytes) or None; only the window's objects
+    are held in memory. Objects that do not compress are not diffed, nor
+    are pairs whose fingerprints show little in common, and once deadline
+    (a time.monotonic() value) passes the remaining objects are stored whole.
+    """
+    order = sorted(objects, key=lambda o: (o[1], -o[2]))
+    depth = {}
+    window = []
+    for oid, obj_type, _ in order:
+        data = load(oid)
+        if window and window[-1][1] != obj_type:
+            window = []
+        searching = (len(data) <= MAX_DELTA_SOURCE and (deadline is None or time.monotonic() < deadline)
+                     and _compresses(data))
+        fingerprint = _fingerprint(data) if searching else None
+        best = None
+        if searching:
+            for base_oid, _, base_data, base_fingerprint in window:
+                if depth.get(base_oid, 0) >= MAX_DELTA_DEPTH:
+                    continue
+                # Skip bases whose size or content rules out a worthwhile delta
+                if len(base_data) < len(data) // 4:
+                    continue
+                if _resemblance(fingerprint, base_fingerprint) < MIN_RESEMBLANCE:
+                    continue
+                delta = create_delta(base_data, data)
+                limit = len(best[1]) if best else len(data) // 2
+                if len(delta) < limit:
+                    best = (base_oid, delta)
+        if best:
+            depth[oid] = depth.get(best[0], 0) + 1
+        yield oid, obj_type, data, best
+        if searching:
+            window.append((oid, obj_type, data, fingerprint))
+            if len(window) > DELTA_WINDOW:
+                window.pop(0)
+
+
+def write_pack(pack_dir, objects, load, max_delta_seconds=DELTA_SEARCH_SECONDS):
+    """Write objects into a new pack and index.
+
+    objects is a list of (oid, type, size) tuples; size only orders the
+    delta search and may be an estimate. load(oid) returns an object's raw
+    payload without its type prefix, and is called once per object as the
+    object is written, so a pack never holds more than its delta window in
+    memory. Returns the base path of the pack (without extension), or None
+    if there was nothing to write.
+    """
+    if not objects:
+        return None
+    os.makedirs(pack_dir, exist_ok=True)
+
+    oids = sorted(oid for oid, _, _ in objects)
+    name = hashlib.sha1(''.join(oids).encode()).hexdigest()
+    base_path = os.path.join(pack_dir, f'pack-{name}')
+    tmp_pack = base_path + '.pack.tmp'
+    tmp_idx = base_path + '.idx.tmp'
+
+    offsets = {}
+    checksum = hashlib.sha1()
+    with open(tmp_pack, 'wb') as f:
+        header = PACK_SIGNATURE + struct.pack('>II', PACK_VERSION, len(objects))
+        f.write(header)
+        checksum.update(header)
+        offset = len(header)
+        deadline = time.monotonic() + max_delta_seconds
+        for oid, obj_type, data, base in _choose_deltas(objects, load, deadline):
+            if base:
+                base_oid, delta = base
+                payload = zlib.compress(delta)
+                entry = ENTRY_HEADER.pack(DELTA_CODE, len(delta), len(payload)) + bytes.fromhex(base_oid)
+            else:
+                payload = zlib.compress(data)
+                entry = ENTRY_HEADER.pack(TYPE_CODES[obj_type], len(data), len(payload))
+            offsets[oid] = offset
+            for chunk in (entry, payload):
+                f.write(chunk)
+                checksum.update(chunk)
+                offset += len(chunk)
+        pack_sum = checksum.digest()
+        f.write(pack_sum)
+
+    fanout = [0] * 256
+    for oid in oids:
+        fanout[int(oid[:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    idx = bytearray(IDX_SIGNATURE + struct.pack('>I', PACK_VERSION))
+    idx += struct.pack('>256I', *fanout)
+    for oid in oids:
+        idx += bytes.fromhex(oid)
+    for oid in oids:
+        idx += struct.pack('>Q', offsets[oid])
+    idx += pack_sum
+    idx += hashlib.sha1(idx).digest()
+    with open(tmp_idx, 'wb') as f:
+        f.write(idx)
+
+    # The index goes live last so readers never see an index without its pack
+    os.replace(tmp_pack, base_path + '.pack')
+    os.replace(tmp_idx, base_path + '.idx')
+    return base_path
+
+
+class PackFile:
+    """Read-only view of a pack and its index."""
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.pack_path = base_path + '.pack'
+        self.idx_path = base_path + '.idx'
+        with open(self.idx_path, 'rb') as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._idx[:4] != IDX_SIGNATURE:
+            raise ValueError(f'Invalid pack index: {self.idx_path}')
+        self._fanout = struct.unpack_from('>256I', self._idx, 8)
+        self.count = self._fanout[255]
+        self._oid_start = 8 + 256 * 4
+        self._offset_start = self._oid_start + 20 * self.count
+        self._pack = None
+
+    def _pack_map(self):
+        if self._pack is None:
+            with open(self.pack_path, 'rb') as f:
+                self._pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._pack
+
+    def _oid_at(self, i):
+        start = self._oid_start + 20 * i
+        return self._idx[start:start + 20]
+
+    def find_offset(self, obj_hash):
+        """Return the pack offset of obj_hash, or None if it is not in this pack."""
+        try:
+            key = bytes.fromhex(obj_hash)
+        except ValueError:
+            return None
+        if len(key) != 20:
+            return None
+        first = key[0]
+        lo = self._fanout[first - 1] if first else 0
+        hi = self._fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self._oid_at(mid)
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return struct.unpack_from('>Q', self._idx, self._offset_start + 8 * mid)[0]
+        return None
+
+    def __contains__(self, obj_hash):
+        return self.find_offset(obj_hash) is not None
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._oid_at(i).hex()
+
+    def read(self, obj_hash):
+        """Return (type, data) for obj_hash, or None if it is not in this pack."""
+        offset = self.find_offset(obj_hash)
+        if offset is None:
+            return None
+        return self._read_at(offset, 0)
+
+    def object_type(self, obj_hash):
+        """Return the type of obj_hash, following delta bases, or None if it is not in this pack."""
+        offset = self.find_offset(obj_hash)
+        if offset is None:
+            return None
+        pack = self._pack_map()
+        code = ENTRY_HEADER.unpack_from(pack, offset)[0]
+        while code == DELTA_CODE:
+            base_hash = pack[offset + ENTRY_HEADER.size:offset + ENTRY_HEADER.size + 20].hex()
+            offset = self.find_offset(base_hash)
+            if offset is None:
+                raise ValueError(f'Unresolvable delta base {base_hash} in {self.pack_path}')
+            code = ENTRY_HEADER.unpack_from(pack, offset)[0]
+        return TYPE_NAMES[code]
+
+    def size(self, obj_hash):
+        """Return the uncompressed size of obj_hash, or None if it is not in this pack."""
+        offset = self.find_offset(obj_hash)
+        if offset is None:
+            return None
+        pack = self._pack_map()
+        code, size, clen = ENTRY_HEADER.unpack_from(pack, offset)
+        if code != DELTA_CODE:
+            return size
+        # The result size sits in the delta header, right after the base size
+        start = offset + ENTRY_HEADER.size + 20
+        head = zlib.decompressobj().decompress(pack[start:start + clen], 20)
+        _, pos = _decode_varint(head, 0)
+        return _decode_varint(head, pos)[0]
+
+    def stream(self, obj_hash, chunk_size=65536):
+        """Return (type, iterator of data chunks, size) for obj_hash, or None.
+
+        Whole entries are decompressed incrementally straight out of the
+        mmap; deltified entries are only rebuilt in memory once the iterator
+        is first advanced.
+        """
+        offset = self.find_offset(obj_hash)
+        if offset is None:
+            return None
+        pack = self._pack_map()
+        code, size, clen = ENTRY_HEADER.unpack_from(pack, offset)
+        if code == DELTA_CODE:
+            base_offset = offset
+            while code == DELTA_CODE:
+                base_hash = pack[base_offset + ENTRY_HEADER.size:base_offset + ENTRY_HEADER.size + 20].hex()
+                base_offset = self.find_offset(base_hash)
+                if base_offset is None:
+                    raise ValueError(f'Unresolvable delta base {base_hash} in {self.pack_path}')
+                code = ENTRY_HEADER.unpack_from(pack, base_offset)[0]
+
+            def resolve():
+                yield self._read_at(offset, 0)[1]
+
+            return TYPE_NAMES[code], resolve(), self.size(obj_hash)
+        start = offset + ENTRY_HEADER.size
+        return TYPE_NAMES[code], _inflate(memoryview(pack)[start:start + clen], chunk_size), size
+
+    def _read_at(self, offset, depth):
+        pack = self._pack_map()
+        code, size, clen = ENTRY_HEADER.unpack_from(pack, offset)
+        offset += ENTRY_HEADER.size
+        if code == DELTA_CODE:
+            base_hash = pack[offset:offset + 20].hex()
+            offset += 20
+            delta = zlib.decompress(pack[offset:offset + clen])
+            base_offset = self.find_offset(base_hash)
+            if base_offset is None or depth > MAX_DELTA_DEPTH:
+                raise ValueError(f'Unresolvable delta base {base_hash} in {self.pack_path}')
+            base_type, base_data = self._read_at(base_offset, depth + 1)
+            return base_type, apply_delta(base_data, delta)
+        data = zlib.decompress(pack[offset:offset + clen])
+        if len(data) != size:
+            raise ValueError(f'Corrupt pack entry at offset {offset} in {self.pack_path}')
+        return TYPE_NAMES[code], data
+
+    def close(self):
+        try:
+            if self._pack is not None:
+                self._pack.close()
+            self._idx.close()
+        except BufferError:
+            # A stream still holds a view into the pack; the map is
+            # released when that stream is garbage collected.
+            pass
+        self._pack = None
+
+
+def _inflate(compressed, chunk_size):
+    """Yield decompressed pieces of at most chunk_size bytes."""
+    decompressor = zlib.decompressobj()
+    try:
+        for start in range(0, len(compressed), chunk_size):
+            data = decompressor.decompress(compressed[start:start + chunk_size], chunk_size)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+        data = decompressor.flush()
+        if data:
+            yield data
+    finally:
+        compressed.release()
+
+
+def list_packs(pack_dir):
+    """Return base paths of all complete packs in pack_dir."""
+    if not os.path.isdir(pack_dir):
+        return []
+    packs = []
+    for name in sorted(os.listdir(pack_dir)):
+        if name.startswith('pack-') and name.endswith('.idx'):
+            base = os.path.join(pack_dir, name[:-4])
+            if os.path.exists(base + '.pack'):
+                packs.append(base)
+    return packs
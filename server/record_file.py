@@ -0,0 +1,80 @@
+"""Shared in-memory views of append-only record files.
+
+The commit graph and its changed-path filters are both stored as a fixed
+header followed by records that are only ever appended, so a reader can
+pick up new records by reading past the size it last saw. A record cut
+short by an interrupted append is ignored when reading and truncated away
+before the next append, so later records stay aligned.
+"""
+import os
+import threading
+
+
+class AppendOnlyRecordFile:
+    """Base class for a view of one append-only record file, refreshed incrementally as it grows.
+
+    Subclasses set HEADER, DESCRIPTION (used in errors) and _views, a dict
+    of the shared view per path, and implement _reset() to clear what they
+    have loaded and _load(data) to load the complete records at the start
+    of data, returning the number of bytes they took up.
+    """
+    HEADER = b''
+    DESCRIPTION = 'record file'
+    _views = None
+    _views_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._size = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    @classmethod
+    def open(cls, path):
+        """Return the shared view of path, loading any records appended since the last call."""
+        with cls._views_lock:
+            view = cls._views.get(path)
+            if view is None:
+                view = cls._views[path] = cls(path)
+        view.refresh()
+        return view
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _load(self, data):
+        raise NotImplementedError
+
+    def refresh(self):
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                size = 0
+            if size < self._size:
+                # The file was rewritten; start over
+                self._size = 0
+                self._reset()
+            if size <= max(self._size, len(self.HEADER)):
+                return
+            with open(self.path, 'rb') as f:
+                if self._size == 0:
+                    if f.read(len(self.HEADER)) != self.HEADER:
+                        raise ValueError(f'Invalid {self.DESCRIPTION} file: {self.path}')
+                    self._size = len(self.HEADER)
+                f.seek(self._size)
+                data = f.read(size - self._size)
+            self._size += self._load(data)
+
+    def _append_records(self, records):
+        """Append encoded records to the file and load them. Callers hold the file's lock."""
+        if not records:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as f:
+            # Drop any torn record an interrupted append left behind, so new records stay aligned
+            f.truncate(self._size)
+            if self._size == 0:
+                f.write(self.HEADER)
+            f.write(b''.join(records))
+        self.refresh()
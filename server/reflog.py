@@ -0,0 +1,97 @@
+"""Append-only reflog recording every move of a ref.
+
+Each ref has a log under ``logs/<ref name>`` made of fixed-width records,
+one per update:
+
+    timestamp (8, float seconds) | old commit (20) | new commit (20) |
+    message length (2) | message (78, UTF-8, truncated)
+
+Updates only ever append one record, and because records have a fixed
+size, entries in a time range are found by binary search over record
+offsets instead of reading the whole log.
+"""
+import os
+import struct
+import time
+
+RECORD = struct.Struct('>d20s20sH78s')
+MESSAGE_BYTES = 78
+NO_COMMIT = b'\0' * 20
+
+
+def _encode_message(message):
+    data = (message or '').encode('utf-8')[:MESSAGE_BYTES]
+    # Do not leave half of a multi-byte character at the cut
+    return data.decode('utf-8', errors='ignore').encode('utf-8')
+
+
+def append_entry(path, old, new, message, timestamp=None):
+    """Append one record to the log at path; old or new may be None.
+
+    Callers hold the ref's lock.
+    """
+    message = _encode_message(message)
+    record = RECORD.pack(
+        time.time() if timestamp is None else timestamp,
+        bytes.fromhex(old) if old else NO_COMMIT,
+        bytes.fromhex(new) if new else NO_COMMIT,
+        len(message),
+        message
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A single small write to an O_APPEND file is never interleaved with another
+    with open(path, 'ab') as f:
+        # Drop any torn record an interrupted append left behind, so new records stay aligned
+        size = f.seek(0, os.SEEK_END)
+        if size % RECORD.size:
+            f.truncate(size - size % RECORD.size)
+        f.write(record)
+
+
+def _unpack(data):
+    timestamp, old, new, length, message = RECORD.unpack(data)
+    return {
+        'timestamp': timestamp,
+        'old': old.hex() if old != NO_COMMIT else None,
+        'new': new.hex() if new != NO_COMMIT else None,
+        'message': message[:length].decode('utf-8', errors='replace')
+    }
+
+
+def _first_at_or_after(f, count, timestamp):
+    """Binary search for the index of the first record with a timestamp >= timestamp."""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid * RECORD.size)
+        if RECORD.unpack(f.read(RECORD.size))[0] < timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def read_entries(path, since=None, until=None, limit=None):
+    """Return log entries with since <= timestamp < until, newest first.
+
+    Records are appended in time order, so the range is located by binary
+    search and only the matching records are read.
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return []
+    # Ignore a partially written trailing record
+    count = size // RECORD.size
+    with open(path, 'rb') as f:
+        start = _first_at_or_after(f, count, since) if since is not None else 0
+        end = _first_at_or_after(f, count, until) if until is not None else count
+        if limit is not None:
+            start = max(start, end - limit)
+        if start >= end:
+            return []
+        f.seek(start * RECORD.size)
+        data = f.read((end - start) * RECORD.size)
+    entries = [_unpack(data[i:i + RECORD.size]) for i in range(0, len(data), RECORD.size)]
+    entries.reverse()
+    return entries
@@ -1,12 +1,18 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, current_app, Response
 from .models import db, User, Repository, Branch, Commit, File, CommitFiles, WorkingTree, StagingArea
 from .error import success_response, error_response, APIError
 from .utils import validate_params, error_handler, get_pagination_params, Pagination
-from .vcs import GitRepository
+from .vcs import GitRepository, RefUpdateError, decode_file_content
+from .diff import DEFAULT_CONTEXT
+from .archive import ARCHIVE_FORMATS, archive_path, iter_archive
+from .gc import GC_MAX_SECONDS, collect_garbage
+from .cache import cache
+from .multipart import MultipartReader
 import os
-from datetime import datetime
-import zipfile
-import io
+import mimetypes
+import json
+import re
+from datetime import datetime, timezone
 from functools import wraps
 import jwt
 from datetime import timedelta
@@ -15,9 +21,24 @@ import traceback
 
 api = Blueprint('api', __name__)
 
+# Diffs are keyed by immutable commit hashes, so they can live as long as Redis keeps them
+DIFF_CACHE_TIMEOUT = 7 * 24 * 3600
+MAX_DIFF_CONTEXT = 100
+# Commit message and branch fields of a streamed commit
+MAX_STREAM_FIELD_SIZE = 64 * 1024
+
 def debug_log(msg):
     print(f'[DEBUG ROUTES] {msg}')
 
+def stream_object(stream, chunk_size=65536):
+    """Yield an open object stream in chunks, closing it when done."""
+    with stream:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -178,6 +199,8 @@ def api_delete_repo(repo_id):
     repo_path = os.path.join('repos', str(repo.id))
     if os.path.exists(repo_path):
         import shutil
+        for folder in GitRepository(repo_path).snapshot_folders():
+            shutil.rmtree(folder)
         shutil.rmtree(repo_path)
     return jsonify({'success': True})
 
@@ -207,6 +230,8 @@ def delete_repo(current_user, repo_id):
     if os.path.exists(repo_path):
         import shutil
         print(f'[DEBUG] Deleting repo folder: {repo_path}')
+        for folder in GitRepository(repo_path).snapshot_folders():
+            shutil.rmtree(folder)
         shutil.rmtree(repo_path)
     print('[DEBUG] Repo deleted successfully')
     return jsonify({'success': True})
@@ -234,9 +259,12 @@ def create_file(current_user, repo_id):
         return jsonify({'message': 'Unauthorized'}), 403
     data = request.get_json()
     file_path = data.get('name')
-    content = data.get('content', '')
     if not file_path:
         return jsonify({'message': 'Missing file name'}), 400
+    try:
+        content = decode_file_content(data)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     git_repo = GitRepository(os.path.join('repos', str(repo_id)))
     git_repo.write_file(file_path, content)
     # Add to working tree (DB)
@@ -263,11 +291,37 @@ def get_file(current_user, repo_id, file_path):
         return jsonify({'message': 'Unauthorized'}), 403
         
     git_repo = GitRepository(os.path.join('repos', str(repo_id)))
-    content = git_repo.get_file_content(file_path)
-    
-    if content is None:
-        return jsonify({'message': 'File not found'}), 404
-    return jsonify({'content': content})
+    encoding = request.args.get('encoding')
+    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    ref = request.args.get('ref')
+    if ref:
+        # Serve the blob straight from the object store at the given ref
+        commit_hash = git_repo.resolve_commit(ref)
+        entry = git_repo.lookup_path(git_repo._commit_tree(commit_hash), file_path) if commit_hash else None
+        if entry is None or entry[0] != 'blob':
+            return jsonify({'message': 'File not found'}), 404
+        stream = git_repo.open_object(entry[1])
+        if not encoding:
+            return Response(stream_object(stream), mimetype=mimetype)
+        with stream:
+            content = stream.read()
+    else:
+        if not encoding:
+            abs_path = git_repo.get_file_path(file_path)
+            if abs_path is None:
+                return jsonify({'message': 'File not found'}), 404
+            return send_file(os.path.abspath(abs_path), mimetype=mimetype)
+        content = git_repo.get_file_content(file_path)
+        if content is None:
+            return jsonify({'message': 'File not found'}), 404
+
+    # Text was explicitly requested
+    try:
+        return jsonify({'content': content.decode(encoding)})
+    except LookupError:
+        return jsonify({'message': f'Unknown encoding {encoding}'}), 400
+    except UnicodeDecodeError:
+        return jsonify({'message': f'File is not valid {encoding}'}), 415
 
 @api.route('/repos/<int:repo_id>/files/<path:file_path>', methods=['PUT'])
 @token_required
@@ -276,9 +330,15 @@ def write_file(current_user, repo_id, file_path):
     if repo.user_id != current_user.id:
         return jsonify({'message': 'Unauthorized'}), 403
         
-    data = request.get_json()
     git_repo = GitRepository(os.path.join('repos', str(repo_id)))
-    git_repo.write_file(file_path, data['content'])
+    if request.is_json:
+        try:
+            content = decode_file_content(request.get_json())
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+    else:
+        content = request.get_data()
+    git_repo.write_file(file_path, content)
     # Add to working tree (DB)
     from .models import WorkingTree, File as DBFile
     db_file = DBFile.query.filter_by(filename=file_path, repo_id=repo_id).first()
@@ -368,9 +428,92 @@ def create_commit(current_user, repo_id):
     data = request.get_json()
     git_repo = GitRepository(os.path.join('repos', str(repo_id)))
     
-    commit_hash = git_repo.commit(data['message'], data['files'])
+    try:
+        commit_hash = git_repo.commit(data['message'], data['files'], branch=data.get('branch'))
+    except RefUpdateError as e:
+        return jsonify({'message': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     return jsonify({'commit_hash': commit_hash})
 
+@api.route('/repos/<int:repo_id>/commits/stream', methods=['POST'])
+@token_required
+def create_commit_stream(current_user, repo_id):
+    """Create a commit from a streamed body instead of one JSON document.
+
+    The body is either NDJSON (application/x-ndjson), one JSON object per
+    line: {"message": ..., "branch": ...} plus one {"name", "content",
+    "encoding"} object per file; or multipart/form-data with "message" and
+    "branch" fields and one file part per file, its filename being the
+    path in the repository. Files are stored as they are read off the body,
+    which is never spooled, so at most a chunk of one file is held at a time.
+    """
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    message = request.args.get('message')
+    branch = request.args.get('branch')
+    entries = {}
+    total_bytes = 0
+
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            return jsonify({'message': 'Missing multipart boundary'}), 400
+        # request.files would spool the whole body before we saw any of it
+        parts = MultipartReader(request.stream, boundary, max_parts=request.max_form_parts)
+        try:
+            for part in parts:
+                if part.filename is None:
+                    if part.name in ('message', 'branch'):
+                        value = part.read(MAX_STREAM_FIELD_SIZE + 1)
+                        if len(value) > MAX_STREAM_FIELD_SIZE:
+                            return jsonify({'message': f'Field {part.name} is too large'}), 400
+                        if part.name == 'message':
+                            message = value.decode('utf-8', 'replace')
+                        else:
+                            branch = value.decode('utf-8', 'replace')
+                    continue
+                if not part.filename:
+                    return jsonify({'message': 'File part without a filename'}), 400
+                entries[part.filename] = git_repo.write_blob_stream(part)
+                total_bytes += part.size
+        except ValueError:
+            return jsonify({'message': 'Malformed multipart body'}), 400
+    elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        for line_number, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                return jsonify({'message': f'Invalid JSON on line {line_number}'}), 400
+            if not isinstance(item, dict):
+                return jsonify({'message': f'Expected a JSON object on line {line_number}'}), 400
+            if 'name' not in item:
+                message = item.get('message', message)
+                branch = item.get('branch', branch)
+                continue
+            try:
+                content = decode_file_content(item)
+            except ValueError as e:
+                return jsonify({'message': f'{e} on line {line_number}'}), 400
+            entries[item['name']] = git_repo._save_blob(content)
+            total_bytes += len(content)
+    else:
+        return jsonify({'message': 'Expected application/x-ndjson or multipart/form-data'}), 415
+
+    if not message:
+        return jsonify({'message': 'Missing commit message'}), 400
+    try:
+        commit_hash = git_repo.commit_blobs(message, entries, branch=branch)
+    except RefUpdateError as e:
+        return jsonify({'message': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'commit_hash': commit_hash, 'files': len(entries), 'bytes': total_bytes})
+
 @api.route('/repos/<int:repo_id>/commits', methods=['GET'])
 @token_required
 def get_commits(current_user, repo_id):
@@ -378,8 +521,146 @@ def get_commits(current_user, repo_id):
     if repo.user_id != current_user.id:
         return jsonify({'message': 'Unauthorized'}), 403
     git_repo = GitRepository(os.path.join('repos', str(repo_id)))
-    commits = git_repo.list_commits()
-    return jsonify(commits)
+    if not any(arg in request.args for arg in ('limit', 'before', 'ref', 'path')):
+        commits = git_repo.list_commits()
+        return jsonify(commits)
+
+    # Cursor pagination, newest first
+    try:
+        limit = min(
+            int(request.args.get('limit', current_app.config.get('DEFAULT_PAGE_SIZE', 50))),
+            current_app.config.get('MAX_PAGE_SIZE', 100)
+        )
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Invalid limit'}), 400
+    limit = max(1, limit)
+    ref = request.args.get('ref')
+    before = request.args.get('before')
+    if ref and not git_repo.resolve_commit(ref):
+        return jsonify({'message': 'Ref not found'}), 404
+    if before and not git_repo.resolve_commit(before):
+        return jsonify({'message': 'Cursor commit not found'}), 404
+    page = git_repo.list_commits_page(limit, before=before, ref=ref, path=request.args.get('path'))
+    page['limit'] = limit
+    return jsonify(page)
+
+def get_diff_context():
+    try:
+        return min(max(int(request.args.get('context', DEFAULT_CONTEXT)), 0), MAX_DIFF_CONTEXT)
+    except (TypeError, ValueError):
+        raise APIError('Invalid context', status_code=400)
+
+def cached_diff(old_commit, new_commit, context, compute):
+    """Diffs between two commit hashes never change, so cache them for a long time."""
+    key = f"diff:{old_commit}:{new_commit}:{context}"
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.set(key, result, expire=DIFF_CACHE_TIMEOUT)
+    return result
+
+@api.route('/repos/<int:repo_id>/commits/<commit_hash>/diff', methods=['GET'])
+@token_required
+def get_commit_diff(current_user, repo_id, commit_hash):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    commit_hash = git_repo.resolve_commit(commit_hash)
+    if not commit_hash:
+        return jsonify({'message': 'Commit not found'}), 404
+    context = get_diff_context()
+    parents = git_repo.commit_parents(commit_hash)
+    parent = parents[0] if parents else None
+    result = cached_diff(parent, commit_hash, context,
+                         lambda: git_repo.diff_commits(parent, commit_hash, context))
+    return jsonify(result)
+
+@api.route('/repos/<int:repo_id>/compare/<path:spec>', methods=['GET'])
+@token_required
+def compare_commits(current_user, repo_id, spec):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    if '...' not in spec:
+        return jsonify({'message': 'Expected <base>...<head>'}), 400
+    base_ref, head_ref = spec.split('...', 1)
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    base = git_repo.resolve_commit(base_ref)
+    head = git_repo.resolve_commit(head_ref)
+    if not base or not head:
+        return jsonify({'message': 'Commit not found'}), 404
+    # Like git's a...b, compare against where head branched off base
+    merge_base = git_repo.merge_base(base, head) or base
+    context = get_diff_context()
+    result = cached_diff(merge_base, head, context,
+                         lambda: git_repo.diff_commits(merge_base, head, context))
+    result = dict(result, base=base, head=head, merge_base=merge_base)
+    return jsonify(result)
+
+@api.route('/repos/<int:repo_id>/status', methods=['GET'])
+@token_required
+def get_status(current_user, repo_id):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    return jsonify(git_repo.status())
+
+@api.route('/repos/<int:repo_id>/blame/<path:file_path>', methods=['GET'])
+@token_required
+def blame_file(current_user, repo_id, file_path):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    commit_hash = git_repo.resolve_commit(request.args.get('ref'))
+    if not commit_hash:
+        return jsonify({'message': 'Ref not found'}), 404
+    entry = git_repo.lookup_path(git_repo._commit_tree(commit_hash), file_path)
+    if entry is None or entry[0] != 'blob':
+        return jsonify({'message': 'File not found'}), 404
+    try:
+        return jsonify(git_repo.blame(commit_hash, file_path))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+@api.route('/repos/<int:repo_id>/search', methods=['GET'])
+@token_required
+def search_repo(current_user, repo_id):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    query = request.args.get('q', '')
+    if not query:
+        return jsonify({'message': 'Missing q'}), 400
+    regex = request.args.get('regex', '').lower() in ('1', 'true', 'yes')
+    ignore_case = request.args.get('ignore_case', '').lower() in ('1', 'true', 'yes')
+    ref = request.args.get('ref')
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    if not git_repo.resolve_commit(ref):
+        return jsonify({'message': 'Ref not found'}), 404
+    try:
+        results = git_repo.search(query, ref, regex=regex, ignore_case=ignore_case)
+    except re.error as e:
+        return jsonify({'message': f'Invalid regex: {e}'}), 400
+    return jsonify({'query': query, 'results': results})
+
+@api.route('/repos/<int:repo_id>/gc', methods=['POST'])
+@token_required
+def gc_repo(current_user, repo_id):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        max_seconds = float(data.get('max_seconds', GC_MAX_SECONDS))
+        max_bytes = int(data['max_bytes']) if data.get('max_bytes') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Invalid budget'}), 400
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    stats = collect_garbage(git_repo, max_bytes=max_bytes, max_seconds=max_seconds)
+    return jsonify(stats)
 
 @api.route('/repos/<int:repo_id>/graph', methods=['GET'])
 @token_required
@@ -391,6 +672,22 @@ def get_graph(current_user, repo_id):
     graph = git_repo.get_commit_graph() if hasattr(git_repo, 'get_commit_graph') else []
     return jsonify(graph)
 
+@api.route('/repos/<int:repo_id>/tree', methods=['GET'])
+@token_required
+def get_tree(current_user, repo_id):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    commit_hash = git_repo.resolve_commit(request.args.get('ref'))
+    if not commit_hash:
+        return jsonify({'message': 'Ref not found'}), 404
+    try:
+        entries = git_repo.list_tree(git_repo._commit_tree(commit_hash), request.args.get('path', ''))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 404
+    return jsonify(entries)
+
 @api.route('/repos/<int:repo_id>/branches', methods=['GET'])
 @token_required
 def list_branches(current_user, repo_id):
@@ -398,11 +695,8 @@ def list_branches(current_user, repo_id):
     if repo.user_id != current_user.id:
         return jsonify({'message': 'Unauthorized'}), 403
         
-    branches_dir = os.path.join('repos', str(repo_id), 'refs', 'heads')
-    branches = []
-    for branch in os.listdir(branches_dir):
-        branches.append({'name': branch})
-    return jsonify(branches)
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    return jsonify(git_repo.list_branches())
 
 @api.route('/repos/<int:repo_id>/branches', methods=['POST'])
 @token_required
@@ -413,7 +707,12 @@ def create_branch(current_user, repo_id):
         
     data = request.get_json()
     git_repo = GitRepository(os.path.join('repos', str(repo_id)))
-    git_repo.create_branch(data['name'], data.get('start_point', 'HEAD'))
+    try:
+        git_repo.create_branch(data['name'], data.get('start_point', 'HEAD'))
+    except RefUpdateError:
+        return jsonify({'message': f"Branch {data['name']} already exists"}), 409
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     
     return jsonify({'message': 'Branch created'})
 
@@ -426,9 +725,66 @@ def checkout_branch(current_user, repo_id):
         
     data = request.get_json()
     git_repo = GitRepository(os.path.join('repos', str(repo_id)))
-    git_repo.checkout(data['branch'])
+    dry_run = bool(data.get('dry_run', False))
+    plan = git_repo.checkout(data['branch'], dry_run=dry_run)
     
-    return jsonify({'message': 'Checked out branch'})
+    if dry_run:
+        return jsonify({'dry_run': True, 'operations': plan['operations'], 'bytes_to_write': plan['bytes_to_write']})
+    return jsonify({'message': 'Checked out branch', 'operations': len(plan['operations']), 'bytes_written': plan['bytes_to_write']})
+
+@api.route('/repos/<int:repo_id>/merge', methods=['POST'])
+@token_required
+def merge_branch(current_user, repo_id):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    data = request.get_json() or {}
+    ref = data.get('branch') or data.get('ref')
+    if not ref:
+        return jsonify({'message': 'Missing branch'}), 400
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    try:
+        result = git_repo.merge(ref, data.get('message'))
+    except RefUpdateError as e:
+        return jsonify({'message': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 404
+    if result['status'] == 'conflict':
+        return jsonify(dict(result, message='Merge conflict')), 409
+    return jsonify(result)
+
+def parse_time_arg(name):
+    """Read a query argument given as epoch seconds or an ISO 8601 UTC timestamp."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        raise APIError(f'Invalid {name}', status_code=400)
+
+@api.route('/repos/<int:repo_id>/reflog', methods=['GET'])
+@token_required
+def get_reflog(current_user, repo_id):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    ref = request.args.get('ref', 'HEAD')
+    if ref != 'HEAD' and not ref.startswith('refs/'):
+        ref = f'refs/heads/{ref}'
+    if ref != 'HEAD' and not git_repo.get_ref(ref):
+        return jsonify({'message': 'Invalid ref'}), 400
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({'message': 'Invalid limit'}), 400
+    entries = git_repo.get_reflog(ref, parse_time_arg('since'), parse_time_arg('until'), limit)
+    return jsonify({'ref': ref, 'entries': entries})
 
 @api.route('/repos/<int:repo_id>/revert', methods=['POST'])
 @token_required
@@ -466,16 +822,38 @@ def download_repo(current_user, repo_id):
     repo = Repository.query.get_or_404(repo_id)
     if repo.user_id != current_user.id:
         return jsonify({'message': 'Unauthorized'}), 403
-    repo_path = os.path.join('repos', str(repo_id))
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(repo_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, repo_path)
-                zipf.write(file_path, arcname)
-    zip_buffer.seek(0)
-    return send_file(zip_buffer, mimetype='application/zip', as_attachment=True, download_name=f'repo_{repo_id}.zip')
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    commit_hash = git_repo.resolve_commit()
+    if not commit_hash:
+        return jsonify({'message': 'Repository has no commits'}), 404
+    return send_archive(git_repo, git_repo._commit_tree(commit_hash), 'zip', f'repo_{repo_id}.zip')
+
+@api.route('/repos/<int:repo_id>/archive/<path:spec>', methods=['GET'])
+@token_required
+def download_archive(current_user, repo_id, spec):
+    repo = Repository.query.get_or_404(repo_id)
+    if repo.user_id != current_user.id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    fmt = next((f for f in ARCHIVE_FORMATS if spec.endswith('.' + f)), None)
+    if fmt is None:
+        return jsonify({'message': f"Unsupported archive format, use one of: {', '.join(ARCHIVE_FORMATS)}"}), 400
+    ref = spec[:-len(fmt) - 1]
+    git_repo = GitRepository(os.path.join('repos', str(repo_id)))
+    commit_hash = git_repo.resolve_commit(ref)
+    if not commit_hash:
+        return jsonify({'message': 'Ref not found'}), 404
+    name = re.sub(r'[^A-Za-z0-9._-]+', '-', ref)
+    return send_archive(git_repo, git_repo._commit_tree(commit_hash), fmt, f'repo_{repo_id}-{name}.{fmt}')
+
+def send_archive(git_repo, tree, fmt, download_name):
+    """Serve an archive of a tree from the archive cache, or stream it while filling the cache."""
+    mimetype = ARCHIVE_FORMATS[fmt]
+    cached_path = archive_path(git_repo, tree, fmt)
+    if os.path.exists(cached_path):
+        return send_file(os.path.abspath(cached_path), mimetype=mimetype, as_attachment=True,
+                         download_name=download_name)
+    return Response(iter_archive(git_repo, tree, fmt), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{download_name}"'})
 
 @api.route('/repos/<int:repo_id>/working-tree', methods=['GET'])
 @token_required
@@ -0,0 +1,415 @@
+"""Trigram code search over the files reachable from branch heads.
+
+Every text blob reachable from a branch is broken into the set of
+(lowercased) three-byte sequences it contains, and an inverted index maps
+each trigram to the blobs containing it. A query is reduced to the
+trigrams any match must contain; only blobs whose posting lists contain
+all of them are read and checked against the real pattern.
+
+Posting lists live in immutable shard files under ``cache/search/``, one
+written per index update, and are memory-mapped when searched. Each shard
+holds its blob hashes, a sorted table of trigrams, and for each trigram
+the sorted indexes of the blobs containing it:
+
+    b'TGRM' | version (4) | blob count (4) | trigram count (4) |
+    blob hashes (20 each) | trigrams (4 each) | posting offsets (4 each, count + 1) |
+    postings (4 each)
+
+with the arrays in native byte order. A small SQLite database records the
+tree indexed for each branch, and for each blob how many branch paths
+reference it and which shard holds it. Updating the index only diffs each
+branch's indexed tree against its new tree: new blobs go into a new shard,
+blobs no branch reaches any more are forgotten, and once there are too
+many shards the live postings are merged into one.
+"""
+import array
+import bisect
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+
+from .diff import is_binary
+
+logger = logging.getLogger(__name__)
+
+# Binary blobs and blobs larger than this are neither indexed nor searched
+MAX_INDEX_BYTES = 1024 * 1024
+MAX_RESULTS = 100
+MAX_LINE_LENGTH = 500
+MAX_SHARDS = 8
+
+SHARD_SIGNATURE = b'TGRM'
+SHARD_VERSION = 1
+SHARD_HEADER = struct.Struct('>4sIII')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS heads (ref TEXT PRIMARY KEY, tree TEXT);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL,
+    shard INTEGER
+);
+CREATE TABLE IF NOT EXISTS shards (id INTEGER PRIMARY KEY AUTOINCREMENT, blob_count INTEGER NOT NULL);
+"""
+
+_REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+_REGEX_QUANTIFIERS = set('*?{')
+# Escapes that stand for exactly one literal character
+_LITERAL_ESCAPES = set(r'.^$*+?{}[]\|()/-#&~ "\'')
+
+
+def trigrams(data):
+    """Return the set of trigram codes in a bytes value, case-folded."""
+    data = data.lower()
+    return {int.from_bytes(t, 'big') for t in {data[i:i + 3] for i in range(len(data) - 2)}}
+
+
+def required_literals(pattern):
+    """Return literal strings every match of a regex must contain.
+
+    Only top-level runs of plain characters are used; anything inside a
+    group or class, or made optional by a quantifier, is ignored. A
+    top-level alternation means no literal is required.
+    """
+    runs = []
+    current = []
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        literal = None
+        if char == '\\' and i + 1 < len(pattern):
+            if depth == 0 and pattern[i + 1] in _LITERAL_ESCAPES:
+                literal = pattern[i + 1]
+            i += 2
+        elif char == '[':
+            # Skip the class, honouring escapes and a leading ]
+            i += 2 if pattern[i + 1:i + 2] == ']' else 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        else:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char == '|' and depth == 0:
+                return []
+            elif depth == 0 and char not in _REGEX_SPECIAL:
+                literal = char
+            i += 1
+        if literal is not None and not (i < len(pattern) and pattern[i] in _REGEX_QUANTIFIERS):
+            current.append(literal)
+        else:
+            # A run ends at anything that is not a mandatory literal; x+ keeps
+            # its x, since the + only ends the run after it
+            if current:
+                runs.append(''.join(current))
+            current = []
+    if current:
+        runs.append(''.join(current))
+    return [run for run in runs if len(run.encode('utf-8')) >= 3]
+
+
+class Shard:
+    """Read-only view of a shard file, memory-mapped so only the pages a query touches are read."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        signature, version, blob_count, trigram_count = SHARD_HEADER.unpack_from(view)
+        if signature != SHARD_SIGNATURE or version != SHARD_VERSION:
+            raise ValueError(f'Invalid search shard: {path}')
+        offset = SHARD_HEADER.size
+        self._hashes = view[offset:offset + 20 * blob_count]
+        offset += 20 * blob_count
+        self.trigrams = view[offset:offset + 4 * trigram_count].cast('I')
+        offset += 4 * trigram_count
+        self.offsets = view[offset:offset + 4 * (trigram_count + 1)].cast('I')
+        offset += 4 * (trigram_count + 1)
+        self.postings = view[offset:offset + 4 * self.offsets[-1]].cast('I')
+        self.blob_count = blob_count
+
+    def blob(self, index):
+        return self._hashes[20 * index:20 * index + 20].hex()
+
+    def posting(self, trigram):
+        i = bisect.bisect_left(self.trigrams, trigram)
+        if i < len(self.trigrams) and self.trigrams[i] == trigram:
+            return self.postings[self.offsets[i]:self.offsets[i + 1]]
+        return self.postings[0:0]
+
+    def candidates(self, required):
+        """Return the hashes of blobs in this shard containing every required trigram."""
+        lists = sorted((self.posting(trigram) for trigram in required), key=len)
+        if not lists or not len(lists[0]):
+            return set()
+        matches = set(lists[0])
+        for posting in lists[1:]:
+            matches.intersection_update(posting)
+            if not matches:
+                return set()
+        return {self.blob(index) for index in matches}
+
+    def iter_postings(self):
+        """Yield (trigram, blob indexes) for every trigram in the shard."""
+        for i, trigram in enumerate(self.trigrams):
+            yield trigram, self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+
+def write_shard(path, blob_hashes, postings):
+    """Write a shard for a list of blob hashes and a dict of trigram -> sorted blob indexes."""
+    trigram_table = array.array('I', sorted(postings))
+    offsets = array.array('I', [0])
+    flat = array.array('I')
+    for trigram in trigram_table:
+        flat.extend(postings[trigram])
+        offsets.append(len(flat))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SHARD_HEADER.pack(SHARD_SIGNATURE, SHARD_VERSION, len(blob_hashes), len(trigram_table)))
+            f.write(b''.join(bytes.fromhex(h) for h in blob_hashes))
+            f.write(trigram_table.tobytes())
+            f.write(offsets.tobytes())
+            f.write(flat.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class SearchIndex:
+    def __init__(self, repo):
+        self.repo = repo
+        self.path = os.path.join(repo.repo_path, 'cache', 'search')
+        self.db_path = os.path.join(self.path, 'index.sqlite3')
+
+    def _connect(self):
+        os.makedirs(self.path, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _shard_path(self, shard_id):
+        return os.path.join(self.path, f'shard-{shard_id}.idx')
+
+    def update(self):
+        """Bring the index in line with the current branch heads.
+
+        Runs in one write transaction, so concurrent updates serialize and
+        each sees the heads the previous one recorded.
+        """
+        branches = {name: self.repo._commit_tree(commit)
+                    for name, commit in self.repo.list_refs('refs/heads/').items()}
+        conn = self._connect()
+        obsolete = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            indexed_heads = dict(conn.execute('SELECT ref, tree FROM heads'))
+            if indexed_heads == branches:
+                conn.execute('COMMIT')
+                return
+            added = []
+            for ref in sorted(set(indexed_heads) | set(branches)):
+                old_tree = indexed_heads.get(ref)
+                new_tree = branches.get(ref)
+                if old_tree == new_tree:
+                    continue
+                for _, old_blob, new_blob in self.repo.diff_trees(old_tree, new_tree):
+                    if new_blob:
+                        self._add_ref(conn, new_blob, added)
+                    if old_blob:
+                        self._drop_ref(conn, old_blob)
+                if new_tree:
+                    conn.execute('INSERT OR REPLACE INTO heads (ref, tree) VALUES (?, ?)', (ref, new_tree))
+                else:
+                    conn.execute('DELETE FROM heads WHERE ref = ?', (ref,))
+            # A blob added and dropped again within this update is gone already
+            live_added = [h for h in added if conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (h,)).fetchone()]
+            self._index_blobs(conn, live_added)
+            if conn.execute('SELECT COUNT(*) FROM shards').fetchone()[0] > MAX_SHARDS:
+                obsolete = self._compact(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        for shard_id in obsolete:
+            try:
+                os.remove(self._shard_path(shard_id))
+            except OSError:
+                pass
+
+    def _add_ref(self, conn, blob_hash, added):
+        cursor = conn.execute('UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?', (blob_hash,))
+        if not cursor.rowcount:
+            conn.execute('INSERT INTO blobs (hash, refcount, shard) VALUES (?, 1, NULL)', (blob_hash,))
+            added.append(blob_hash)
+
+    def _drop_ref(self, conn, blob_hash):
+        conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?', (blob_hash,))
+        conn.execute('DELETE FROM blobs WHERE hash = ? AND refcount <= 0', (blob_hash,))
+
+    def _index_blobs(self, conn, blob_hashes):
+        """Write the text blobs among blob_hashes to a new shard."""
+        indexed = []
+        postings = defaultdict(list)
+        for blob_hash in blob_hashes:
+            content = self._indexable_content(blob_hash)
+            if content is None:
+                continue
+            index = len(indexed)
+            indexed.append(blob_hash)
+            for trigram in trigrams(content):
+                postings[trigram].append(index)
+        if not indexed:
+            return
+        shard_id = conn.execute('INSERT INTO shards (blob_count) VALUES (?)', (len(indexed),)).lastrowid
+        write_shard(self._shard_path(shard_id), indexed, postings)
+        conn.executemany('UPDATE blobs SET shard = ? WHERE hash = ?', ((shard_id, h) for h in indexed))
+
+    def _compact(self, conn):
+        """Merge the live postings of every shard into one; return the ids of the replaced shards."""
+        live = {blob_hash for blob_hash, in conn.execute('SELECT hash FROM blobs WHERE shard IS NOT NULL')}
+        shard_ids = [shard_id for shard_id, in conn.execute('SELECT id FROM shards ORDER BY id')]
+        merged = []
+        postings = defaultdict(list)
+        for shard_id in shard_ids:
+            shard = Shard(self._shard_path(shard_id))
+            remap = {}
+            for index in range(shard.blob_count):
+                blob_hash = shard.blob(index)
+                if blob_hash in live:
+                    live.discard(blob_hash)
+                    remap[index] = len(merged)
+                    merged.append(blob_hash)
+            for trigram, posting in shard.iter_postings():
+                new_indexes = [remap[i] for i in posting if i in remap]
+                if new_indexes:
+                    postings[trigram].extend(new_indexes)
+        conn.execute('DELETE FROM shards')
+        if merged:
+            new_id = conn.execute('INSERT INTO shards (blob_count) VALUES (?)', (len(merged),)).lastrowid
+            write_shard(self._shard_path(new_id), merged, postings)
+            conn.execute('UPDATE blobs SET shard = ? WHERE shard IS NOT NULL', (new_id,))
+        return shard_ids
+
+    def _indexable_content(self, blob_hash):
+        if (self.repo.object_size(blob_hash) or 0) > MAX_INDEX_BYTES:
+            return None
+        with self.repo.open_object(blob_hash) as stream:
+            content = stream.read()
+        return None if is_binary(content) else content
+
+    def search(self, tree, query, regex=False, ignore_case=False, limit=MAX_RESULTS):
+        """Search the files of a tree, returning matching lines as dicts of path, line and text.
+
+        Indexed blobs are only read if they contain every trigram of the
+        literals the query requires; blobs the index does not know are
+        always read, so any tree can be searched, not just branch heads.
+        """
+        pattern = re.compile(query if regex else re.escape(query), re.IGNORECASE if ignore_case else 0)
+        required = set()
+        for literal in (required_literals(query) if regex else [query]):
+            required |= trigrams(literal.encode('utf-8'))
+
+        paths_by_blob = {}
+        for path, blob_hash in self.repo.iter_tree(tree):
+            paths_by_blob.setdefault(blob_hash, []).append(path)
+
+        conn = self._connect()
+        try:
+            known = dict(conn.execute('SELECT hash, shard FROM blobs'))
+            shard_ids = [shard_id for shard_id, in conn.execute('SELECT id FROM shards')]
+        finally:
+            conn.close()
+        candidates = None
+        # Shards a concurrent compaction removed after their ids were read
+        missing_shards = set()
+        if required:
+            candidates = set()
+            for shard_id in shard_ids:
+                try:
+                    shard = Shard(self._shard_path(shard_id))
+                except FileNotFoundError:
+                    missing_shards.add(shard_id)
+                    continue
+                candidates |= shard.candidates(required)
+
+        results = []
+        for blob_hash in sorted(paths_by_blob, key=lambda h: paths_by_blob[h][0]):
+            if blob_hash in known:
+                if known[blob_hash] is None:
+                    # Binary or too large
+                    continue
+                if (candidates is not None and blob_hash not in candidates
+                        and known[blob_hash] not in missing_shards):
+                    continue
+            content = self._indexable_content(blob_hash)
+            if content is None:
+                continue
+            for number, line in enumerate(content.decode('utf-8', errors='replace').splitlines(), 1):
+                if pattern.search(line):
+                    for path in paths_by_blob[blob_hash]:
+                        results.append({'path': path, 'line': number, 'text': line[:MAX_LINE_LENGTH]})
+            if len(results) >= limit:
+                break
+        return sorted(results, key=lambda r: (r['path'], r['line']))[:limit]
+
+
+class BackgroundIndexer:
+    """Daemon thread that updates search indexes after commits, off the request path.
+
+    Updates scheduled for a repository that is still waiting are merged,
+    so a burst of commits costs one update. Failures are logged; search()
+    brings the index up to date itself anyway.
+    """
+
+    def __init__(self):
+        # repo_path -> repo waiting for an update, oldest first
+        self._pending = {}
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, repo):
+        with self._cond:
+            self._pending.setdefault(repo.repo_path, repo)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='vcs-search-index')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until every scheduled update has run; return False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                repo = self._pending.pop(next(iter(self._pending)))
+                self._busy = True
+            try:
+                SearchIndex(repo).update()
+            except Exception:
+                logger.exception(f"Search index update failed for {repo.repo_path}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+search_indexer = BackgroundIndexer()
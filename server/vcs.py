@@ -1,10 +1,31 @@
 import os
+import base64
+import binascii
 import hashlib
+import io
+import itertools
 import json
+import re
 import shutil
-from datetime import datetime
+import stat
+import tempfile
+import zlib
+from datetime import datetime, timezone
 import threading
+import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from .pack import DELTA_SEARCH_SECONDS, PackFile, write_pack, list_packs
+from .commit_graph import CommitGraph
+from .bloom import ChangedPathFilters, build_filter, changed_paths
+from .object_cache import object_cache
+from .chunking import CHUNK_THRESHOLD, chunk_bytes, iter_chunks
+from .diff import DEFAULT_CONTEXT, diff_trees
+from .merge import merge_trees
+from .blame import blame as blame_file
+from .search import MAX_RESULTS as MAX_SEARCH_RESULTS, SearchIndex, search_indexer
+from . import reflog
+from .index import IndexEntry, RACY_NS, read_index, scan_files, write_index
 
 # Platform-specific imports for file locking
 if os.name == 'nt':
@@ -20,21 +41,89 @@ def sanitize_path(base, user_path):
         raise ValueError("Invalid file path: directory traversal detected.")
     return abs_path
 
+class LockMetrics:
+    """Process-wide lock acquisition counts and wait times, per kind of lock."""
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, waited, contended):
+        with self._lock:
+            stats = self._stats.setdefault(kind, {
+                'acquired': 0,
+                'contended': 0,
+                'wait_seconds': 0.0,
+                'max_wait_seconds': 0.0
+            })
+            stats['acquired'] += 1
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+            if contended:
+                stats['contended'] += 1
+
+    def get_metrics(self):
+        with self._lock:
+            return {kind: dict(stats) for kind, stats in self._stats.items()}
+
+lock_metrics = LockMetrics()
+
+# Locks held by the current thread: lockfile -> [shared, depth]
+_held_locks = threading.local()
+
+
 class FileLock:
-    """Context manager for file-based locking."""
-    def __init__(self, lockfile):
-        self.lockfile = lockfile
+    """Context manager for file-based locking.
+
+    Any number of shared holders may hold a lock at once, while an exclusive
+    holder waits for all of them (Windows has no shared locks, so every lock
+    is exclusive there). A thread that already holds a lock can take it
+    again without blocking, so helpers can lock whether or not their caller
+    did; a shared lock cannot be upgraded to an exclusive one this way.
+    Wait times are recorded in lock_metrics under kind.
+    """
+    def __init__(self, lockfile, shared=False, kind='repo'):
+        self.lockfile = os.path.abspath(lockfile)
+        self.shared = shared
+        self.kind = kind
         self.handle = None
 
     def __enter__(self):
+        held = getattr(_held_locks, 'locks', None)
+        if held is None:
+            held = _held_locks.locks = {}
+        if self.lockfile in held:
+            if held[self.lockfile][0] and not self.shared:
+                raise RuntimeError(f"Cannot upgrade shared lock {self.lockfile} to exclusive")
+            held[self.lockfile][1] += 1
+            return self
+
+        os.makedirs(os.path.dirname(self.lockfile), exist_ok=True)
         self.handle = open(self.lockfile, 'a+')
+        start = time.monotonic()
+        contended = False
         if os.name == 'nt':
-            msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                contended = True
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
         else:
-            fcntl.flock(self.handle, fcntl.LOCK_EX)
+            operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+            try:
+                fcntl.flock(self.handle, operation | fcntl.LOCK_NB)
+            except BlockingIOError:
+                contended = True
+                fcntl.flock(self.handle, operation)
+        lock_metrics.record(self.kind, time.monotonic() - start, contended)
+        held[self.lockfile] = [self.shared, 1]
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        held = _held_locks.locks
+        held[self.lockfile][1] -= 1
+        if held[self.lockfile][1]:
+            return
+        del held[self.lockfile]
         if self.handle:
             if os.name == 'nt':
                 self.handle.seek(0)
@@ -42,6 +131,279 @@ class FileLock:
             else:
                 fcntl.flock(self.handle, fcntl.LOCK_UN)
             self.handle.close()
+            self.handle = None
+
+LOOSE_CHUNK_SIZE = 65536
+
+# Threads used to hash and write the blobs of a commit, and the number of
+# files below which a commit is not worth fanning out
+HASH_WORKERS = int(os.environ.get('VCS_HASH_WORKERS', min(8, os.cpu_count() or 1)))
+PARALLEL_HASH_MIN_FILES = 16
+
+# Rough in-memory cost of parsed objects beyond their serialized size
+COMMIT_CACHE_OVERHEAD = 600
+TREE_ENTRY_CACHE_OVERHEAD = 250
+
+
+def decode_file_content(file_data):
+    """Return the bytes of a file entry from a JSON payload.
+
+    Text is sent as a plain string; binary content is sent base64-encoded
+    with "encoding": "base64". Malformed base64 raises ValueError.
+    """
+    content = file_data.get('content', '')
+    if file_data.get('encoding') == 'base64':
+        try:
+            return base64.b64decode(content, validate=True)
+        except (binascii.Error, TypeError):
+            raise ValueError(f"Invalid base64 content for {file_data.get('name')}") from None
+    if isinstance(content, str):
+        return content.encode()
+    return content
+
+
+def _commit_parents(commit):
+    """Return a parsed commit's parent hashes, first parent first."""
+    if commit.get('parents'):
+        return list(commit['parents'])
+    return [commit['parent']] if commit.get('parent') else []
+
+
+def _commit_timestamp(commit):
+    """Return a parsed commit's timestamp as UTC epoch seconds."""
+    try:
+        return datetime.fromisoformat(commit.get('timestamp', '')).replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def object_hash(obj_type, data):
+    """Return the hash an object with this type and data (bytes) is stored under."""
+    return hashlib.sha1(obj_type.encode() + b' ' + data).hexdigest()
+
+
+def _chunk_manifest_data(entries, size):
+    return json.dumps({'size': size, 'chunks': entries}, separators=(',', ':')).encode()
+
+
+OBJECT_HASH_RE = re.compile(r'^[0-9a-f]{40}$')
+REF_NAMESPACES = ('refs/heads/', 'refs/tags/')
+
+
+def is_object_hash(value):
+    """Check that value is a full lowercase hex object hash, safe to build an object path from."""
+    return isinstance(value, str) and OBJECT_HASH_RE.match(value) is not None
+
+
+def is_valid_ref_name(name):
+    """Check that name is a branch or tag ref that stays inside refs/ when used as a path.
+
+    Empty, '.' and '..' components, backslashes, NUL bytes and names of
+    the temporary and lock files kept next to refs are all rejected.
+    """
+    if not isinstance(name, str) or not name.startswith(REF_NAMESPACES):
+        return False
+    if '\\' in name or '\0' in name:
+        return False
+    return all(part and part not in ('.', '..') and not part.startswith('tmp_') and not part.endswith('.lock')
+               for part in name.split('/')[2:])
+
+
+def _split_path(path):
+    """Split a repository path into its components, ignoring empty ones."""
+    return [part for part in path.replace('\\', '/').split('/') if part and part != '.']
+
+
+class ObjectWriteStats:
+    """Process-wide counters of object writes versus writes skipped because the object already existed."""
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def increment_written(self):
+        with self._lock:
+            self.written += 1
+
+    def increment_skipped(self):
+        with self._lock:
+            self.skipped += 1
+
+    def get_metrics(self):
+        return {
+            'written': self.written,
+            'skipped': self.skipped
+        }
+
+object_write_stats = ObjectWriteStats()
+
+
+class ObjectStream(io.RawIOBase):
+    """Read-only file-like view over an object's data.
+
+    Wraps an iterator of data pieces so callers can copy large blobs without
+    ever holding the whole object in memory. The object type is exposed as
+    the ``type`` attribute, and its size as ``size`` when it is known
+    without reading the data.
+    """
+    def __init__(self, obj_type, chunks, size=None, on_close=None):
+        super().__init__()
+        self.type = obj_type
+        self.size = size
+        self._chunks = chunks
+        self._buffer = b''
+        self._on_close = on_close
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            close_chunks = getattr(self._chunks, 'close', None)
+            if close_chunks:
+                close_chunks()
+            if self._on_close:
+                self._on_close()
+        super().close()
+
+
+def _iter_loose_chunks(f, chunk_size=LOOSE_CHUNK_SIZE):
+    """Yield the decompressed contents of an open loose object file.
+
+    Objects written before loose compression was introduced are stored as
+    raw "type data" bytes and are passed through unchanged.
+    """
+    first = f.read(chunk_size)
+    if not first or first[0] != 0x78:
+        while first:
+            yield first
+            first = f.read(chunk_size)
+        return
+    decompressor = zlib.decompressobj()
+    compressed = first
+    while compressed:
+        data = decompressor.decompress(compressed, chunk_size)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+        compressed = f.read(chunk_size)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def _split_header(chunks):
+    """Consume the "type " prefix from an iterator of raw object pieces.
+
+    Returns (type, iterator over the remaining data).
+    """
+    head = b''
+    for piece in chunks:
+        head += piece
+        space_index = head.find(b' ')
+        if space_index != -1:
+            break
+        if len(head) > 32:
+            raise ValueError('Malformed object header')
+    else:
+        raise ValueError('Truncated object header')
+
+    def rest():
+        remainder = head[space_index + 1:]
+        if remainder:
+            yield remainder
+        yield from chunks
+
+    return head[:space_index].decode(), rest()
+
+
+# Default for update_ref's expected value: overwrite without checking
+ANY_VALUE = object()
+
+
+class RefUpdateError(ValueError):
+    """A compare-and-swap ref update found the ref pointing somewhere unexpected."""
+    def __init__(self, ref_name, expected, actual):
+        super().__init__(f"Ref {ref_name} is at {actual or 'nothing'}, expected {expected or 'nothing'}")
+        self.ref_name = ref_name
+        self.expected = expected
+        self.actual = actual
+
+
+# Parsed packed-refs files keyed by path, valid while (inode, mtime, size) is
+# unchanged. The file is replaced by rename, so every rewrite changes the key.
+_packed_refs_cache = {}
+_packed_refs_cache_lock = threading.Lock()
+
+# A file modified this recently may be rewritten again within the same
+# timestamp tick, so its cache entry is not trusted yet
+RACY_MTIME_SECONDS = 2
+
+
+def _read_loose_ref(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return None
+
+
+def _read_packed_refs(path):
+    """Return the refs in a packed-refs file as a dict, or {} if there is none."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _packed_refs_cache_lock:
+        cached = _packed_refs_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, 'r') as f:
+            refs = _parse_packed_refs(f.read())
+    except FileNotFoundError:
+        return {}
+    if time.time() - st.st_mtime > RACY_MTIME_SECONDS:
+        with _packed_refs_cache_lock:
+            _packed_refs_cache[path] = (key, refs)
+    return refs
+
+
+def _parse_packed_refs(text):
+    """Parse packed-refs lines of the form "<commit hash> <ref name>"."""
+    refs = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        commit_hash, _, name = line.partition(' ')
+        refs[name] = commit_hash
+    return refs
+
+
+def _write_packed_refs(path, refs):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write('# packed-refs\n')
+            for name in sorted(refs):
+                f.write(f"{refs[name]} {name}\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
 
 class GitRepository:
     def __init__(self, repo_path):
@@ -51,7 +413,20 @@ class GitRepository:
         self.head_file = os.path.join(repo_path, 'HEAD')
         self.config_file = os.path.join(repo_path, 'config')
         self.files_path = os.path.join(repo_path, 'files')
+        # Guards files/ and CHECKOUT_TREE; refs and HEAD have their own locks under .locks/
         self.lockfile = os.path.join(repo_path, '.vcs.lock')
+        self.locks_path = os.path.join(repo_path, '.locks')
+        self.checkout_file = os.path.join(repo_path, 'CHECKOUT_TREE')
+        self.commit_graph_file = os.path.join(self.objects_path, 'info', 'commit-graph')
+        self.changed_path_filters_file = self.commit_graph_file + '-bloom'
+        # Every chunk manifest stored, one hash per line, so gc can find them without reading blobs
+        self.chunk_manifests_file = os.path.join(self.objects_path, 'info', 'chunk-manifests')
+        self.packed_refs_file = os.path.join(repo_path, 'packed-refs')
+        self.logs_path = os.path.join(repo_path, 'logs')
+        self.index_file = os.path.join(repo_path, 'index')
+        self.pack_path = os.path.join(self.objects_path, 'pack')
+        self._packs = None
+        self._packs_mtime = None
 
     @staticmethod
     def init(repo_path):
@@ -60,7 +435,8 @@ class GitRepository:
             shutil.rmtree(repo_path)
         
         os.makedirs(repo_path)
-        os.makedirs(os.path.join(repo_path, 'objects'))
+        os.makedirs(os.path.join(repo_path, 'objects', 'info'))
+        open(os.path.join(repo_path, 'objects', 'info', 'chunk-manifests'), 'w').close()
         os.makedirs(os.path.join(repo_path, 'refs', 'heads'))
         os.makedirs(os.path.join(repo_path, 'refs', 'tags'))
         os.makedirs(os.path.join(repo_path, 'files'))
@@ -76,236 +452,1259 @@ class GitRepository:
         return GitRepository(repo_path)
 
     def create_branch(self, branch_name, start_point='HEAD'):
-        """Create a new branch pointing to start_point."""
-        if start_point == 'HEAD':
-            with open(self.head_file, 'r') as f:
-                ref = f.read().strip()
-                if ref.startswith('ref: '):
-                    ref = ref[5:]
-                start_point = self.get_ref(ref)
-        
-        branch_path = os.path.join(self.refs_path, 'heads', branch_name)
-        with open(branch_path, 'w') as f:
-            f.write(start_point)
-
-    def checkout(self, branch_name):
-        """Switch to a different branch."""
-        branch_path = os.path.join(self.refs_path, 'heads', branch_name)
-        if not os.path.exists(branch_path):
+        """Create a new branch pointing to start_point.
+
+        Raises RefUpdateError if the branch already exists, and ValueError
+        if the name is not a valid branch name or start_point does not resolve.
+        """
+        commit_hash = self.resolve_commit(start_point)
+        if not commit_hash:
+            raise ValueError(f"Start point {start_point} does not exist")
+        start_point = commit_hash
+
+        self.update_ref(f'refs/heads/{branch_name}', start_point, expected=None,
+                        message=f"branch: Created from {start_point}")
+
+    def checkout(self, branch_name, dry_run=False):
+        """Switch to a different branch.
+
+        Only paths that differ between the checked-out tree and the branch's
+        tree are written, deleted or renamed. With dry_run=True nothing is
+        touched and the planned operations are returned instead.
+        """
+        branch_ref = f'refs/heads/{branch_name}'
+        if not is_valid_ref_name(branch_ref):
             raise ValueError(f"Branch {branch_name} does not exist")
-        
-        # Update HEAD to point to new branch
-        with open(self.head_file, 'w') as f:
-            f.write(f'ref: refs/heads/{branch_name}')
-        
-        # Get commit hash
+        if dry_run:
+            with self._ref_lock(branch_ref, shared=True), self._worktree_lock(shared=True):
+                return self._plan_checkout(self._branch_commit(branch_name))
+
+        # The branch is read under its lock, so a commit to it cannot land
+        # between resolving it and writing its tree out
+        with self._ref_lock('HEAD'), self._ref_lock(branch_ref, shared=True), self._worktree_lock():
+            commit_hash = self._branch_commit(branch_name)
+            previous_ref = self._get_current_ref()
+            previous_commit = self.get_ref(previous_ref)
+            # Update HEAD to point to new branch
+            with open(self.head_file, 'w') as f:
+                f.write(f'ref: refs/heads/{branch_name}')
+            reflog.append_entry(self._reflog_path('HEAD'), previous_commit, commit_hash,
+                                f"checkout: moving from {previous_ref.split('/')[-1]} to {branch_name}")
+
+            if commit_hash:
+                return self._restore_commit_files(commit_hash)
+            return {'operations': [], 'bytes_to_write': 0}
+
+    def _branch_commit(self, branch_name):
         commit_hash = self.get_ref(f'refs/heads/{branch_name}')
-        if commit_hash:
-            self._restore_commit_files(commit_hash)
-
-    def commit(self, message, files):
-        """Create a new commit with the given files and snapshot the repo folder."""
-        with FileLock(self.lockfile):
-            parent = self.get_current_commit()
-            # --- Snapshot current repo folder ---
-            if parent:
-                parent_folder = f"{self.repo_path}_{parent}"
-                if not os.path.exists(parent_folder):
-                    shutil.copytree(self.repo_path, parent_folder, dirs_exist_ok=True)
-            # --- Create new commit as before ---
-            tree_hash = self._create_tree(files)
-            commit = {
-                'tree': tree_hash,
-                'parent': parent,
-                'message': message,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            commit_hash = self._save_object('commit', json.dumps(commit))
+        if not commit_hash:
+            raise ValueError(f"Branch {branch_name} does not exist")
+        return commit_hash
+
+    def commit(self, message, files, branch=None):
+        """Create a new commit with the given files on branch (default: the current branch)."""
+        return self.commit_tree(message, self._create_tree(files), branch)
+
+    def commit_blobs(self, message, entries, branch=None):
+        """Create a new commit from files already stored as blobs, given as a dict of path -> blob hash."""
+        return self.commit_tree(message, self._build_tree(entries), branch)
+
+    def commit_tree(self, message, tree_hash, branch=None):
+        """Create a new commit of an already written tree on branch (default: the current branch).
+
+        Only the target branch is locked, and only while the commit object
+        is written, so commits to different branches run in parallel.
+        """
+        with self._ref_lock('HEAD', shared=True):
+            if branch:
+                ref_name = f'refs/heads/{branch}'
+                if not self.get_ref(ref_name):
+                    raise ValueError(f"Branch {branch} does not exist")
+            else:
+                ref_name = self._get_current_ref()
+        with self._ref_lock(ref_name):
+            parent = self.get_ref(ref_name)
+            commit_hash = self._write_commit(tree_hash, [parent] if parent else [], message)
+            self.update_ref(ref_name, commit_hash, expected=parent,
+                            message=f"commit: {message.splitlines()[0] if message else ''}")
+        # Indexed in the background: the commit stands whatever happens there
+        search_indexer.schedule(self)
+        return commit_hash
+
+    def search(self, query, ref=None, regex=False, ignore_case=False, limit=MAX_SEARCH_RESULTS):
+        """Search the files at ref (default HEAD) for a literal string or a regex."""
+        commit_hash = self.resolve_commit(ref)
+        if not commit_hash:
+            raise ValueError(f"Ref {ref} does not exist")
+        index = SearchIndex(self)
+        index.update()
+        return index.search(self._commit_tree(commit_hash), query, regex, ignore_case, limit)
+
+    def merge(self, ref, message=None):
+        """Merge ref into the current branch.
+
+        Fast-forwards when the current branch has no commits of its own,
+        otherwise three-way merges the trees against the merge base and
+        records a commit with both parents. Returns a dict whose status is
+        'up-to-date', 'fast-forward', 'merged' or 'conflict'; on conflict
+        nothing is written to the branch or the working tree.
+        """
+        theirs = self.resolve_commit(ref)
+        if not theirs:
+            raise ValueError(f"Ref {ref} does not exist")
+        with self._ref_lock('HEAD', shared=True):
             current_ref = self._get_current_ref()
-            self.update_ref(current_ref, commit_hash)
-            return commit_hash
+            with self._ref_lock(current_ref), self._worktree_lock():
+                return self._merge_locked(current_ref, ref, theirs, message)
+
+    def _merge_locked(self, current_ref, ref, theirs, message):
+        ours = self.get_ref(current_ref)
+        if ours and self.is_ancestor(theirs, ours):
+            return {'status': 'up-to-date', 'commit': ours}
+        if not ours or self.is_ancestor(ours, theirs):
+            self.update_ref(current_ref, theirs, expected=ours, message=f"merge {ref}: Fast-forward")
+            self._restore_commit_files(theirs)
+            return {'status': 'fast-forward', 'commit': theirs}
+
+        base = self.merge_base(ours, theirs)
+        tree_hash, conflicts = merge_trees(
+            self,
+            self._commit_tree(base) if base else None,
+            self._commit_tree(ours),
+            self._commit_tree(theirs)
+        )
+        if conflicts:
+            return {'status': 'conflict', 'base': base, 'ours': ours, 'theirs': theirs, 'conflicts': conflicts}
+        if tree_hash is None:
+            tree_hash = self._build_tree({})
+        commit_hash = self._write_commit(tree_hash, [ours, theirs], message or f"Merge {ref}")
+        self.update_ref(current_ref, commit_hash, expected=ours, message=f"merge {ref}")
+        self._restore_commit_files(commit_hash)
+        return {'status': 'merged', 'commit': commit_hash, 'base': base}
+
+    def _write_commit(self, tree_hash, parents, message):
+        """Save a commit object, index it in the commit graph and return its hash.
+
+        'parent' keeps the first parent for readers that predate merges;
+        merge commits also list every parent under 'parents'.
+        """
+        commit = {
+            'tree': tree_hash,
+            'parent': parents[0] if parents else None,
+            'message': message,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+        if len(parents) > 1:
+            commit['parents'] = parents
+        commit_hash = self._save_object('commit', json.dumps(commit))
+        self._commit_graph(commit_hash)
+        return commit_hash
 
     def revert_to_commit(self, commit_hash):
-        """Revert the repo to a previous commit by restoring the corresponding folder."""
-        parent_folder = f"{self.repo_path}_{commit_hash}"
-        if not os.path.exists(parent_folder):
-            raise ValueError(f"Snapshot for commit {commit_hash} does not exist.")
-        # Remove current repo folder contents except snapshots and lock
-        for item in os.listdir(self.repo_path):
-            item_path = os.path.join(self.repo_path, item)
-            if not item.startswith('.') and not item.endswith('.lock'):
-                if os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-                elif os.path.isfile(item_path):
-                    os.remove(item_path)
-        # Copy snapshot back
-        for item in os.listdir(parent_folder):
-            s = os.path.join(parent_folder, item)
-            d = os.path.join(self.repo_path, item)
-            if os.path.isdir(s):
-                shutil.copytree(s, d, dirs_exist_ok=True)
-            else:
-                shutil.copy2(s, d)
+        """Reset the current branch to a previous commit and rebuild the working tree from it."""
+        obj = self._load_object(commit_hash)
+        if not obj or obj[0] != 'commit':
+            raise ValueError(f"Commit {commit_hash} does not exist.")
+        with self._ref_lock('HEAD', shared=True):
+            current_ref = self._get_current_ref()
+            with self._ref_lock(current_ref), self._worktree_lock():
+                self.update_ref(current_ref, commit_hash, message=f"revert: moving to {commit_hash}")
+                self._restore_commit_files(commit_hash)
+
+    def snapshot_folders(self):
+        """Return paths of legacy per-commit snapshot folders (<repo_path>_<hash>) of this repo."""
+        parent_dir = os.path.dirname(os.path.abspath(self.repo_path))
+        prefix = os.path.basename(os.path.abspath(self.repo_path)) + '_'
+        folders = []
+        if not os.path.isdir(parent_dir):
+            return folders
+        for name in sorted(os.listdir(parent_dir)):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and len(suffix) == 40 and all(c in '0123456789abcdef' for c in suffix):
+                path = os.path.join(parent_dir, name)
+                if os.path.isdir(path):
+                    folders.append(path)
+        return folders
+
+    def import_snapshots(self):
+        """Import objects from legacy snapshot folders into the object store, then delete the folders.
+
+        Commits used to copy the whole repository to <repo_path>_<parent> on
+        every commit. Every object a snapshot holds is also reachable from the
+        live repository unless it was lost, so only missing objects are copied.
+        Returns the number of objects imported.
+        """
+        return sum(self.import_snapshot(folder) for folder in self.snapshot_folders())
+
+    def import_snapshot(self, folder):
+        """Import the objects of one legacy snapshot folder that the store lacks, then delete the folder.
+
+        The objects lock is held for this folder only. Importing is
+        idempotent, so a folder left behind by an interrupted import is
+        simply imported again. Returns the number of objects imported.
+        """
+        imported = 0
+        with self._objects_lock():
+            snapshot = GitRepository(folder)
+            for obj_hash, path in snapshot._iter_loose_objects():
+                if not self._has_object(obj_hash):
+                    dest = os.path.join(self.objects_path, obj_hash[:2], obj_hash[2:])
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    shutil.copy2(path, dest)
+                    imported += 1
+            for pack in snapshot._get_packs():
+                for obj_hash in pack:
+                    if not self._has_object(obj_hash):
+                        obj_type, data = pack.read(obj_hash)
+                        self._save_object(obj_type, data)
+                        imported += 1
+            snapshot._close_packs()
+            shutil.rmtree(folder)
+        return imported
+
+    def fsck(self, workers=None):
+        """Verify every stored object and ref; see server.fsck for the report format."""
+        from .fsck import check_repository
+        return check_repository(self, workers=workers)
 
     def list_files(self):
         """List all files in the working directory."""
         files = []
-        for root, _, filenames in os.walk(self.files_path):
-            for filename in filenames:
-                rel_path = os.path.relpath(os.path.join(root, filename), self.files_path)
-                files.append({
-                    'name': rel_path,
-                    'type': 'file'
-                })
+        with self._worktree_lock(shared=True):
+            for root, _, filenames in os.walk(self.files_path):
+                for filename in filenames:
+                    rel_path = os.path.relpath(os.path.join(root, filename), self.files_path)
+                    files.append({
+                        'name': rel_path,
+                        'type': 'file'
+                    })
         return files
 
-    def get_file_content(self, file_path):
-        """Get the content of a file."""
+    def get_file_path(self, file_path):
+        """Return the absolute path of a working file, or None if it does not exist."""
         abs_path = sanitize_path(self.files_path, file_path)
-        if not os.path.exists(abs_path):
+        if not os.path.isfile(abs_path):
             return None
-        with open(abs_path, 'r') as f:
-            return f.read()
+        return abs_path
+
+    def get_file_content(self, file_path):
+        """Get the content of a file as bytes."""
+        with self._worktree_lock(shared=True):
+            abs_path = self.get_file_path(file_path)
+            if abs_path is None:
+                return None
+            with open(abs_path, 'rb') as f:
+                return f.read()
 
     def write_file(self, file_path, content):
-        """Write content to a file."""
+        """Write content (bytes, or str encoded as UTF-8) to a file."""
         abs_path = sanitize_path(self.files_path, file_path)
-        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-        with FileLock(self.lockfile):
-            with open(abs_path, 'w') as f:
+        if isinstance(content, str):
+            content = content.encode()
+        with self._worktree_lock():
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            with open(abs_path, 'wb') as f:
                 f.write(content)
 
     def delete_file(self, file_path):
         """Delete a file."""
         abs_path = sanitize_path(self.files_path, file_path)
-        with FileLock(self.lockfile):
+        with self._worktree_lock():
             if os.path.exists(abs_path):
                 os.remove(abs_path)
 
-    def sync(self):
+    def sync(self, dry_run=False):
         """Sync working directory with current commit."""
-        commit_hash = self.get_current_commit()
-        if commit_hash:
-            self._restore_commit_files(commit_hash)
+        with self._ref_lock('HEAD', shared=True), self._worktree_lock(shared=dry_run):
+            commit_hash = self.get_current_commit()
+            if commit_hash:
+                return self._restore_commit_files(commit_hash, dry_run=dry_run)
+            return {'operations': [], 'bytes_to_write': 0}
+
+    def status(self):
+        """Compare files/ with the current commit.
+
+        Returns the commit plus sorted lists of modified, added and deleted
+        paths. Files whose stat data matches the index are not read; only
+        new, changed or racily clean files are rehashed, and the index is
+        rewritten when any were.
+        """
+        with self._worktree_lock(shared=True):
+            commit_hash = self.get_current_commit()
+            head = self._flatten_tree(self._commit_tree(commit_hash)) if commit_hash else {}
+            entries, index_mtime_ns = read_index(self.index_file)
+            racy_after = index_mtime_ns - RACY_NS
+            current = {}
+            rehashed = False
+            for path, st in scan_files(self.files_path):
+                entry = entries.get(path)
+                if entry is None or not entry.matches(st) or entry.mtime_ns >= racy_after:
+                    with open(os.path.join(self.files_path, path), 'rb') as f:
+                        # A large file only has to be chunked again if it no longer matches HEAD
+                        if st.st_size >= CHUNK_THRESHOLD and path in head and \
+                                self._file_holds_blob(f, st.st_size, head[path]):
+                            blob = head[path]
+                        else:
+                            f.seek(0)
+                            blob = self.hash_blob_stream(f)
+                        entry = IndexEntry.from_stat(st, blob)
+                    rehashed = True
+                current[path] = entry
+            if rehashed or len(current) != len(entries):
+                write_index(self.index_file, current)
+
+        modified = sorted(path for path, entry in current.items() if path in head and head[path] != entry.blob)
+        added = sorted(path for path in current if path not in head)
+        deleted = sorted(path for path in head if path not in current)
+        return {'commit': commit_hash, 'modified': modified, 'added': added, 'deleted': deleted}
 
     def list_commits(self):
-        """List all commits in the repository (simple linear history)."""
-        commits = []
-        # Start from HEAD
-        commit_hash = self.get_current_commit()
-        seen = set()
-        while commit_hash and commit_hash not in seen:
-            seen.add(commit_hash)
-            obj = self._load_object(commit_hash)
-            if not obj:
-                break
-            obj_type, data = obj
-            if obj_type != 'commit':
-                break
-            commit = json.loads(data)
-            commits.append({
-                'hash': commit_hash,
-                'message': commit.get('message', ''),
-                'timestamp': commit.get('timestamp', ''),
-                'parent': commit.get('parent', None)
-            })
-            commit_hash = commit.get('parent', None)
-        return commits[::-1]  # Oldest first
+        """List all commits reachable from HEAD, oldest first."""
+        return list(self.iter_commits())[::-1]  # Oldest first
+
+    def iter_commits(self, ref=None, before=None):
+        """Yield commits reachable from ref (default HEAD), newest first.
+
+        With before set to a commit hash, only the commits the walk reaches
+        after it are yielded, so passing the last hash of one page yields
+        the next page. Commits are loaded lazily, so stopping early stops
+        the walk.
+        """
+        for commit_hash in self._walk_history(ref, before):
+            yield self._commit_summary(commit_hash, self._read_commit(commit_hash))
+
+    def list_commits_page(self, limit, before=None, ref=None, path=None):
+        """Return one page of history, newest first, plus the cursor for the next page.
+
+        With path set, only commits that changed the file or directory at
+        path are listed.
+        """
+        history = self._walk_path_history(path, ref, before) if path else self._walk_history(ref, before)
+        # Peek one commit past the page in the index to know whether there is more
+        hashes = list(itertools.islice(history, limit + 1))
+        items = [self._commit_summary(h, self._read_commit(h)) for h in hashes[:limit]]
+        return {
+            'items': items,
+            'next_cursor': items[-1]['hash'] if len(hashes) > limit else None
+        }
+
+    def _walk_history(self, ref=None, before=None):
+        """Yield commit hashes newest first from the commit-graph index.
+
+        With before set the walk still starts at ref and skips past before:
+        starting from before's parents would lose commits still queued from
+        the other side of a merge above it. If before is not in ref's
+        history (the branch was reset), the walk carries on from its parents.
+        """
+        head = self.resolve_commit(ref)
+        before = self.resolve_commit(before) if before else None
+        if not head:
+            return
+        graph = self._commit_graph(head, before)
+        walk = graph.walk([head])
+        if before:
+            for commit_hash in walk:
+                if commit_hash == before:
+                    break
+            else:
+                walk = graph.walk(graph.parent_oids(before))
+        yield from walk
+
+    def _walk_path_history(self, path, ref=None, before=None):
+        """Yield, newest first, the hashes of commits that changed the file or directory at path.
+
+        A commit changed path if the entry there differs from every parent's
+        (so merges that took one side unchanged are skipped). Commits whose
+        changed-path filter rules the path out are skipped without reading
+        any trees.
+        """
+        path = '/'.join(_split_path(path))
+        if not path:
+            yield from self._walk_history(ref, before)
+            return
+        graph = filters = None
+        for commit_hash in self._walk_history(ref, before):
+            if graph is None:
+                graph = self._commit_graph()
+                filters = self._changed_path_filters(graph)
+            position = graph.positions[commit_hash]
+            if not filters.may_contain(position, path):
+                continue
+            entry = self.lookup_path(graph.trees[position], path)
+            parent_entries = [self.lookup_path(graph.trees[p], path) for p in graph.parents[position]]
+            if parent_entries:
+                if all(parent_entry != entry for parent_entry in parent_entries):
+                    yield commit_hash
+            elif entry is not None:
+                yield commit_hash
+
+    def _commit_summary(self, commit_hash, commit):
+        return {
+            'hash': commit_hash,
+            'message': commit.get('message', ''),
+            'timestamp': commit.get('timestamp', ''),
+            'parent': commit.get('parent', None),
+            'parents': _commit_parents(commit)
+        }
+
+    def is_ancestor(self, ancestor, descendant):
+        """Check whether commit ancestor is reachable from commit descendant."""
+        graph = self._commit_graph(ancestor, descendant)
+        return graph.is_ancestor(ancestor, descendant)
+
+    def merge_base(self, a, b):
+        """Return the best common ancestor of two commits, or None if they share no history."""
+        graph = self._commit_graph(a, b)
+        bases = graph.merge_bases(a, b)
+        return bases[0] if bases else None
+
+    def diff_commits(self, old_commit, new_commit, context=DEFAULT_CONTEXT):
+        """Diff two commits; old_commit may be None to diff against an empty tree."""
+        old_tree = self._commit_tree(old_commit) if old_commit else None
+        result = diff_trees(self, old_tree, self._commit_tree(new_commit), context)
+        result['from'] = old_commit
+        result['to'] = new_commit
+        return result
+
+    def commit_parents(self, commit_hash):
+        return _commit_parents(self._read_commit(commit_hash))
+
+    def commit_diff(self, commit_hash, context=DEFAULT_CONTEXT):
+        """Diff a commit against its first parent."""
+        parents = self.commit_parents(commit_hash)
+        return self.diff_commits(parents[0] if parents else None, commit_hash, context)
+
+    def blame(self, commit_hash, path):
+        """Annotate each line of a file at a commit with the commit that last changed it."""
+        return blame_file(self, commit_hash, path)
 
     def get_commit_graph(self):
-        """Return a simple commit graph (linear for now)."""
-        # For now, just return the list of commits as nodes and edges
+        """Return the commit graph as nodes and parent -> child edges, including merge parents."""
         commits = self.list_commits()
         nodes = [{'id': c['hash'], 'label': c['message']} for c in commits]
         edges = []
         for c in commits:
-            if c['parent']:
-                edges.append({'from': c['parent'], 'to': c['hash']})
+            for parent in c['parents']:
+                edges.append({'from': parent, 'to': c['hash']})
         return {'nodes': nodes, 'edges': edges}
 
     # Helper methods
     def _save_object(self, obj_type, data):
-        """Save an object to the repository and return its hash."""
-        content = f"{obj_type} {data}".encode()
+        """Save an object to the repository and return its hash.
+
+        Objects are immutable, so an object that already exists is left
+        untouched. New objects are written to a temporary file and renamed
+        into place, so a crash can never leave a truncated object behind.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        content = obj_type.encode() + b' ' + data
         sha1 = hashlib.sha1(content).hexdigest()
         
+        if self._freshen_object(sha1):
+            object_write_stats.increment_skipped()
+            return sha1
+        
         path = os.path.join(self.objects_path, sha1[:2], sha1[2:])
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        
-        with open(path, 'wb') as f:
-            f.write(content)
-        
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='tmp_obj_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(content))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        object_write_stats.increment_written()
+        if obj_type == 'chunked':
+            self._record_chunk_manifest(sha1)
         return sha1
 
-    def _load_object(self, obj_hash):
-        """Load an object from the repository."""
+    def _has_object(self, obj_hash):
+        """Check whether an object exists as a loose file or in a pack."""
+        if not is_object_hash(obj_hash):
+            return False
+        if os.path.exists(os.path.join(self.objects_path, obj_hash[:2], obj_hash[2:])):
+            return True
+        return any(obj_hash in pack for pack in self._get_packs())
+
+    def _freshen_object(self, obj_hash):
+        """Check whether an object exists, touching a loose copy's mtime.
+
+        A write that finds its object already stored is about to make it
+        reachable again, so it restarts the grace period garbage collection
+        gives unreachable loose objects.
+        """
+        try:
+            os.utime(os.path.join(self.objects_path, obj_hash[:2], obj_hash[2:]))
+            return True
+        except FileNotFoundError:
+            return any(obj_hash in pack for pack in self._get_packs())
+
+    def open_object(self, obj_hash):
+        """Open an object for streaming reads.
+
+        Returns an ObjectStream whose ``type`` attribute holds the object type,
+        or None if the object does not exist. Chunked blobs are presented as
+        a single blob whose chunks are opened one at a time as it is read.
+        """
+        stream = self._open_stored_object(obj_hash)
+        if stream is None or stream.type != 'chunked':
+            return stream
+        with stream:
+            manifest = json.loads(stream.read())
+        return ObjectStream('blob', self._iter_chunked(manifest), size=manifest['size'])
+
+    def _open_stored_object(self, obj_hash):
+        """Open an object exactly as stored, without expanding chunk manifests."""
+        if not is_object_hash(obj_hash):
+            return None
         path = os.path.join(self.objects_path, obj_hash[:2], obj_hash[2:])
-        if not os.path.exists(path):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            f = None
+        if f is not None:
+            obj_type, chunks = _split_header(_iter_loose_chunks(f))
+            return ObjectStream(obj_type, chunks, on_close=f.close)
+        for pack in self._get_packs():
+            obj = pack.stream(obj_hash, LOOSE_CHUNK_SIZE)
+            if obj is not None:
+                return ObjectStream(*obj)
+        return None
+
+    def _iter_chunked(self, manifest):
+        for chunk_hash, _ in manifest['chunks']:
+            chunk = self._open_stored_object(chunk_hash)
+            if chunk is None:
+                raise ValueError(f"Missing chunk {chunk_hash}")
+            with chunk:
+                while True:
+                    data = chunk.read(LOOSE_CHUNK_SIZE)
+                    if not data:
+                        break
+                    yield data
+
+    def _save_blob(self, content):
+        """Save file content as a blob, splitting large content into shared chunks."""
+        if isinstance(content, str):
+            content = content.encode()
+        if len(content) < CHUNK_THRESHOLD:
+            return self._save_object('blob', content)
+        return self._save_chunk_manifest(chunk_bytes(content))
+
+    def write_blob_stream(self, stream):
+        """Save file content read from a file-like as a blob, chunking it if it turns out to be large."""
+        head = stream.read(CHUNK_THRESHOLD)
+        if isinstance(head, str):
+            head = head.encode()
+        if len(head) < CHUNK_THRESHOLD:
+            return self._save_object('blob', head)
+        return self._save_chunk_manifest(iter_chunks(stream, prefix=head))
+
+    def _save_chunk_manifest(self, chunks):
+        """Store each chunk as a blob and return the hash of the manifest listing them."""
+        entries = []
+        size = 0
+        for chunk in chunks:
+            entries.append([self._save_object('blob', chunk), len(chunk)])
+            size += len(chunk)
+        return self._save_object('chunked', _chunk_manifest_data(entries, size))
+
+    def _chunk_manifests_lock(self):
+        return FileLock(self.chunk_manifests_file + '.lock', kind='chunk-manifests')
+
+    def _record_chunk_manifest(self, manifest_hash):
+        """Add a newly stored manifest to the chunk-manifests list.
+
+        Until the list exists nothing is added: the scan that creates it
+        runs under the same lock and finds the stored manifest itself.
+        """
+        with self._chunk_manifests_lock():
+            if os.path.exists(self.chunk_manifests_file):
+                with open(self.chunk_manifests_file, 'a') as f:
+                    f.write(manifest_hash + '\n')
+
+    def chunk_manifests(self):
+        """Return the hashes of the chunk manifests stored (or once stored) in the repository.
+
+        Repositories from before the list was kept get it built by one scan
+        of every stored object's type.
+        """
+        if not os.path.exists(self.chunk_manifests_file):
+            with self._chunk_manifests_lock():
+                if not os.path.exists(self.chunk_manifests_file):
+                    self._write_chunk_manifests(self._scan_chunk_manifests())
+        with open(self.chunk_manifests_file, 'r') as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _scan_chunk_manifests(self):
+        hashes = [obj_hash for obj_hash, _ in self._iter_loose_objects()]
+        for pack in self._get_packs():
+            hashes.extend(pack)
+        manifests = []
+        for obj_hash in hashes:
+            stream = self._open_stored_object(obj_hash)
+            if stream is not None:
+                with stream:
+                    if stream.type == 'chunked':
+                        manifests.append(obj_hash)
+        return manifests
+
+    def _write_chunk_manifests(self, manifests):
+        os.makedirs(os.path.dirname(self.chunk_manifests_file), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.chunk_manifests_file), prefix='tmp_')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(''.join(manifest_hash + '\n' for manifest_hash in manifests))
+            os.replace(tmp_path, self.chunk_manifests_file)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def hash_blob_stream(self, stream):
+        """Return the hash write_blob_stream would store a file-like's content under, without storing it."""
+        head = stream.read(CHUNK_THRESHOLD)
+        if len(head) < CHUNK_THRESHOLD:
+            return object_hash('blob', head)
+        entries = []
+        size = 0
+        for chunk in iter_chunks(stream, prefix=head):
+            entries.append([object_hash('blob', chunk), len(chunk)])
+            size += len(chunk)
+        return object_hash('chunked', _chunk_manifest_data(entries, size))
+
+    def _load_object(self, obj_hash):
+        """Load an object from loose storage or a pack as (type, bytes)."""
+        if not is_object_hash(obj_hash):
             return None
-        
-        with open(path, 'rb') as f:
-            content = f.read()
-        
-        space_index = content.index(b' ')
-        obj_type = content[:space_index].decode()
-        data = content[space_index + 1:].decode()
-        
-        return obj_type, data
+        path = os.path.join(self.objects_path, obj_hash[:2], obj_hash[2:])
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            # Not loose, or a repack has just moved it into a pack
+            content = None
+        if content is not None:
+            if content[:1] == b'\x78':
+                content = zlib.decompress(content)
+            space_index = content.index(b' ')
+            return content[:space_index].decode(), content[space_index + 1:]
+        for pack in self._get_packs():
+            obj = pack.read(obj_hash)
+            if obj is not None:
+                return obj
+        return None
+
+    def _get_packs(self):
+        """Return the repository's packs, reopening them if the pack directory changed."""
+        try:
+            mtime = os.stat(self.pack_path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if self._packs is None or mtime != self._packs_mtime:
+            self._close_packs()
+            self._packs = [PackFile(base) for base in list_packs(self.pack_path)]
+            self._packs_mtime = mtime
+        return self._packs
+
+    def _close_packs(self):
+        for pack in self._packs or []:
+            pack.close()
+        self._packs = None
+        self._packs_mtime = None
+
+    def _iter_loose_objects(self):
+        """Yield (hash, path) for every loose object."""
+        if not os.path.isdir(self.objects_path):
+            return
+        for prefix in sorted(os.listdir(self.objects_path)):
+            prefix_dir = os.path.join(self.objects_path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if len(name) == 38 and not name.startswith('tmp_'):
+                    yield prefix + name, os.path.join(prefix_dir, name)
 
-    def _create_tree(self, files):
-        """Create a tree object from a list of files."""
+    def repack(self, full=False, reachable=None, max_delta_seconds=DELTA_SEARCH_SECONDS):
+        """Fold loose objects into a new delta-compressed pack.
+
+        With full=True, objects from existing packs are folded in as well and
+        the old packs are removed, leaving a single pack. With reachable (a
+        set of hashes) given, loose objects outside it are left loose for gc
+        to sweep once their grace period is over. Returns the number of
+        objects written to the new pack.
+        """
+        with self._objects_lock():
+            # Only types and sizes are gathered here; write_pack loads each
+            # object as it writes it
+            objects = {}
+            loose_paths = []
+            for obj_hash, path in self._iter_loose_objects():
+                if reachable is not None and obj_hash not in reachable:
+                    continue
+                with self._open_stored_object(obj_hash) as stream:
+                    obj_type = stream.type
+                # The compressed size is close enough to order the delta search
+                objects[obj_hash] = (obj_hash, obj_type, os.path.getsize(path))
+                loose_paths.append(path)
+            old_packs = []
+            if full:
+                for pack in self._get_packs():
+                    for obj_hash in pack:
+                        if obj_hash not in objects:
+                            objects[obj_hash] = (obj_hash, pack.object_type(obj_hash), pack.size(obj_hash))
+                    old_packs.append(pack.base_path)
+            if not objects:
+                return 0
+            new_pack = write_pack(self.pack_path, list(objects.values()), lambda h: self._load_object(h)[1],
+                                  max_delta_seconds)
+            self._close_packs()
+
+            # Only drop the old copies once the new pack is in place
+            for path in loose_paths:
+                os.remove(path)
+                try:
+                    os.rmdir(os.path.dirname(path))
+                except OSError:
+                    pass
+            for base in old_packs:
+                if base != new_pack:
+                    os.remove(base + '.idx')
+                    os.remove(base + '.pack')
+            return len(objects)
+
+    def _create_tree(self, files, workers=None):
+        """Create a tree object from a list of files.
+
+        Blobs are decoded, hashed, compressed and written on a pool of up to
+        workers threads (default HASH_WORKERS); hashlib and zlib release the
+        GIL on large buffers, and the rest is mostly file I/O. The tree only
+        depends on the resulting hashes, so it comes out the same whatever
+        order the blobs finish in.
+        """
+        if workers is None:
+            workers = HASH_WORKERS
+        if workers > 1 and len(files) >= PARALLEL_HASH_MIN_FILES:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vcs-hash') as executor:
+                blob_hashes = list(executor.map(self._save_file_blob, files))
+        else:
+            blob_hashes = [self._save_file_blob(file_data) for file_data in files]
+
+        entries = {}
+        for file_data, blob_hash in zip(files, blob_hashes):
+            entries[file_data['name']] = blob_hash
+        return self._build_tree(entries)
+
+    def _save_file_blob(self, file_data):
+        return self._save_blob(decode_file_content(file_data))
+
+    def _build_tree(self, entries):
+        """Write nested tree objects for a dict of path -> blob hash and return the root tree hash.
+
+        Each directory gets its own tree object mapping names to
+        [type, hash] pairs, so a directory whose contents did not change
+        hashes to the same tree object as before and is not written again.
+        """
+        root = {}
+        for path, blob_hash in entries.items():
+            parts = _split_path(path)
+            # A '..' entry would be written outside files/ on checkout
+            if not parts or any(part == '..' or '\0' in part for part in parts):
+                raise ValueError(f"Invalid file path: {path!r}")
+            node = root
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+                if not isinstance(node, dict):
+                    raise ValueError(f"Path conflicts with a file: {path!r}")
+            if isinstance(node.get(parts[-1]), dict):
+                raise ValueError(f"Path conflicts with a directory: {path!r}")
+            node[parts[-1]] = blob_hash
+        return self._write_tree_node(root)
+
+    def _write_tree_node(self, node):
         tree = {}
-        for file_data in files:
-            name = file_data['name']
-            content = file_data['content']
-            
-            # Save file content as blob
-            blob_hash = self._save_object('blob', content)
-            tree[name] = blob_hash
-        
-        # Save tree object
-        return self._save_object('tree', json.dumps(tree))
-
-    def _restore_commit_files(self, commit_hash):
-        """Restore files from a commit to the working directory."""
-        obj_type, data = self._load_object(commit_hash)
-        if obj_type != 'commit':
-            raise ValueError('Not a commit object')
-        
-        commit = json.loads(data)
-        tree_hash = commit['tree']
-        
-        # Clear working directory
-        if os.path.exists(self.files_path):
-            shutil.rmtree(self.files_path)
-        os.makedirs(self.files_path)
-        
-        # Load tree
-        _, tree_data = self._load_object(tree_hash)
-        tree = json.loads(tree_data)
-        
-        # Restore files
-        for name, blob_hash in tree.items():
-            _, content = self._load_object(blob_hash)
-            file_path = os.path.join(self.files_path, name)
+        for name, value in node.items():
+            if isinstance(value, dict):
+                tree[name] = ['tree', self._write_tree_node(value)]
+            else:
+                tree[name] = ['blob', value]
+        return self._save_object('tree', json.dumps(tree, sort_keys=True, separators=(',', ':')))
+
+    def _read_commit(self, commit_hash):
+        """Load and parse a commit object.
+
+        Parsed commits are shared through the process-wide object cache and
+        must not be modified.
+        """
+        commit = object_cache.get(commit_hash)
+        if commit is not None:
+            return commit
+        obj = self._load_object(commit_hash)
+        if not obj or obj[0] != 'commit':
+            raise ValueError(f"Not a commit object: {commit_hash}")
+        commit = json.loads(obj[1])
+        object_cache.put(commit_hash, commit, COMMIT_CACHE_OVERHEAD + len(obj[1]))
+        return commit
+
+    def _commit_graph(self, *tips):
+        """Return the commit-graph index, first adding any of tips (and their history) that it lacks."""
+        graph = CommitGraph.open(self.commit_graph_file)
+        missing = [tip for tip in tips if tip and tip not in graph]
+        if missing:
+            os.makedirs(os.path.dirname(self.commit_graph_file), exist_ok=True)
+            with FileLock(self.commit_graph_file + '.lock', kind='commit-graph'):
+                graph.refresh()
+                graph.append(self._collect_unindexed_commits(graph, missing))
+                self._extend_changed_path_filters(graph, ChangedPathFilters.open(self.changed_path_filters_file))
+        return graph
+
+    def _changed_path_filters(self, graph):
+        """Return the changed-path filters, first computing any that graph has and the file lacks."""
+        filters = ChangedPathFilters.open(self.changed_path_filters_file)
+        if len(filters) < len(graph):
+            with FileLock(self.commit_graph_file + '.lock', kind='commit-graph'):
+                filters.refresh()
+                self._extend_changed_path_filters(graph, filters)
+        return filters
+
+    def _extend_changed_path_filters(self, graph, filters):
+        """Append the filters for graph positions past the end of filters; needs the commit-graph lock."""
+        new_filters = []
+        for position in range(len(filters), len(graph)):
+            parents = graph.parents[position]
+            parent_tree = graph.trees[parents[0]] if parents else None
+            diff = self.diff_trees(parent_tree, graph.trees[position])
+            new_filters.append(build_filter(changed_paths(diff)))
+        filters.append(new_filters)
+
+    def _collect_unindexed_commits(self, graph, tips):
+        """Walk the object store from tips and return unindexed commits, parents first."""
+        ordered = []
+        visited = set()
+        stack = [(tip, False) for tip in tips]
+        while stack:
+            commit_hash, expanded = stack.pop()
+            if expanded:
+                ordered.append(commit_hash)
+                continue
+            if commit_hash in visited or commit_hash in graph:
+                continue
+            visited.add(commit_hash)
+            stack.append((commit_hash, True))
+            for parent in _commit_parents(self._read_commit(commit_hash)):
+                if parent not in visited and parent not in graph:
+                    stack.append((parent, False))
+        records = []
+        for commit_hash in ordered:
+            commit = self._read_commit(commit_hash)
+            records.append((commit_hash, commit['tree'], _commit_parents(commit), _commit_timestamp(commit)))
+        return records
+
+    def _commit_tree(self, commit_hash):
+        """Return the tree hash of a commit."""
+        return self._read_commit(commit_hash)['tree']
+
+    def _tree_entries(self, tree):
+        """Return the entries of a tree as a dict of name -> (type, ref).
+
+        tree is either a tree hash or an already expanded node. Trees written
+        before directories got their own objects map full paths straight to
+        blob hashes; those are expanded in memory, with subdirectory refs
+        being nested dicts instead of hashes.
+
+        Parsed trees are shared through the process-wide object cache and
+        must not be modified.
+        """
+        if isinstance(tree, dict):
+            return tree
+        entries = object_cache.get(tree)
+        if entries is not None:
+            return entries
+        obj = self._load_object(tree)
+        if not obj or obj[0] != 'tree':
+            raise ValueError(f"Not a tree object: {tree}")
+        data = json.loads(obj[1])
+        entries = {}
+        for name, value in data.items():
+            if isinstance(value, list):
+                entries[name] = (value[0], value[1])
+                continue
+            parts = _split_path(name)
+            node = entries
+            for part in parts[:-1]:
+                if part not in node:
+                    node[part] = ('tree', {})
+                node = node[part][1]
+            node[parts[-1]] = ('blob', value)
+        object_cache.put(tree, entries, len(obj[1]) + TREE_ENTRY_CACHE_OVERHEAD * len(data))
+        return entries
+
+    def iter_tree(self, tree, prefix=''):
+        """Yield (path, blob hash) for every file below a tree."""
+        for name, (entry_type, ref) in sorted(self._tree_entries(tree).items()):
+            path = f"{prefix}{name}"
+            if entry_type == 'tree':
+                yield from self.iter_tree(ref, path + '/')
+            else:
+                yield path, ref
+
+    def _flatten_tree(self, tree):
+        """Return a tree as a dict of path -> blob hash."""
+        return dict(self.iter_tree(tree)) if tree else {}
+
+    def lookup_path(self, tree, path):
+        """Return the (type, ref) entry at path below a tree, or None if it does not exist."""
+        entry = ('tree', tree)
+        for part in _split_path(path):
+            if entry[0] != 'tree':
+                return None
+            entry = self._tree_entries(entry[1]).get(part)
+            if entry is None:
+                return None
+        return entry
+
+    def diff_trees(self, old, new, prefix=''):
+        """Yield (path, old blob, new blob) for every file that differs between two trees.
+
+        Either tree may be None. Subtrees with the same hash are skipped
+        without being read, so the cost is proportional to what changed.
+        """
+        if old == new:
+            return
+        old_entries = self._tree_entries(old) if old else {}
+        new_entries = self._tree_entries(new) if new else {}
+        for name in sorted(set(old_entries) | set(new_entries)):
+            old_entry = old_entries.get(name)
+            new_entry = new_entries.get(name)
+            if old_entry == new_entry:
+                continue
+            path = f"{prefix}{name}"
+            old_tree = old_entry[1] if old_entry and old_entry[0] == 'tree' else None
+            new_tree = new_entry[1] if new_entry and new_entry[0] == 'tree' else None
+            old_blob = old_entry[1] if old_entry and old_entry[0] == 'blob' else None
+            new_blob = new_entry[1] if new_entry and new_entry[0] == 'blob' else None
+            if old_tree or new_tree:
+                yield from self.diff_trees(old_tree, new_tree, path + '/')
+            if old_blob or new_blob:
+                yield path, old_blob, new_blob
+
+    def list_tree(self, tree, path=''):
+        """List the entries of the directory at path below a tree."""
+        entry = self.lookup_path(tree, path)
+        if entry is None or entry[0] != 'tree':
+            raise ValueError(f"Directory {path or '/'} does not exist")
+        return [{'name': name, 'type': entry_type, 'hash': ref if isinstance(ref, str) else None}
+                for name, (entry_type, ref) in sorted(self._tree_entries(entry[1]).items())]
+
+    def _checked_out_tree(self):
+        """Return the tree hash last materialized into files/, or None if unknown."""
+        if not os.path.exists(self.checkout_file):
+            return None
+        with open(self.checkout_file, 'r') as f:
+            return f.read().strip() or None
+
+    def object_size(self, obj_hash):
+        """Return the size in bytes of an object's data, or None if it does not exist."""
+        stream = self.open_object(obj_hash)
+        if stream is None:
+            return None
+        with stream:
+            if stream.size is not None:
+                return stream.size
+            size = 0
+            while True:
+                data = stream.read(LOOSE_CHUNK_SIZE)
+                if not data:
+                    return size
+                size += len(data)
+
+    def _plan_checkout(self, commit_hash):
+        """Work out the file operations needed to move files/ to a commit's tree.
+
+        Returns a dict with the target tree, the list of operations and the
+        number of bytes that will be written.
+        """
+        target_tree = self._commit_tree(commit_hash) if commit_hash else None
+        current_tree = self._checked_out_tree()
+        current = {}
+        to_delete = []
+        to_write = {}
+        if current_tree is not None:
+            for path, old_blob, new_blob in self.diff_trees(current_tree, target_tree):
+                if old_blob:
+                    current[path] = old_blob
+                    if not new_blob:
+                        to_delete.append(path)
+                if new_blob:
+                    to_write[path] = new_blob
+        else:
+            # Unknown working tree state: rewrite everything
+            to_write = self._flatten_tree(target_tree)
+            to_delete = [f['name'] for f in self.list_files() if f['name'] not in to_write]
+
+        # A removed path whose blob reappears elsewhere is a rename
+        removed_by_blob = {}
+        for path in to_delete:
+            removed_by_blob.setdefault(current.get(path), []).append(path)
+        operations = []
+        renamed = set()
+        for path in sorted(to_write):
+            sources = removed_by_blob.get(to_write[path])
+            if sources:
+                source = sources.pop()
+                renamed.add(source)
+                operations.append({'op': 'rename', 'from': source, 'path': path, 'blob': to_write[path]})
+        for path in sorted(to_delete):
+            if path not in renamed:
+                operations.append({'op': 'delete', 'path': path})
+        renamed_to = {op['path'] for op in operations if op['op'] == 'rename'}
+        bytes_to_write = 0
+        for path in sorted(to_write):
+            if path in renamed_to:
+                continue
+            size = self.object_size(to_write[path]) or 0
+            bytes_to_write += size
+            operations.append({'op': 'write', 'path': path, 'blob': to_write[path], 'bytes': size})
+        return {'tree': target_tree, 'operations': operations, 'bytes_to_write': bytes_to_write}
+
+    def _restore_commit_files(self, commit_hash, dry_run=False):
+        """Bring files/ in line with a commit, touching only the paths that differ."""
+        plan = self._plan_checkout(commit_hash)
+        if dry_run:
+            return plan
+        os.makedirs(self.files_path, exist_ok=True)
+
+        # Renames and deletes go first so paths can switch between file and
+        # directory. Rename sources are moved aside before anything else in
+        # case one rename's target is another's source.
+        writes = [op for op in plan['operations'] if op['op'] == 'write']
+        staged = []
+        index_entries, index_mtime_ns = read_index(self.index_file)
+        for op in plan['operations']:
+            if op['op'] == 'rename':
+                src = sanitize_path(self.files_path, op['from'])
+                if self._working_file_holds(src, index_entries.get(op['from']), index_mtime_ns, op['blob']):
+                    tmp = f"{src}.vcs-rename-{len(staged)}"
+                    os.replace(src, tmp)
+                    staged.append((tmp, op))
+                else:
+                    # Missing or edited since the last checkout: write the target from
+                    # the blob and drop the source, as a delete would
+                    self._remove_working_file(op['from'])
+                    writes.append(op)
+            elif op['op'] == 'delete':
+                self._remove_working_file(op['path'])
+        for tmp, op in staged:
+            dest = sanitize_path(self.files_path, op['path'])
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(tmp, dest)
+            self._prune_empty_dirs(os.path.dirname(tmp))
+
+        for op in writes:
+            file_path = sanitize_path(self.files_path, op['path'])
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path)
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, 'w') as f:
-                f.write(content)
+            with self.open_object(op['blob']) as src, open(file_path, 'wb') as f:
+                shutil.copyfileobj(src, f)
+
+        with open(self.checkout_file, 'w') as f:
+            f.write(plan['tree'] or '')
+        return plan
+
+    def _working_file_holds(self, abs_path, entry, index_mtime_ns, blob):
+        """Check whether a file in files/ holds blob, trusting its index entry if the stat data matches."""
+        try:
+            st = os.stat(abs_path)
+        except FileNotFoundError:
+            return False
+        if not stat.S_ISREG(st.st_mode):
+            return False
+        if entry is not None and entry.matches(st) and entry.mtime_ns < index_mtime_ns - RACY_NS:
+            return entry.blob == blob
+        with open(abs_path, 'rb') as f:
+            return self._file_holds_blob(f, st.st_size, blob)
+
+    def _file_holds_blob(self, f, size, blob):
+        """Check whether an open file of size bytes holds blob, reading from the current position.
+
+        Hashing a large file means chunking it again, which is far slower
+        than reading the stored copy back, so large files are compared with
+        the blob's content instead; the comparison stops at the first
+        difference.
+        """
+        if size < CHUNK_THRESHOLD:
+            return self.hash_blob_stream(f) == blob
+        stored = self.open_object(blob)
+        if stored is None:
+            return False
+        with stored:
+            if stored.size is not None and stored.size != size:
+                return False
+            while True:
+                expected = stored.read(LOOSE_CHUNK_SIZE)
+                if not expected:
+                    return not f.read(1)
+                if f.read(len(expected)) != expected:
+                    return False
+
+    def _remove_working_file(self, path):
+        abs_path = sanitize_path(self.files_path, path)
+        if os.path.isfile(abs_path):
+            os.remove(abs_path)
+            self._prune_empty_dirs(os.path.dirname(abs_path))
+
+    def _prune_empty_dirs(self, directory):
+        """Remove empty directories from directory up to (not including) files/."""
+        root = os.path.abspath(self.files_path)
+        directory = os.path.abspath(directory)
+        while directory != root and directory.startswith(root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
 
     def get_ref(self, ref_name):
-        """Get the commit hash that a ref points to."""
-        ref_path = os.path.join(self.repo_path, ref_name)
-        if not os.path.exists(ref_path):
+        """Get the commit hash that a ref points to, or None.
+
+        A loose ref file takes precedence over the ref's entry in packed-refs.
+        Names that are not valid branch or tag refs, and refs that do not
+        hold an object hash, read as None.
+        """
+        if not is_valid_ref_name(ref_name):
             return None
-        with open(ref_path, 'r') as f:
-            return f.read().strip()
+        commit_hash = _read_loose_ref(os.path.join(self.repo_path, ref_name))
+        if commit_hash is None:
+            commit_hash = self._packed_refs().get(ref_name)
+        return commit_hash if is_object_hash(commit_hash) else None
+
+    def update_ref(self, ref_name, commit_hash, expected=ANY_VALUE, message=''):
+        """Point a ref at a commit, atomically, and record the move in its reflog.
 
-    def update_ref(self, ref_name, commit_hash):
-        """Update a ref to point to a commit."""
+        Unless expected is left out, the update is a compare-and-swap: it
+        raises RefUpdateError if the ref does not currently point at
+        expected (None meaning the ref must not exist yet). The new value is
+        written to a temporary file and renamed into place, so lock-free
+        readers see either the old or the new commit, never a partial write.
+        """
+        if not is_valid_ref_name(ref_name):
+            raise ValueError(f"Invalid ref name: {ref_name}")
+        if not is_object_hash(commit_hash):
+            raise ValueError(f"Invalid commit hash: {commit_hash}")
         ref_path = os.path.join(self.repo_path, ref_name)
-        os.makedirs(os.path.dirname(ref_path), exist_ok=True)
-        with open(ref_path, 'w') as f:
-            f.write(commit_hash)
+        with self._ref_lock(ref_name):
+            current = self.get_ref(ref_name)
+            if expected is not ANY_VALUE and current != expected:
+                raise RefUpdateError(ref_name, expected, current)
+            os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(ref_path), prefix='tmp_')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(commit_hash)
+                os.replace(tmp_path, ref_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            reflog.append_entry(self._reflog_path(ref_name), current, commit_hash, message)
+
+    def get_reflog(self, ref_name, since=None, until=None, limit=None):
+        """Return how a ref (or HEAD) moved, newest first, optionally limited to a time range in epoch seconds."""
+        return reflog.read_entries(self._reflog_path(ref_name), since, until, limit)
+
+    def _reflog_path(self, ref_name):
+        if ref_name != 'HEAD' and not is_valid_ref_name(ref_name):
+            raise ValueError(f"Invalid ref name: {ref_name}")
+        return os.path.join(self.logs_path, ref_name)
+
+    def list_refs(self, prefix='refs/'):
+        """Return a sorted dict of ref name -> commit hash for refs under prefix.
+
+        Reads packed-refs (cached until it changes) plus whatever loose refs
+        exist, so a repository whose refs are packed lists them with one read.
+        """
+        refs = {name: commit_hash for name, commit_hash in self._packed_refs().items()
+                if name.startswith(prefix)}
+        loose_root = os.path.join(self.repo_path, prefix)
+        for root, _, filenames in os.walk(loose_root):
+            for filename in filenames:
+                if filename.startswith('tmp_'):
+                    continue
+                path = os.path.join(root, filename)
+                commit_hash = _read_loose_ref(path)
+                if commit_hash:
+                    name = os.path.relpath(path, self.repo_path).replace(os.sep, '/')
+                    refs[name] = commit_hash
+        return dict(sorted(refs.items()))
+
+    def list_branches(self):
+        """Return the branches as a sorted list of {'name', 'commit'} dicts."""
+        return [{'name': name[len('refs/heads/'):], 'commit': commit_hash}
+                for name, commit_hash in self.list_refs('refs/heads/').items()]
+
+    def pack_refs(self):
+        """Move every loose ref into packed-refs.
+
+        Each loose file is only removed while holding its ref's lock and if
+        it still holds the value that was packed, so concurrent updates are
+        never lost. Returns the number of refs packed.
+        """
+        with FileLock(self.packed_refs_file + '.lock', kind='ref'):
+            refs = self.list_refs()
+            _write_packed_refs(self.packed_refs_file, refs)
+            for name, commit_hash in refs.items():
+                ref_path = os.path.join(self.repo_path, name)
+                with self._ref_lock(name):
+                    if _read_loose_ref(ref_path) == commit_hash:
+                        os.remove(ref_path)
+                        self._prune_empty_ref_dirs(os.path.dirname(ref_path))
+        return len(refs)
+
+    def _packed_refs(self):
+        return _read_packed_refs(self.packed_refs_file)
+
+    def _prune_empty_ref_dirs(self, directory):
+        """Remove empty directories left by packed refs, keeping refs/heads and refs/tags."""
+        keep = {os.path.abspath(os.path.join(self.refs_path, name)) for name in ('heads', 'tags')}
+        directory = os.path.abspath(directory)
+        while directory not in keep and directory.startswith(os.path.abspath(self.refs_path) + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    # Lock order: HEAD, then a branch ref, then the working tree, then objects
+    def _ref_lock(self, ref_name, shared=False):
+        """Lock a single ref (or HEAD) so updates to other refs are not blocked."""
+        return FileLock(os.path.join(self.locks_path, ref_name + '.lock'), shared=shared, kind='ref')
+
+    def _worktree_lock(self, shared=False):
+        """Lock files/ and CHECKOUT_TREE; readers take it shared."""
+        return FileLock(self.lockfile, shared=shared, kind='worktree')
+
+    def _objects_lock(self):
+        """Serialize maintenance that rewrites or removes stored objects."""
+        return FileLock(os.path.join(self.locks_path, 'objects.lock'), kind='objects')
+
+    def resolve_commit(self, ref=None):
+        """Resolve HEAD, a branch name, a full ref name or a commit hash to a commit hash.
+
+        Returns None if the ref does not exist or does not point at a commit.
+        """
+        if not ref or ref == 'HEAD':
+            return self.get_current_commit()
+        for candidate in (ref, f'refs/heads/{ref}', f'refs/tags/{ref}'):
+            commit_hash = self.get_ref(candidate)
+            if commit_hash:
+                return commit_hash
+        if is_object_hash(ref):
+            obj = self._load_object(ref)
+            if obj and obj[0] == 'commit':
+                return ref
+        return None
 
     def get_current_commit(self):
         """Get the commit hash of HEAD."""
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.search import search_indexer  # noqa: E402
+from server.vcs import GitRepository  # noqa: E402
+
+
+@pytest.fixture
+def repo(tmp_path):
+    yield GitRepository.init(str(tmp_path / 'repo'))
+    # Let commits' background indexing finish before the directory goes
+    search_indexer.wait(timeout=30)
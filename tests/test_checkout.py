@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def renamed(repo):
+    """master has old.txt checked out; branch b renames it to new.txt."""
+    repo.commit('add', [{'name': 'old.txt', 'content': 'original\n'}])
+    repo.create_branch('b')
+    repo.commit('rename', [{'name': 'new.txt', 'content': 'original\n'}], branch='b')
+    repo.checkout('master')
+    return repo
+
+
+def _read(repo, path):
+    with open(os.path.join(repo.files_path, path), 'rb') as f:
+        return f.read()
+
+
+def test_checkout_renames_an_unchanged_file(renamed):
+    plan = renamed.checkout('b')
+    assert [op['op'] for op in plan['operations']] == ['rename']
+    assert _read(renamed, 'new.txt') == b'original\n'
+    assert not os.path.exists(os.path.join(renamed.files_path, 'old.txt'))
+
+
+def test_checkout_does_not_rename_a_locally_edited_file(renamed):
+    renamed.write_file('old.txt', 'LOCAL EDIT')
+    renamed.checkout('b')
+    assert _read(renamed, 'new.txt') == b'original\n'
+    assert not os.path.exists(os.path.join(renamed.files_path, 'old.txt'))
+
+
+def test_checkout_trusts_a_matching_index_entry(renamed, monkeypatch):
+    # Old enough that status records an entry which is not racily clean
+    path = os.path.join(renamed.files_path, 'old.txt')
+    past = os.stat(path).st_mtime_ns - 10 * 10**9
+    os.utime(path, ns=(past, past))
+    renamed.status()
+
+    def no_hashing(f):
+        raise AssertionError('the rename source was hashed')
+
+    monkeypatch.setattr(renamed, 'hash_blob_stream', no_hashing)
+    plan = renamed.checkout('b')
+    assert [op['op'] for op in plan['operations']] == ['rename']
+    assert _read(renamed, 'new.txt') == b'original\n'
+
+
+def test_checkout_rejects_an_invalid_branch_name(repo):
+    with pytest.raises(ValueError):
+        repo.checkout('../../escape')
+    assert not os.path.exists(os.path.join(repo.locks_path, 'escape.lock'))
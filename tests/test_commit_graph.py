@@ -0,0 +1,52 @@
+from server import bloom, commit_graph
+
+
+def _forget_cached_views():
+    commit_graph._graphs.clear()
+    bloom._filters.clear()
+
+
+def test_append_after_torn_graph_record(repo):
+    first = repo.commit('one', [{'name': 'a.txt', 'content': '1'}])
+    with open(repo.commit_graph_file, 'ab') as f:
+        f.write(b'\xab' * 30)
+    _forget_cached_views()
+
+    second = repo.commit('two', [{'name': 'a.txt', 'content': '2'}])
+    third = repo.commit('three', [{'name': 'a.txt', 'content': '2'}, {'name': 'b.txt', 'content': '3'}])
+    assert [c['hash'] for c in repo.iter_commits()] == [third, second, first]
+    assert [c['hash'] for c in repo.list_commits_page(10, path='a.txt')['items']] == [second, first]
+
+    _forget_cached_views()
+    graph = repo._commit_graph()
+    assert graph.parent_oids(third) == [second]
+    assert graph.parent_oids(second) == [first]
+
+
+def test_append_after_torn_filter_record(repo):
+    first = repo.commit('one', [{'name': 'a.txt', 'content': '1'}])
+    with open(repo.changed_path_filters_file, 'ab') as f:
+        f.write(b'\x00\x40partial')
+    _forget_cached_views()
+
+    second = repo.commit('two', [{'name': 'a.txt', 'content': '1'}, {'name': 'b.txt', 'content': '2'}])
+    third = repo.commit('three', [{'name': 'a.txt', 'content': '3'}, {'name': 'b.txt', 'content': '2'}])
+    _forget_cached_views()
+    filters = repo._changed_path_filters(repo._commit_graph())
+    assert len(filters) == 3
+    assert [c['hash'] for c in repo.list_commits_page(10, path='a.txt')['items']] == [third, first]
+    assert [c['hash'] for c in repo.list_commits_page(10, path='b.txt')['items']] == [second]
+
+
+def test_refresh_starts_over_after_the_file_is_rewritten(repo):
+    first = repo.commit('one', [{'name': 'a.txt', 'content': '1'}])
+    repo.commit('two', [{'name': 'a.txt', 'content': '2'}])
+    graph = repo._commit_graph()
+    lock = graph._lock
+    assert len(graph) == 2
+
+    with open(repo.commit_graph_file, 'r+b') as f:
+        f.truncate(len(commit_graph.HEADER) + commit_graph.RECORD.size)
+    graph.refresh()
+    assert graph.oids == [first] and graph.positions == {first: 0}
+    assert graph._lock is lock
@@ -0,0 +1,22 @@
+import os
+
+from server import fsck
+from server.search import search_indexer
+from server.vcs import GitRepository
+
+
+def test_default_repos_dir_is_next_to_the_server_package():
+    assert fsck.DEFAULT_REPOS_DIR == os.path.join(os.path.dirname(fsck.__file__), 'repos')
+
+
+def test_check_all_reports_nothing_for_a_missing_directory(tmp_path):
+    assert fsck.check_all(str(tmp_path / 'missing')) == []
+
+
+def test_check_all_checks_each_repository(tmp_path):
+    repo = GitRepository.init(str(tmp_path / '7'))
+    repo.commit('c', [{'name': 'a.txt', 'content': 'x'}])
+    search_indexer.wait(timeout=30)
+    (tmp_path / 'not-a-repo').mkdir()
+    reports = fsck.check_all(str(tmp_path), workers=1)
+    assert [(r['repo'], r['ok']) for r in reports] == [(repo.repo_path, True)]
@@ -0,0 +1,174 @@
+import json
+import os
+import time
+
+from server import gc
+from server.chunking import CHUNK_THRESHOLD
+from server.pack import list_packs
+from server.search import search_indexer
+from server.vcs import GitRepository
+
+
+def _big_content():
+    return os.urandom(CHUNK_THRESHOLD // 2).hex() + 'tail'
+
+
+def _manifest_chunks(repo, manifest_hash):
+    with repo._open_stored_object(manifest_hash) as stream:
+        return [chunk_hash for chunk_hash, _ in json.loads(stream.read())['chunks']]
+
+
+def test_mark_finds_chunks_without_opening_blobs(repo, monkeypatch):
+    commit = repo.commit('big', [{'name': 'big.txt', 'content': _big_content()},
+                                 {'name': 'small.txt', 'content': 'small'}])
+    manifest = repo._flatten_tree(repo._commit_tree(commit))['big.txt']
+    assert repo.chunk_manifests() == {manifest}
+    # The search indexer reads blobs through the same repository object
+    search_indexer.wait(timeout=30)
+
+    opened = []
+    open_stored_object = repo._open_stored_object
+
+    def recording_open(obj_hash):
+        opened.append(obj_hash)
+        return open_stored_object(obj_hash)
+
+    monkeypatch.setattr(repo, '_open_stored_object', recording_open)
+    marked = gc.mark_reachable(repo, [commit])
+    assert set(_manifest_chunks(repo, manifest)) <= marked
+    assert set(opened) <= {manifest}
+
+
+def test_sweep_keeps_chunks_of_reachable_manifests(repo):
+    content = _big_content()
+    repo.commit('big', [{'name': 'big.txt', 'content': content}])
+    stats = gc.collect_garbage(repo, grace_seconds=0)
+    assert stats['complete'] and stats['objects_removed'] == 0
+    with repo.open_object(repo._flatten_tree(repo._commit_tree(repo.get_current_commit()))['big.txt']) as stream:
+        assert stream.read() == content.encode()
+
+
+def test_manifest_list_is_rebuilt_for_older_repositories(repo):
+    commit = repo.commit('big', [{'name': 'big.txt', 'content': _big_content()}])
+    manifest = repo._flatten_tree(repo._commit_tree(commit))['big.txt']
+    os.remove(repo.chunk_manifests_file)
+    assert GitRepository(repo.repo_path).chunk_manifests() == {manifest}
+
+
+def test_marking_out_of_time_resumes_next_pass(repo, monkeypatch):
+    first = repo.commit('one', [{'name': 'a.txt', 'content': '1'}])
+    repo.commit('two', [{'name': 'a.txt', 'content': '2'}])
+    monkeypatch.setattr(gc, 'MARK_CHECK_INTERVAL', 2)
+
+    stats = gc.collect_garbage(repo, grace_seconds=0, max_seconds=0)
+    assert not stats['complete']
+    marked, commits, trees = gc._load_mark_progress(repo)
+    assert marked and (commits or trees)
+
+    resumed = []
+    mark_reachable = gc.mark_reachable
+
+    def recording_mark(repo, commits, trees=(), marked=None, deadline=None):
+        resumed.append(set(marked))
+        return mark_reachable(repo, commits, trees, marked, deadline)
+
+    monkeypatch.setattr(gc, 'mark_reachable', recording_mark)
+    stats = gc.collect_garbage(repo, grace_seconds=0)
+    assert stats['complete'] and stats['objects_removed'] == 0
+    assert resumed[0] == marked
+    assert not os.path.exists(gc._mark_path(repo))
+    assert repo._load_object(first)[0] == 'commit'
+
+
+def test_pass_moves_on_from_a_repo_it_could_not_finish(tmp_path, monkeypatch):
+    for repo_id in (1, 2, 3):
+        GitRepository.init(str(tmp_path / str(repo_id)))
+    visited = []
+
+    def budgeted_collect(repo, max_bytes=None, max_seconds=None):
+        visited.append(os.path.basename(repo.repo_path))
+        return {'complete': False}
+
+    monkeypatch.setattr(gc, 'collect_garbage', budgeted_collect)
+    collector = gc.GarbageCollector(str(tmp_path))
+    for _ in range(3):
+        collector.run_pass()
+    assert visited == ['1', '2', '3']
+
+
+def test_default_repos_dir_is_next_to_the_server_package():
+    assert gc.DEFAULT_REPOS_DIR == os.path.join(os.path.dirname(gc.__file__), 'repos')
+
+
+def _snapshot(repo, n):
+    snapshot = GitRepository.init(f'{repo.repo_path}_{n:040x}')
+    snapshot.commit('snap', [{'name': f'{n}.txt', 'content': f'snapshot {n}'}])
+    return snapshot
+
+
+def test_snapshot_import_stops_between_folders_when_out_of_time(repo, monkeypatch):
+    repo.commit('c', [{'name': 'a.txt', 'content': 'x'}])
+    for n in (1, 2):
+        _snapshot(repo, n)
+    import_snapshot = repo.import_snapshot
+
+    def slow_import(folder):
+        imported = import_snapshot(folder)
+        time.sleep(0.2)
+        return imported
+
+    monkeypatch.setattr(repo, 'import_snapshot', slow_import)
+    stats = gc.collect_garbage(repo, max_seconds=0.1)
+    assert stats['snapshots_removed'] == 1 and not stats['complete']
+    assert len(repo.snapshot_folders()) == 1
+
+    stats = gc.collect_garbage(repo)
+    assert stats['snapshots_removed'] == 1 and stats['complete']
+    assert repo.snapshot_folders() == []
+
+
+def test_orphaned_snapshot_removal_stops_at_the_byte_budget(tmp_path):
+    for n in (1, 2):
+        folder = tmp_path / f'5_{n:040x}'
+        folder.mkdir()
+        (folder / 'data').write_bytes(b'x' * 1000)
+    collector = gc.GarbageCollector(str(tmp_path), max_bytes=500)
+    totals = collector.run_pass()
+    assert totals['snapshots_removed'] == 1 and totals['bytes_freed'] == 1000
+    assert len(gc.orphaned_snapshot_folders(str(tmp_path))) == 1
+
+
+def test_complete_pass_packs_reachable_loose_objects(repo, monkeypatch):
+    commit = repo.commit('one', [{'name': 'a.txt', 'content': 'kept'}])
+    stray = repo._save_object('blob', b'not referenced anywhere')
+    monkeypatch.setattr(gc, 'GC_AUTO_PACK', 1)
+
+    stats = gc.collect_garbage(repo, grace_seconds=3600)
+    assert stats['complete'] and stats['objects_packed'] >= 3
+    assert {obj_hash for obj_hash, _ in repo._iter_loose_objects()} == {stray}
+    with repo.open_object(repo._flatten_tree(repo._commit_tree(commit))['a.txt']) as stream:
+        assert stream.read() == b'kept'
+
+
+def test_pass_folds_packs_together_past_the_limit(repo, monkeypatch):
+    repo.commit('one', [{'name': 'a.txt', 'content': '1'}])
+    repo.repack()
+    commit = repo.commit('two', [{'name': 'a.txt', 'content': '2'}])
+    repo.repack()
+    monkeypatch.setattr(gc, 'GC_MAX_PACKS', 1)
+
+    gc.collect_garbage(repo, grace_seconds=0)
+    assert len(list_packs(repo.pack_path)) == 1
+    with repo.open_object(repo._flatten_tree(repo._commit_tree(commit))['a.txt']) as stream:
+        assert stream.read() == b'2'
+
+
+def test_pass_packs_refs_past_the_limit(repo, monkeypatch):
+    commit = repo.commit('one', [{'name': 'a.txt', 'content': '1'}])
+    repo.create_branch('feature')
+    monkeypatch.setattr(gc, 'GC_PACK_REFS', 2)
+
+    stats = gc.collect_garbage(repo, grace_seconds=0)
+    assert stats['refs_packed'] == 2
+    assert gc._loose_ref_count(repo) == 0
+    assert repo.list_refs() == {'refs/heads/master': commit, 'refs/heads/feature': commit}
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def _pages(repo, limit, path=None):
+    hashes = []
+    before = None
+    while True:
+        page = repo.list_commits_page(limit, before=before, path=path)
+        hashes.extend(item['hash'] for item in page['items'])
+        before = page['next_cursor']
+        if before is None:
+            return hashes
+
+
+@pytest.fixture
+def merged(repo, monkeypatch):
+    """C <- side (on branch side), C <- A, M = merge(A, side), with distinct timestamps."""
+    ticks = iter(range(100))
+
+    class Clock(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime(2024, 1, 1) + timedelta(minutes=next(ticks))
+
+    monkeypatch.setattr('server.vcs.datetime', Clock)
+    c = repo.commit('C', [{'name': 'a.txt', 'content': 'base\n'}])
+    repo.create_branch('side')
+    b = repo.commit('side', [{'name': 'a.txt', 'content': 'base\n'}, {'name': 'dir/b.txt', 'content': 'side\n'}],
+                    branch='side')
+    a = repo.commit('A', [{'name': 'a.txt', 'content': 'changed\n'}, {'name': 'dir/c.txt', 'content': 'A\n'}])
+    result = repo.merge('side')
+    assert result['status'] == 'merged'
+    return c, b, a, result['commit']
+
+
+def test_paging_keeps_the_other_side_of_a_merge(repo, merged):
+    c, b, a, m = merged
+    assert [commit['hash'] for commit in repo.iter_commits()] == [m, a, b, c]
+    for limit in (1, 2, 3):
+        assert _pages(repo, limit) == [m, a, b, c]
+
+
+def test_path_paging_keeps_the_other_side_of_a_merge(repo, merged):
+    c, b, a, m = merged
+    # The merge combines both sides' files under dir, so it changed dir too
+    assert _pages(repo, 1, path='dir') == [m, a, b]
+    assert _pages(repo, 1, path='a.txt') == [a, c]
+
+
+def test_cursor_outside_the_branch_continues_from_its_parents(repo, merged):
+    c, b, a, m = merged
+    page = repo.list_commits_page(10, before=a, ref='side')
+    assert [item['hash'] for item in page['items']] == [c]
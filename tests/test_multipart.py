@@ -0,0 +1,42 @@
+import io
+import os
+
+import pytest
+
+from server.chunking import CHUNK_THRESHOLD
+from server.multipart import MultipartReader
+
+
+def _body(*parts):
+    body = b''
+    for headers, data in parts:
+        body += b'--XX\r\nContent-Disposition: form-data; ' + headers + b'\r\n\r\n' + data + b'\r\n'
+    return body + b'--XX--\r\n'
+
+
+def test_parts_are_read_in_order_and_unread_data_is_skipped():
+    body = _body((b'name="message"', b'hello'),
+                 (b'name="unused"', b'x' * 100000),
+                 (b'name="f"; filename="dir/a.txt"', b'contents'))
+    seen = []
+    for part in MultipartReader(io.BytesIO(body), 'XX'):
+        if part.name != 'unused':
+            seen.append((part.name, part.filename, part.read()))
+    assert seen == [('message', None, b'hello'), ('f', 'dir/a.txt', b'contents')]
+
+
+def test_file_part_streams_into_a_chunked_blob(repo):
+    content = os.urandom(CHUNK_THRESHOLD * 2)
+    body = _body((b'name="f"; filename="big.bin"', content))
+    for part in MultipartReader(io.BytesIO(body), 'XX'):
+        blob = repo.write_blob_stream(part)
+        assert part.size == len(content)
+    with repo.open_object(blob) as stream:
+        assert stream.read() == content
+
+
+def test_truncated_body_raises_value_error():
+    body = _body((b'name="f"; filename="a.txt"', b'y' * 10000))
+    with pytest.raises(ValueError):
+        for part in MultipartReader(io.BytesIO(body[:5000]), 'XX'):
+            part.read()
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from server import pack
+from server.pack import PackFile, write_pack
+
+
+def _text(seed, lines=400):
+    return ''.join(f'line {seed}-{i} of some source file\n' for i in range(lines)).encode()
+
+
+def _objects(payloads):
+    return [(pack.hashlib.sha1(b'blob ' + data).hexdigest(), 'blob', data) for data in payloads]
+
+
+@pytest.fixture
+def delta_calls(monkeypatch):
+    calls = []
+    create_delta = pack.create_delta
+
+    def counting_create_delta(base, target):
+        calls.append(len(target))
+        return create_delta(base, target)
+
+    monkeypatch.setattr(pack, 'create_delta', counting_create_delta)
+    return calls
+
+
+def _write(tmp_path, objects, **kwargs):
+    data = {oid: payload for oid, _, payload in objects}
+    loads = []
+
+    def load(oid):
+        loads.append(oid)
+        return data[oid]
+
+    base = write_pack(str(tmp_path), [(oid, t, len(payload)) for oid, t, payload in objects], load, **kwargs)
+    packed = PackFile(base)
+    try:
+        for oid, obj_type, payload in objects:
+            assert packed.read(oid) == (obj_type, payload)
+            assert packed.object_type(oid) == obj_type
+    finally:
+        packed.close()
+    assert sorted(loads) == sorted(data)
+    return base
+
+
+def test_similar_objects_are_deltified(tmp_path, delta_calls):
+    original = _text('a')
+    edited = original.replace(b'line a-7 ', b'LINE a-7 ') + b'one more line\n'
+    base = _write(tmp_path, _objects([original, edited]))
+    assert delta_calls
+    assert os.path.getsize(base + '.pack') < len(original)
+
+
+def test_incompressible_objects_are_not_diffed(tmp_path, delta_calls):
+    _write(tmp_path, _objects([os.urandom(64 * 1024) for _ in range(4)]))
+    assert delta_calls == []
+
+
+def test_dissimilar_objects_are_not_diffed(tmp_path, delta_calls):
+    _write(tmp_path, _objects([_text(seed) for seed in 'abcd']))
+    assert delta_calls == []
+
+
+def test_delta_search_stops_at_its_deadline(tmp_path, delta_calls):
+    original = _text('a')
+    _write(tmp_path, _objects([original, original + b'more\n']), max_delta_seconds=0)
+    assert delta_calls == []
+
+
+def test_repack_round_trips_loose_and_packed_objects(repo):
+    commits = []
+    content = _text('x').decode()
+    for i in range(3):
+        content += f'change {i}\n'
+        commits.append(repo.commit(f'c{i}', [{'name': 'a.txt', 'content': content},
+                                             {'name': 'random.bin', 'content': os.urandom(2048).hex()}]))
+    assert repo.repack() > 0
+    repo.commit('c3', [{'name': 'a.txt', 'content': content + 'last\n'}])
+    assert repo.repack(full=True) > 0
+    assert list(repo._iter_loose_objects()) == []
+    assert len(repo._get_packs()) == 1
+    with repo.open_object(repo._flatten_tree(repo._commit_tree(commits[-1]))['a.txt']) as stream:
+        assert stream.read() == content.encode()
+
+
+def test_load_object_falls_back_to_packs_when_a_loose_copy_vanishes(repo, monkeypatch):
+    commit = repo.commit('c', [{'name': 'a.txt', 'content': 'x'}])
+    repo.repack()
+    # As if the loose copy was seen just before repack removed it
+    monkeypatch.setattr('server.vcs.os.path.exists', lambda path: True)
+    assert repo._load_object(commit)[0] == 'commit'
@@ -0,0 +1,16 @@
+from server import reflog
+
+
+def test_append_after_torn_record(tmp_path):
+    path = str(tmp_path / 'logs' / 'refs' / 'heads' / 'master')
+    reflog.append_entry(path, None, 'a' * 40, 'first', timestamp=1.0)
+    with open(path, 'ab') as f:
+        f.write(b'\x01' * 50)
+    reflog.append_entry(path, 'a' * 40, 'b' * 40, 'second', timestamp=2.0)
+
+    entries = reflog.read_entries(path)
+    assert [(e['timestamp'], e['old'], e['new'], e['message']) for e in entries] == [
+        (2.0, 'a' * 40, 'b' * 40, 'second'),
+        (1.0, None, 'a' * 40, 'first'),
+    ]
+    assert reflog.read_entries(path, since=1.5) == entries[:1]
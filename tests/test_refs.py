@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from server.vcs import is_object_hash, is_valid_ref_name
+
+
+def test_ref_names():
+    assert is_valid_ref_name('refs/heads/master')
+    assert is_valid_ref_name('refs/tags/v1.0')
+    assert is_valid_ref_name('refs/heads/feature/x')
+    for name in ['HEAD', 'refs/../files/ptr', 'refs/heads/../../x', 'refs/heads/', 'refs/heads/a//b',
+                 '/etc/passwd', 'refs/heads/a\\b', 'refs/heads/x.lock', 'refs/remotes/x']:
+        assert not is_valid_ref_name(name), name
+
+
+def test_object_hashes():
+    assert is_object_hash('a' * 40)
+    for value in ['A' * 40, 'a' * 39, 'xx/etc/passwd', '../' + 'a' * 37, None]:
+        assert not is_object_hash(value)
+
+
+def test_refs_and_hashes_cannot_escape_the_repository(repo):
+    repo.commit('c', [{'name': 'a.txt', 'content': 'x'}])
+    with open(os.path.join(repo.files_path, 'ptr'), 'w') as f:
+        f.write('0' * 40)
+    for ref in ['refs/../files/ptr', 'refs/heads/../../files/ptr', 'xx/etc/passwd', '/etc/passwd']:
+        assert repo.resolve_commit(ref) is None
+        assert repo.open_object(ref) is None
+        assert repo._load_object(ref) is None
+
+
+def test_invalid_branch_names_are_rejected(repo):
+    repo.commit('c', [{'name': 'a.txt', 'content': 'x'}])
+    for name in ['../x', 'a/../../b', '', 'x.lock']:
+        with pytest.raises(ValueError):
+            repo.create_branch(name)
+    repo.create_branch('feature/x')
+    assert [b['name'] for b in repo.list_branches()] == ['feature/x', 'master']
+
+
+def test_reflog_path_must_be_a_ref(repo):
+    repo.commit('c', [{'name': 'a.txt', 'content': 'x'}])
+    assert len(repo.get_reflog('refs/heads/master')) == 1
+    assert repo.get_reflog('HEAD') == []
+    with pytest.raises(ValueError):
+        repo.get_reflog('refs/../../../../etc/passwd')
+
+
+@pytest.mark.parametrize('name', ['../evil.txt', 'a/../../evil.txt', 'a/..', 'nul\0.txt'])
+def test_commit_rejects_paths_leaving_the_tree(repo, name):
+    first = repo.commit('c', [{'name': 'a.txt', 'content': 'x'}])
+    with pytest.raises(ValueError):
+        repo.commit('evil', [{'name': 'a.txt', 'content': 'x'}, {'name': name, 'content': 'y'}])
+    with pytest.raises(ValueError):
+        repo.commit_blobs('evil', {name: repo._save_blob(b'y')})
+    assert repo.get_current_commit() == first
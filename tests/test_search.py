@@ -0,0 +1,47 @@
+import logging
+import os
+
+from server import search
+from server.search import SearchIndex, search_indexer
+
+
+def test_commit_indexes_in_background(repo):
+    commit = repo.commit('first', [{'name': 'a.txt', 'content': 'needle in a haystack\n'}])
+    assert search_indexer.wait(timeout=30)
+    conn = SearchIndex(repo)._connect()
+    try:
+        heads = dict(conn.execute('SELECT ref, tree FROM heads'))
+    finally:
+        conn.close()
+    assert heads == {'refs/heads/master': repo._commit_tree(commit)}
+
+
+def test_commit_stands_when_indexing_fails(repo, monkeypatch, caplog):
+    def broken_update(self):
+        raise ValueError('corrupt tree')
+
+    monkeypatch.setattr(SearchIndex, 'update', broken_update)
+    with caplog.at_level(logging.ERROR, logger=search.__name__):
+        commit = repo.commit('first', [{'name': 'a.txt', 'content': 'hello\n'}])
+        assert search_indexer.wait(timeout=30)
+    assert repo.get_ref('refs/heads/master') == commit
+    assert 'corrupt tree' in caplog.text
+
+
+def test_search_reads_blobs_of_a_removed_shard(repo):
+    repo.commit('first', [{'name': 'a.txt', 'content': 'needle one\n'}])
+    search_indexer.wait(timeout=30)
+    repo.commit('second', [{'name': 'a.txt', 'content': 'needle one\n'},
+                           {'name': 'b.txt', 'content': 'needle two\n'}])
+    search_indexer.wait(timeout=30)
+    index = SearchIndex(repo)
+    conn = index._connect()
+    try:
+        shard_ids = [shard_id for shard_id, in conn.execute('SELECT id FROM shards ORDER BY id')]
+    finally:
+        conn.close()
+    assert len(shard_ids) == 2
+    # As if a compaction replaced the shard between reading its id and opening it
+    os.remove(index._shard_path(shard_ids[0]))
+    results = index.search(repo._commit_tree(repo.get_ref('refs/heads/master')), 'needle')
+    assert [r['path'] for r in results] == ['a.txt', 'b.txt']
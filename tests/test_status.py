@@ -0,0 +1,51 @@
+import io
+import os
+
+from server.chunking import CHUNK_THRESHOLD
+from server.index import read_index
+
+
+def test_status_hashes_large_files_like_write_blob_stream(repo):
+    content = os.urandom(CHUNK_THRESHOLD // 2).hex().encode() + b'tail'
+    assert len(content) > CHUNK_THRESHOLD
+    commit = repo.commit('big', [{'name': 'big.bin', 'content': content.decode()}])
+    repo.write_file('big.bin', content)
+
+    assert repo.hash_blob_stream(io.BytesIO(content)) == repo.write_blob_stream(io.BytesIO(content))
+    status = repo.status()
+    assert status['commit'] == commit
+    assert status['modified'] == status['added'] == status['deleted'] == []
+
+    with open(os.path.join(repo.files_path, 'big.bin'), 'ab') as f:
+        f.write(b'more')
+    assert repo.status()['modified'] == ['big.bin']
+
+
+def test_read_index_returns_the_index_files_own_mtime(repo):
+    repo.write_file('a.txt', 'a')
+    path = os.path.join(repo.files_path, 'a.txt')
+    past = os.stat(path).st_mtime_ns - 10 * 10**9
+    os.utime(path, ns=(past, past))
+    repo.status()
+
+    entries, index_mtime_ns = read_index(repo.index_file)
+    assert entries['a.txt'].mtime_ns == past
+    assert index_mtime_ns == os.stat(repo.index_file).st_mtime_ns
+
+
+def test_status_compares_unchanged_large_files_instead_of_rechunking(repo, monkeypatch):
+    content = os.urandom(CHUNK_THRESHOLD // 2).hex().encode() + b'tail'
+    repo.commit('big', [{'name': 'big.bin', 'content': content.decode()}])
+    repo.write_file('big.bin', content)
+
+    def no_hashing(stream):
+        raise AssertionError('large file was rechunked')
+
+    monkeypatch.setattr(repo, 'hash_blob_stream', no_hashing)
+    assert repo.status()['modified'] == []
+
+    monkeypatch.undo()
+    with open(os.path.join(repo.files_path, 'big.bin'), 'r+b') as f:
+        f.seek(len(content) // 2)
+        f.write(b'x')
+    assert repo.status()['modified'] == ['big.bin']